@@ -0,0 +1,221 @@
+"""
+Code to process many LabVIEW loop files without the gui.
+The operations are the same used by the dialogs (see hyloa.data.core)
+and every file is processed in a separate worker process.
+The chain of operations applied to a file in the gui can be exported
+(see hyloa.data.provenance) and replayed on other files.
+
+Example:
+
+::
+
+    hyloa-batch data/*.txt -o processed/ --steps close norm -j 8
+    hyloa-batch data/*.txt -o processed/ --replay operazioni.json
+    hyloa-batch data/*.txt -o processed/ --pipeline pipeline.yaml
+"""
+import os
+import sys
+import glob
+import logging
+import argparse
+from concurrent.futures import ProcessPoolExecutor, as_completed
+
+import pandas as pd
+
+from hyloa.data.labview import read_labview_file, write_labview_file, DEFAULT_FMT
+from hyloa.data.pipeline import Pipeline
+from hyloa.utils.queue_logging import setup_logging, stop_logging, pool_logging
+
+
+logger = logging.getLogger(__name__)
+
+# Columns of the increasing and decreasing branches in the standard LabVIEW file
+DEFAULT_COLUMNS = ["UpRot", "DwRot", "UpEllipt", "DwEllipt"]
+
+# Operations that can be applied to the pairs of columns, see hyloa.data.pipeline
+STEPS = ("norm", "close", "invert")
+
+#==============================================================================================#
+# Processing                                                                                   #
+#==============================================================================================#
+
+def process_file(file_path, output_dir, pipeline, fmt=DEFAULT_FMT):
+    '''
+    Apply a pipeline to a file and save the result.
+    Only the columns modified by the pipeline are written back in the data.
+
+    Parameters
+    ----------
+    file_path : str
+        path of the file to process
+    output_dir : str
+        directory where the processed file is saved, with the same name
+    pipeline : Pipeline
+        operations to apply, the columns are named as in the file
+    fmt : str, optional
+        printf-style format of the numbers in the saved file
+
+    Returns
+    -------
+    out_path : str
+        path of the saved file
+    fit_rows : list of dict
+        results of the fits of the pipeline
+    '''
+    header, data = read_labview_file(file_path)
+    names = header.columns
+
+    columns  = {name: data[:, i] for i, name in enumerate(names)}
+    fit_rows = pipeline.run(columns)
+    for name in pipeline.modified_columns():
+        data[:, names.index(name)] = columns[name]
+
+    out_path = os.path.join(output_dir, os.path.basename(file_path))
+    write_labview_file(out_path, header, data, fmt)
+
+    return out_path, fit_rows
+
+
+def run_pipeline(file_paths, output_dir, pipeline, fmt=DEFAULT_FMT, jobs=None):
+    '''
+    Apply a pipeline to all files using a pool of worker processes.
+    The results of the fits, if any, are saved in fit_table.csv
+    in the output directory.
+
+    Parameters
+    ----------
+    file_paths : list of str
+        files to process
+    output_dir : str
+        directory where the processed files are saved
+    pipeline : Pipeline
+        operations to apply
+    fmt : str, optional
+        printf-style format of the numbers in the saved files
+    jobs : int or None, optional
+        number of worker processes, default is the number of cores
+
+    Returns
+    -------
+    failed : dict
+        {file_path : error message} for the files that could not be processed
+    '''
+    os.makedirs(output_dir, exist_ok=True)
+    failed, fit_rows = {}, {}
+
+    # The records of the workers (e.g. the warnings of the pipeline) go to the same log
+    with ProcessPoolExecutor(max_workers=jobs, **pool_logging()) as pool:
+        futures = {
+            pool.submit(process_file, path, output_dir, pipeline, fmt): path
+            for path in file_paths
+        }
+        for future in as_completed(futures):
+            path = futures[future]
+            try:
+                out_path, fit_rows[path] = future.result()
+                logger.info(f"File {path} elaborato, salvato in {out_path}")
+            except Exception as e:
+                failed[path] = str(e)
+                logger.error(f"Errore durante l'elaborazione di {path}: {e}")
+
+    rows = [
+        {"filename": os.path.basename(path), **row}
+        for path in file_paths if path in fit_rows
+        for row in fit_rows[path]
+    ]
+    if rows:
+        table_path = os.path.join(output_dir, "fit_table.csv")
+        pd.DataFrame(rows).to_csv(table_path, index=False)
+        logger.info(f"Risultati dei fit salvati in {table_path}")
+
+    return failed
+
+
+def run_batch(file_paths, output_dir, columns=DEFAULT_COLUMNS, steps=("close", "norm"),
+              window=5, fmt=DEFAULT_FMT, jobs=None):
+    '''
+    Apply the same operations to the same pairs of columns of all files,
+    using a pool of worker processes.
+
+    Parameters
+    ----------
+    file_paths : list of str
+        files to process
+    output_dir : str
+        directory where the processed files are saved
+    columns : list of str, optional
+        names of the columns to process, in pairs
+    steps : sequence of str, optional
+        operations to apply in order, default close and then norm
+    window : int, optional
+        number of points used for the averages of the normalization, default 5
+    fmt : str, optional
+        printf-style format of the numbers in the saved files
+    jobs : int or None, optional
+        number of worker processes, default is the number of cores
+
+    Returns
+    -------
+    failed : dict
+        {file_path : error message} for the files that could not be processed
+    '''
+    unknown = [s for s in steps if s not in STEPS]
+    if unknown:
+        raise ValueError(f"Operazioni sconosciute: {unknown}")
+
+    pipeline = Pipeline.from_names(steps, columns, window)
+    return run_pipeline(file_paths, output_dir, pipeline, fmt, jobs)
+
+#==============================================================================================#
+# Command line interface                                                                       #
+#==============================================================================================#
+
+def main(argv=None):
+    ''' Entry point of the hyloa-batch command
+    '''
+    parser = argparse.ArgumentParser(
+        prog="hyloa-batch",
+        description="Elaborazione senza interfaccia grafica di file di cicli di isteresi."
+    )
+    parser.add_argument("files", nargs="+",
+                        help="file da elaborare (sono accettati anche pattern come data/*.txt)")
+    parser.add_argument("-o", "--output-dir", required=True,
+                        help="cartella dove salvare i file elaborati")
+    parser.add_argument("-c", "--columns", nargs="+", default=DEFAULT_COLUMNS,
+                        help="colonne da elaborare, a coppie ramo up ramo down")
+    parser.add_argument("-s", "--steps", nargs="+", default=["close", "norm"], choices=list(STEPS),
+                        help="operazioni da applicare in ordine")
+    parser.add_argument("-p", "--pipeline", "-r", "--replay", dest="pipeline", default=None,
+                        help="file JSON o YAML con la pipeline da applicare, anche esportata "
+                             "dalla gui, al posto di --steps e --columns")
+    parser.add_argument("-w", "--window", type=int, default=5,
+                        help="punti agli estremi dei rami usati per la normalizzazione")
+    parser.add_argument("-f", "--fmt", default=DEFAULT_FMT,
+                        help="formato dei numeri nei file salvati, default %%.6E")
+    parser.add_argument("-j", "--jobs", type=int, default=None,
+                        help="numero di processi, default numero di core")
+    parser.add_argument("--log", default=None,
+                        help="file di log, default sullo standard error")
+    parser.add_argument("--log-json", default=None,
+                        help="file dove scrivere il log anche in formato JSON, una riga per messaggio")
+    args = parser.parse_args(argv)
+
+    setup_logging(args.log, json_file=args.log_json)
+
+    file_paths = []
+    for pattern in args.files:
+        file_paths.extend(sorted(glob.glob(pattern)) or [pattern])
+
+    if args.pipeline:
+        failed = run_pipeline(file_paths, args.output_dir, Pipeline.load(args.pipeline),
+                              args.fmt, args.jobs)
+    else:
+        failed = run_batch(file_paths, args.output_dir, args.columns, args.steps,
+                           args.window, args.fmt, args.jobs)
+
+    logger.info(f"Elaborati {len(file_paths) - len(failed)} file su {len(file_paths)}.")
+    stop_logging()
+    return 1 if failed else 0
+
+if __name__ == "__main__":
+    sys.exit(main())
@@ -0,0 +1,197 @@
+"""
+Code to compute the quantities that characterize a hysteresis loop:
+coercive fields, remanence, saturation, area, exchange bias and squareness.
+Everything is computed on stacks of loops, so all the loops of all the
+files with the same number of points are analyzed in a single pass.
+Nothing here depends on Qt.
+"""
+import numpy as np
+import pandas as pd
+
+
+# Quantities computed for each loop, in the order of the columns of the table
+LOOP_QUANTITIES = [
+    "Hc", "Hc_up", "Hc_dw", "H_eb", "Mr", "Mr_up", "Mr_dw", "Ms", "area", "squareness"
+]
+
+
+def zero_crossing(a, b):
+    '''
+    Value of b where a crosses zero, by linear interpolation between
+    the two points around the crossing. If a crosses zero many times
+    (e.g. noise around zero) the steepest crossing is used.
+
+    Parameters
+    ----------
+    a, b : 2darray
+        data with shape (n_loops, n_points)
+
+    Returns
+    -------
+    1darray
+        value of b at the crossing for each loop, nan if a never crosses zero
+    '''
+    a = np.asarray(a, dtype=float)
+    b = np.asarray(b, dtype=float)
+
+    sign   = np.signbit(a)
+    change = sign[:, 1:] != sign[:, :-1]
+    step   = np.abs(np.diff(a, axis=1))
+
+    i    = np.argmax(np.where(change, step, -1.0), axis=1)
+    rows = np.arange(a.shape[0])
+
+    a0, a1 = a[rows, i], a[rows, i + 1]
+    b0, b1 = b[rows, i], b[rows, i + 1]
+
+    with np.errstate(divide="ignore", invalid="ignore"):
+        crossing = b0 + a0 / (a0 - a1) * (b1 - b0)
+
+    return np.where(change.any(axis=1), crossing, np.nan)
+
+
+def branch_area(h, m):
+    '''
+    Integral of m in dh along a branch, with the trapezoidal rule.
+    The sign follows the direction of the sweep.
+
+    Parameters
+    ----------
+    h, m : 2darray
+        field and magnetization, shape (n_loops, n_points)
+
+    Returns
+    -------
+    1darray
+        integral for each loop
+    '''
+    return np.sum(0.5 * (m[:, 1:] + m[:, :-1]) * np.diff(h, axis=1), axis=1)
+
+
+def loop_figures(h_up, m_up, h_dw, m_dw, saturation_fraction=0.05):
+    '''
+    Compute the figures of merit of a stack of loops.
+
+    The magnetization is measured from the center of the loop, i.e.
+    the mean of the two saturations, so that the results do not depend
+    on a vertical offset of the data.
+
+    - Hc_up, Hc_dw : fields where the branches cross M = 0
+    - Hc : coercive field, half of the distance between Hc_up and Hc_dw
+    - H_eb : exchange bias, center of Hc_up and Hc_dw
+    - Mr_up, Mr_dw : magnetization of the branches at H = 0
+    - Mr : remanence, half of the distance between Mr_up and Mr_dw
+    - Ms : saturation, half of the distance between the average
+      magnetization at the highest and at the lowest fields
+    - area : area enclosed by the loop, i.e. the absolute value of the
+      integral of M dH along the closed loop
+    - squareness : Mr / Ms
+
+    Parameters
+    ----------
+    h_up, m_up : 1darray or 2darray
+        field and magnetization of the increasing branch,
+        one loop or a stack with shape (n_loops, n_points)
+    h_dw, m_dw : 1darray or 2darray
+        the same for the decreasing branch
+    saturation_fraction : float, optional
+        fraction of the field span, at each end, whose points are
+        averaged to compute the saturation, default 0.05
+
+    Returns
+    -------
+    dict
+        {quantity : 1darray with one value for each loop}, see LOOP_QUANTITIES
+    '''
+    h_up, m_up, h_dw, m_dw = (np.atleast_2d(np.asarray(v, dtype=float))
+                              for v in (h_up, m_up, h_dw, m_dw))
+
+    # Saturation from the points at the ends of the field range of both branches
+    h      = np.concatenate([h_up, h_dw], axis=1)
+    m      = np.concatenate([m_up, m_dw], axis=1)
+    h_max  = h.max(axis=1, keepdims=True)
+    h_min  = h.min(axis=1, keepdims=True)
+    tol    = saturation_fraction * (h_max - h_min)
+    high   = h >= h_max - tol
+    low    = h <= h_min + tol
+    m_high = (m * high).sum(axis=1) / high.sum(axis=1)
+    m_low  = (m * low).sum(axis=1) / low.sum(axis=1)
+    ms     = np.abs(m_high - m_low) / 2
+
+    # M is measured from the center of the loop, so a vertical offset does not matter
+    center = ((m_high + m_low) / 2)[:, None]
+
+    hc_up = zero_crossing(m_up - center, h_up)
+    hc_dw = zero_crossing(m_dw - center, h_dw)
+    mr_up = zero_crossing(h_up, m_up - center)
+    mr_dw = zero_crossing(h_dw, m_dw - center)
+
+    mr = np.abs(mr_dw - mr_up) / 2
+
+    with np.errstate(divide="ignore", invalid="ignore"):
+        squareness = mr / ms
+
+    return {
+        "Hc"         : np.abs(hc_up - hc_dw) / 2,
+        "Hc_up"      : hc_up,
+        "Hc_dw"      : hc_dw,
+        "H_eb"       : (hc_up + hc_dw) / 2,
+        "Mr"         : mr,
+        "Mr_up"      : mr_up,
+        "Mr_dw"      : mr_dw,
+        "Ms"         : ms,
+        "area"       : np.abs(branch_area(h_up, m_up) + branch_area(h_dw, m_dw)),
+        "squareness" : squareness,
+    }
+
+
+def analyze_dataframes(dataframes, loops, saturation_fraction=0.05):
+    '''
+    Compute the figures of merit of many loops of many files.
+    The loops of the files with the same number of points are
+    stacked and analyzed together with a single call of loop_figures.
+
+    Parameters
+    ----------
+    dataframes : list of pandas.DataFrame
+        loaded files
+    loops : list of tuple
+        loops to analyze, each as (file index, (h_up, m_up, h_dw, m_dw))
+        with the names of the four columns
+    saturation_fraction : float, optional
+        see loop_figures
+
+    Returns
+    -------
+    pandas.DataFrame
+        one row for each loop, in the same order, with file, filename,
+        the four columns and the quantities of LOOP_QUANTITIES
+    '''
+    # Group the loops by number of points
+    groups = {}
+    for k, (idx, columns) in enumerate(loops):
+        groups.setdefault(len(dataframes[idx]), []).append(k)
+
+    results = [None] * len(loops)
+    for members in groups.values():
+        stacks = [
+            np.array([dataframes[loops[k][0]][loops[k][1][j]].to_numpy() for k in members])
+            for j in range(4)
+        ]
+        figures = loop_figures(*stacks, saturation_fraction=saturation_fraction)
+        for n, k in enumerate(members):
+            results[k] = {name: float(values[n]) for name, values in figures.items()}
+
+    rows = []
+    for (idx, (h_up, m_up, h_dw, m_dw)), figures in zip(loops, results):
+        rows.append({
+            "file"     : idx + 1,
+            "filename" : dataframes[idx].attrs.get("filename", ""),
+            "H_up"     : h_up,
+            "M_up"     : m_up,
+            "H_dw"     : h_dw,
+            "M_dw"     : m_dw,
+            **figures,
+        })
+
+    return pd.DataFrame(rows)
@@ -0,0 +1,583 @@
+"""
+Code for the automatic saving of the session.
+The state is kept in two files next to the log: a snapshot, i.e. a
+normal session archive (see hyloa.data.session), and an append-only
+journal with the changes made after the snapshot. Each change writes
+only the modified columns (or a whole file, if it is new or replaced)
+and, when it changes, the small state of plots and fits.
+When the journal grows too much it is compacted in a new snapshot,
+written by a background thread while a new journal collects the next
+changes; the new journal starts with a "continue" entry, so until the
+new snapshot is in place the recovery replays both journals. When a
+session archive is opened the snapshot is just a link to (or a copy of)
+that archive, so nothing is rewritten.
+After a crash the session is recovered by reading the snapshot
+and replaying the journal.
+
+Each entry of the journal is made by two little endian unsigned 64 bit
+integers, the lengths of the JSON header and of the payload, followed by
+the header and by the raw float64 data of the columns listed in it.
+"""
+import os
+import copy
+import json
+import glob
+import shutil
+import struct
+import zipfile
+import numpy as np
+import pandas as pd
+from concurrent.futures import ThreadPoolExecutor
+
+from hyloa.data.labview import LabviewHeader, parse_metadata
+from hyloa.data.provenance import set_source_columns, source_name
+from hyloa.data.session import (
+    SESSION_EXT, collect_session_data, collect_plot_state,
+    write_session_archive, read_session_archive, _json_default
+)
+
+
+AUTOSAVE_INTERVAL  = 30000              # Milliseconds between two periodic flushes
+MIN_COMPACT_SIZE   = 16 * 1024**2       # The journal is never compacted below this size
+MAX_ENTRIES        = 1000               # ... unless it has more entries than this
+
+_ENTRY_HEADER = struct.Struct("<QQ")
+
+
+def autosave_base(logger_path):
+    '''
+    Base path of the autosave files of the session using a log file.
+
+    Parameters
+    ----------
+    logger_path : str
+        path of the log file
+
+    Returns
+    -------
+    str
+        base path, without extension
+    '''
+    return os.path.splitext(logger_path)[0] + ".autosave"
+
+
+def snapshot_path(base_path):
+    ''' Path of the snapshot of an autosave
+    '''
+    return base_path + ".snapshot" + SESSION_EXT
+
+
+def journal_path(base_path, generation):
+    ''' Path of the journal written after the snapshot of a given generation
+    '''
+    return f"{base_path}.journal.{generation}"
+
+
+def has_autosave(base_path):
+    ''' True if there is something to recover
+    '''
+    return os.path.exists(snapshot_path(base_path))
+
+
+def archive_generation(file_path):
+    ''' Generation written in the manifest of a snapshot, 0 for a normal session
+    '''
+    with zipfile.ZipFile(file_path, "r") as zf:
+        return json.loads(zf.read("manifest.json")).get("generation", 0)
+
+
+def journal_chain(base_path, generation):
+    '''
+    Journals to replay after the snapshot of a generation: its own journal
+    and the following ones started while a new snapshot was being written,
+    recognized by their first "continue" entry.
+
+    Parameters
+    ----------
+    base_path : str
+        base path of the files, see autosave_base
+    generation : int
+        generation of the snapshot
+
+    Returns
+    -------
+    list of int
+        generations of the journals, in order
+    '''
+    chain = [generation] if os.path.exists(journal_path(base_path, generation)) else []
+    while True:
+        following = journal_path(base_path, generation + 1)
+        if not os.path.exists(following):
+            return chain
+        first = next(read_journal(following), None)
+        if first is None or first[0] != {"kind": "continue", "generation": generation}:
+            return chain
+        generation += 1
+        chain.append(generation)
+
+#==============================================================================================#
+# Writing                                                                                      #
+#==============================================================================================#
+
+class SessionJournal:
+    '''
+    Journal of the changes to the session of the application.
+
+    Parameters
+    ----------
+    base_path : str
+        base path of the files, see autosave_base
+    on_change : callable, optional
+        called without arguments each time a column is marked as
+        changed, e.g. to schedule a flush
+    '''
+
+    def __init__(self, base_path, on_change=None):
+        self.base_path  = base_path
+        self.on_change  = on_change
+        self.executor   = ThreadPoolExecutor(max_workers=1)
+        self.pending    = None      # Future of the snapshot being written
+        self.generation = 0
+        self.file       = None
+        self.entries    = 0         # Entries written after the last snapshot
+        self.size       = 0         # Size of the journal in bytes
+        self.snap_size  = 0         # Size of the last snapshot in bytes
+        self.known      = []        # DataFrames as they are in the snapshot + journal
+        self.dirty      = {}        # {id(df) : (df, set of column names)}
+        self.last_state = None      # JSON of the last state written
+
+    def mark(self, df, columns):
+        '''
+        Record that some columns of a DataFrame have been changed.
+
+        Parameters
+        ----------
+        df : pandas dataframe
+            modified dataframe
+        columns : iterable of str
+            names of the modified columns
+        '''
+        self.dirty.setdefault(id(df), (df, set()))[1].update(columns)
+        if self.on_change is not None:
+            self.on_change()
+
+    def start(self, app_instance, seed=None, resume=False):
+        '''
+        Start the autosave of the session: the snapshot is written in the
+        background and a new journal collects the changes meanwhile.
+
+        Parameters
+        ----------
+        app_instance : MainApp
+            application to save
+        seed : str, optional
+            session archive just loaded, whose content is the whole session:
+            it becomes the snapshot, with a link or a copy of the file
+        resume : bool, optional
+            if True the files on disk hold the session just recovered from
+            them (see recover) and are kept until the new snapshot is ready
+        '''
+        self.wait()
+        if resume and has_autosave(self.base_path):
+            generation = archive_generation(snapshot_path(self.base_path))
+            chain      = journal_chain(self.base_path, generation)
+            self.generation = chain[-1] if chain else generation
+            self.compact(app_instance)
+            return
+
+        remove_autosave(self.base_path)
+        if seed is None:
+            self.generation = 0
+            self.compact(app_instance)
+            return
+
+        self.generation = archive_generation(seed)
+        self.open_journal(app_instance)
+        self.pending = self.executor.submit(link_snapshot, seed, snapshot_path(self.base_path))
+
+    def open_journal(self, app_instance, previous=None):
+        '''
+        Start the journal of the current generation, with the session
+        as it is now as reference.
+
+        Parameters
+        ----------
+        app_instance : MainApp
+            application to save
+        previous : int, optional
+            generation of the journal this one continues, see journal_chain
+        '''
+        if self.file is not None:
+            self.file.close()
+        self.file    = open(journal_path(self.base_path, self.generation), "wb")
+        self.entries = 0
+        self.size    = 0
+        if previous is not None:
+            self.write_entry({"kind": "continue", "generation": previous})
+
+        self.known      = list(app_instance.dataframes)
+        self.dirty      = {}
+        self.last_state = self.state_json(app_instance)
+
+    def compact(self, app_instance):
+        '''
+        Write a new snapshot with all the session in a background thread
+        and start a new journal. The data are taken from shallow copies
+        of the dataframes (the columns are never modified in place) and
+        the small state is copied, so the gui and the shell can keep
+        working on the session meanwhile. The snapshot
+        is replaced atomically and carries its generation, the old
+        journals are removed only after that.
+
+        Parameters
+        ----------
+        app_instance : MainApp
+            application to save
+        '''
+        if self.pending is not None:
+            return
+
+        old_generation  = self.generation
+        self.generation = old_generation + 1
+
+        # Everything the gui, or the shell, can change while the snapshot is written is copied here
+        session_data = collect_session_data(app_instance)
+        session_data["dataframes"]   = [df.copy(deep=False) for df in app_instance.dataframes]
+        session_data["header_lines"] = list(app_instance.header_lines)
+        session_data["fit_results"]  = copy.deepcopy(app_instance.fit_results)
+        session_data["generation"]   = self.generation
+
+        self.open_journal(app_instance, previous=old_generation)
+        self.pending = self.executor.submit(write_snapshot, self.base_path, session_data)
+
+    def poll(self):
+        '''
+        Check the snapshot written in the background, if any.
+        The errors of the writing are raised here.
+
+        Returns
+        -------
+        bool
+            True if no snapshot is being written
+        '''
+        if self.pending is None:
+            return True
+        if not self.pending.done():
+            return False
+
+        future, self.pending = self.pending, None
+        self.snap_size = future.result()
+        return True
+
+    def wait(self):
+        ''' Wait the snapshot being written, ignoring its errors
+        '''
+        if self.pending is not None:
+            try:
+                self.pending.result()
+            except Exception:
+                pass
+            self.pending = None
+
+    def state_json(self, app_instance):
+        ''' The part of the session that is not data, as JSON
+        '''
+        return json.dumps({
+            "logger_path"  : app_instance.logger_path,
+            "fit_results"  : app_instance.fit_results,
+            "fit_table"    : app_instance.fit_table.to_dict("records"),
+            "number_plots" : app_instance.number_plots,
+            "plot_widgets" : collect_plot_state(app_instance),
+            "n_files"      : len(app_instance.dataframes),
+        }, default=_json_default)
+
+    def write_entry(self, meta, arrays=()):
+        '''
+        Append an entry to the journal.
+
+        Parameters
+        ----------
+        meta : dict
+            header of the entry
+        arrays : list of 1darray, optional
+            columns whose data follows the header
+        '''
+        header  = json.dumps(meta, default=_json_default).encode("utf-8")
+        payload = [np.ascontiguousarray(a, dtype=np.float64) for a in arrays]
+        n_bytes = sum(a.nbytes for a in payload)
+
+        self.file.write(_ENTRY_HEADER.pack(len(header), n_bytes))
+        self.file.write(header)
+        for a in payload:
+            self.file.write(memoryview(a).cast("B"))
+
+        self.entries += 1
+        self.size    += _ENTRY_HEADER.size + len(header) + n_bytes
+
+    def flush(self, app_instance):
+        '''
+        Write in the journal everything changed since the last flush
+        and force it on disk; compact the journal if it is too big.
+
+        Parameters
+        ----------
+        app_instance : MainApp
+            application to save
+
+        Returns
+        -------
+        int
+            number of entries written
+        '''
+        if self.file is None:
+            self.start(app_instance)
+            return 0
+
+        ready   = self.poll()
+        written = 0
+        for i, df in enumerate(app_instance.dataframes):
+            if i >= len(self.known) or self.known[i] is not df:
+                # New file, or a file loaded over an old one
+                header  = app_instance.header_lines[i]
+                columns = [str(c) for c in df.columns]
+                self.write_entry({
+                    "kind"     : "file",
+                    "file"     : i,
+                    "filename"   : df.attrs.get("filename", ""),
+                    "modified"   : bool(df.attrs.get("modified", False)),
+                    "columns"    : columns,
+                    "source"     : [source_name(df, c) for c in columns],
+                    "provenance" : df.attrs.get("provenance", []),
+                    "length"     : len(df),
+                    "header"     : {"columns": header.columns, "lines": header.lines},
+                }, [df[c].to_numpy(dtype=float) for c in df.columns])
+                written += 1
+
+            elif id(df) in self.dirty:
+                columns = [c for c in df.columns if c in self.dirty[id(df)][1]]
+                if columns:
+                    self.write_entry({
+                        "kind"       : "columns",
+                        "file"       : i,
+                        "columns"    : [str(c) for c in columns],
+                        "provenance" : df.attrs.get("provenance", []),
+                        "length"     : len(df),
+                    }, [df[c].to_numpy(dtype=float) for c in columns])
+                    written += 1
+
+        self.known = list(app_instance.dataframes)
+        self.dirty = {}
+
+        state = self.state_json(app_instance)
+        if state != self.last_state:
+            self.write_entry({"kind": "state", **json.loads(state)})
+            self.last_state = state
+            written += 1
+
+        if written:
+            self.file.flush()
+            os.fsync(self.file.fileno())
+
+            too_big = self.size > max(MIN_COMPACT_SIZE, self.snap_size) or self.entries > MAX_ENTRIES
+            if ready and too_big:
+                self.compact(app_instance)
+
+        return written
+
+    def close(self, remove=True):
+        '''
+        Stop the journal.
+
+        Parameters
+        ----------
+        remove : bool, optional
+            if True (default) snapshot and journal are deleted,
+            i.e. the session was closed normally
+        '''
+        self.wait()
+        self.executor.shutdown(wait=False)
+        if self.file is not None:
+            self.file.close()
+            self.file = None
+        if remove:
+            remove_autosave(self.base_path)
+
+
+def write_snapshot(base_path, session_data):
+    '''
+    Write the snapshot of a generation and remove the journals before it,
+    run by a background thread of SessionJournal.
+
+    Parameters
+    ----------
+    base_path : str
+        base path of the files, see autosave_base
+    session_data : dict
+        session to write, with its "generation"
+
+    Returns
+    -------
+    int
+        size of the snapshot in bytes
+    '''
+    path = snapshot_path(base_path)
+    write_session_archive(path, session_data)
+
+    for old in glob.glob(glob.escape(base_path) + ".journal.*"):
+        generation = old.rsplit(".", 1)[1]
+        if generation.isdigit() and int(generation) < session_data["generation"]:
+            remove_file(old)
+
+    return os.path.getsize(path)
+
+
+def link_snapshot(archive_path, path):
+    '''
+    Use a session archive as snapshot, with a hard link if possible
+    (the archives are never modified in place, only replaced) and
+    otherwise with a copy. Run by a background thread of SessionJournal.
+
+    Parameters
+    ----------
+    archive_path : str
+        path of the session archive
+    path : str
+        path of the snapshot
+
+    Returns
+    -------
+    int
+        size of the snapshot in bytes
+    '''
+    tmp_path = path + ".tmp"
+    remove_file(tmp_path)
+    try:
+        # On Windows a linked file could not be replaced while the session maps it
+        if os.name == "nt":
+            raise OSError
+        os.link(archive_path, tmp_path)
+    except OSError:
+        shutil.copyfile(archive_path, tmp_path)
+    os.replace(tmp_path, path)
+
+    return os.path.getsize(path)
+
+
+def remove_file(path):
+    ''' Remove a file if it exists
+    '''
+    try:
+        os.remove(path)
+    except FileNotFoundError:
+        pass
+
+
+def remove_autosave(base_path):
+    '''
+    Delete all the autosave files of a session.
+
+    Parameters
+    ----------
+    base_path : str
+        base path of the files, see autosave_base
+    '''
+    remove_file(snapshot_path(base_path))
+    for path in glob.glob(glob.escape(base_path) + ".journal.*"):
+        remove_file(path)
+
+#==============================================================================================#
+# Recovery                                                                                     #
+#==============================================================================================#
+
+def read_journal(path):
+    '''
+    Read all the complete entries of a journal.
+    An entry cut by a crash, and everything after it, is ignored.
+
+    Parameters
+    ----------
+    path : str
+        path of the journal
+
+    Yields
+    ------
+    meta : dict
+        header of the entry
+    arrays : list of 1darray
+        columns of the entry
+    '''
+    with open(path, "rb") as f:
+        while True:
+            raw = f.read(_ENTRY_HEADER.size)
+            if len(raw) < _ENTRY_HEADER.size:
+                return
+            header_len, payload_len = _ENTRY_HEADER.unpack(raw)
+
+            header = f.read(header_len)
+            data   = np.empty(payload_len // 8, dtype=np.float64)
+            if len(header) < header_len or f.readinto(data) < payload_len:
+                return
+
+            meta   = json.loads(header)
+            n_cols = len(meta.get("columns", []))
+            arrays = np.split(data, n_cols) if n_cols else []
+
+            yield meta, arrays
+
+
+def recover(base_path):
+    '''
+    Rebuild the session from the snapshot and the journals, see journal_chain.
+
+    Parameters
+    ----------
+    base_path : str
+        base path of the files, see autosave_base
+
+    Returns
+    -------
+    session_data : dict
+        session data, as returned by read_session_archive
+    '''
+    # Read in memory, the snapshot is rewritten as soon as the autosave restarts
+    session_data = read_session_archive(snapshot_path(base_path), mmap=False)
+    generation   = session_data.pop("generation", 0)
+    dataframes   = session_data["dataframes"]
+    header_lines = session_data["header_lines"]
+
+    entries = (entry for g in journal_chain(base_path, generation)
+               for entry in read_journal(journal_path(base_path, g)))
+
+    for meta, arrays in entries:
+        kind = meta.pop("kind")
+
+        if kind == "file":
+            df = pd.DataFrame(dict(zip(meta["columns"], arrays)), copy=False)
+            df.attrs["filename"] = meta["filename"]
+            df.attrs["modified"] = meta["modified"]
+            set_source_columns(df, meta.get("source", meta["columns"]))
+            df.attrs["provenance"] = meta.get("provenance", [])
+
+            header = LabviewHeader(meta["header"]["columns"], meta["header"]["lines"],
+                                   parse_metadata(meta["header"]["lines"]))
+
+            i = meta["file"]
+            if i < len(dataframes):
+                dataframes[i], header_lines[i] = df, header
+            else:
+                dataframes.append(df)
+                header_lines.append(header)
+
+        elif kind == "columns":
+            df = dataframes[meta["file"]]
+            for col, values in zip(meta["columns"], arrays):
+                df[col] = values
+            df.attrs["modified"]   = True
+            df.attrs["provenance"] = meta.get("provenance", [])
+
+        elif kind == "state":
+            n_files = meta.pop("n_files")
+            del dataframes[n_files:], header_lines[n_files:]
+            session_data.update(meta)
+
+    return session_data
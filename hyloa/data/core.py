@@ -0,0 +1,356 @@
+"""
+Pure NumPy core of the standard operations on the loops.
+Every function takes arrays and returns new arrays, nothing here
+depends on Qt, so the same code is used by the dialogs of the gui
+and by the headless batch processing (see hyloa/batch.py).
+"""
+import numpy as np
+
+
+#==============================================================================================#
+# Normalization of the loop in the interval [-1, 1]                                            #
+#==============================================================================================#
+
+def normalization_parameters(heads, tails):
+    '''
+    Compute shift and amplitude of many loops in a single pass.
+
+    1) Compute the initial and final average values of each branch.
+    2) Reconcile the average values to correct any inconsistencies in direction.
+       If both branches grow or decrease in a coherent way, the averages of the same
+       branch are averaged. Otherwise, the "cross-branch" average is averaged.
+    3) Compute the shift and the amplitude of the cycle.
+
+    Parameters
+    ----------
+    heads : ndarray
+        first points of the branches, shape (..., 2, window) where
+        index 0 of the second to last axis is the increasing branch
+        and index 1 the decreasing one
+    tails : ndarray
+        last points of the branches, same shape of heads
+
+    Returns
+    -------
+    v_shift, v_amplitude : ndarray
+        shift and amplitude of each loop, shape (...)
+    '''
+    ave1 = np.mean(heads, axis=-1)
+    ave2 = np.mean(tails, axis=-1)
+
+    aveup1, avedw1 = ave1[..., 0], ave1[..., 1]
+    aveup2, avedw2 = ave2[..., 0], ave2[..., 1]
+
+    # Branch direction correction
+    coherent = ((aveup1 > aveup2) & (avedw1 > avedw2)) | ((aveup1 < aveup2) & (avedw1 < avedw2))
+    start    = np.where(coherent, (aveup1 + avedw1) * 0.5, (aveup1 + avedw2) * 0.5)
+    stop     = np.where(coherent, (aveup2 + avedw2) * 0.5, (aveup2 + avedw1) * 0.5)
+
+    v_shift     = (start + stop) * 0.5
+    v_amplitude = np.abs(start - stop) * 0.5
+
+    return v_shift, v_amplitude
+
+
+def normalize_loops(loops, window=5):
+    '''
+    Normalize a stack of loops so that each one is centered and with unit amplitude.
+    The procedure is the one of normalization_parameters, using
+    the first and last `window` points of each branch.
+
+    Parameters
+    ----------
+    loops : ndarray
+        loops to normalize, shape (n_loops, 2, n_points) or (2, n_points),
+        the first branch is the increasing one and the second the decreasing one
+    window : int, optional
+        number of points at the start and at the end of each branch
+        used to compute the averages, default 5
+
+    Returns
+    -------
+    ndarray
+        normalized loops, same shape of the input
+    '''
+    loops = np.asarray(loops, dtype=float)
+
+    if window < 1:
+        raise ValueError("La finestra per la media deve contenere almeno un punto.")
+
+    v_shift, v_amplitude = normalization_parameters(loops[..., :window], loops[..., -window:])
+
+    return (loops - v_shift[..., None, None]) / v_amplitude[..., None, None]
+
+
+def normalize_loop(ell_up, ell_dw, window=5):
+    '''
+    Normalize a loop so that it is centered and with unit amplitude,
+    see normalize_loops for the details.
+
+    Parameters
+    ----------
+    ell_up : 1darray or 2darray
+        increasing branch of the loop, or one branch for each row
+    ell_dw : 1darray or 2darray
+        decreasing branch of the loop, same shape of ell_up
+    window : int, optional
+        number of points used for the averages, default 5
+
+    Returns
+    -------
+    ell_up_normalized, ell_dw_normalized : 1darray or 2darray
+        normalized branches
+    '''
+    loops = normalize_loops(np.stack([ell_up, ell_dw], axis=-2), window)
+
+    return loops[..., 0, :], loops[..., 1, :]
+
+
+def normalize_dataframes(dataframes, pairs, window=5):
+    '''
+    Normalize the loops of many files at once.
+    Only the first and last points of each branch are collected, so
+    the files can have different lengths; shifts and amplitudes of
+    all the loops are then computed together in a single pass.
+
+    Parameters
+    ----------
+    dataframes : list of pandas.DataFrame
+        loaded files
+    pairs : list
+        columns to normalize, as a list of (col_up, col_dw) used for
+        all the files, or a list with one such list for each file
+    window : int, optional
+        number of points used for the averages, default 5
+
+    Returns
+    -------
+    list of dict
+        for each file a dictionary {column name : normalized array}
+    '''
+    # An empty first element is the (empty) list of pairs of the first file
+    if pairs and pairs[0] and isinstance(pairs[0][0], str):
+        pairs = [pairs] * len(dataframes)
+
+    columns = [
+        (idx, col_up, col_dw, df[col_up].to_numpy(), df[col_dw].to_numpy())
+        for idx, (df, file_pairs) in enumerate(zip(dataframes, pairs))
+        for col_up, col_dw in file_pairs
+    ]
+    if not columns:
+        return [{} for _ in dataframes]
+
+    if min(len(up) for _, _, _, up, _ in columns) < window:
+        raise ValueError(f"Ogni ramo deve avere almeno {window} punti.")
+
+    heads = np.array([[up[:window],  dw[:window]]  for _, _, _, up, dw in columns])
+    tails = np.array([[up[-window:], dw[-window:]] for _, _, _, up, dw in columns])
+    v_shift, v_amplitude = normalization_parameters(heads, tails)
+
+    results = [{} for _ in dataframes]
+    for (idx, col_up, col_dw, up, dw), shift, amplitude in zip(columns, v_shift, v_amplitude):
+        results[idx][col_up] = (up - shift) / amplitude
+        results[idx][col_dw] = (dw - shift) / amplitude
+
+    return results
+
+#==============================================================================================#
+# Closure of the loop                                                                          #
+#==============================================================================================#
+
+def close_loop(ell_up, ell_dw):
+    '''
+    Correct the effects of instrumental drift and close the loop.
+
+    1) Calculate the difference in absolute value between the initial and final values of the branches.
+    2) Determine which difference (initial or final) is dominant.
+    3) Apply a linear correction to reduce the misalignment:
+        This correction is applied only on the dominant difference and its intensity
+        decreases linearly while iterating on the points of the loop:
+
+        - The values of the increasing branch are incremented or decremented.
+        - The values of the decreasing branch are corrected symmetrically.
+
+    The correction is computed as a single linear ramp for all the loops at once,
+    so the branches can also be a stack of many loops with shape (n_loops, n_points).
+
+    Parameters
+    ----------
+    ell_up : 1darray or 2darray
+        increasing branch of the loop, or one branch for each row
+    ell_dw : 1darray or 2darray
+        decreasing branch of the loop, same shape of ell_up
+
+    Returns
+    -------
+    ell_up, ell_dw : 1darray or 2darray
+        corrected branches (new arrays, the inputs are not modified)
+    '''
+    ell_up = np.array(ell_up, dtype=float)
+    ell_dw = np.array(ell_dw, dtype=float)
+
+    if ell_up.shape != ell_dw.shape:
+        raise ValueError("I due rami del ciclo devono avere la stessa lunghezza.")
+
+    num = ell_up.shape[-1]
+    if num < 2:
+        return ell_up, ell_dw
+
+    up = np.atleast_2d(ell_up)
+    dw = np.atleast_2d(ell_dw)
+
+    offset, slope = closure_parameters(up[:, 0], up[:, -1], dw[:, 0], dw[:, -1], num)
+    ramp = offset[:, None] + slope[:, None] * np.arange(num)
+
+    up = up - ramp
+    dw = dw + ramp
+
+    return up.reshape(ell_up.shape), dw.reshape(ell_dw.shape)
+
+
+def closure_parameters(up_first, up_last, dw_first, dw_last, num):
+    '''
+    Linear correction of close_loop, computed only from the first
+    and last points of the branches. The correction of point i is
+    offset + slope * i, subtracted from the increasing branch and
+    added to the decreasing one.
+
+    Parameters
+    ----------
+    up_first, up_last : 1darray
+        first and last point of the increasing branch of each loop
+    dw_first, dw_last : 1darray
+        first and last point of the decreasing branch of each loop
+    num : int
+        number of points of the branches, at least 2
+
+    Returns
+    -------
+    offset, slope : 1darray
+        coefficients of the correction of each loop
+    '''
+    dy_start = np.abs(up_first - dw_first)
+    dy_stop  = np.abs(up_last  - dw_last)
+
+    # Only the dominant misalignment is corrected: the start one with a
+    # ramp that vanishes at the end of the loop, the stop one with a ramp
+    # that vanishes at the beginning. If they are equal nothing is done.
+    start = dy_start > dy_stop
+    stop  = dy_start < dy_stop
+
+    offset = np.where(start, 0.5 * dy_start, 0.0)
+    slope  = np.where(start, -0.5 * dy_start, np.where(stop, 0.5 * dy_stop, 0.0)) / (num - 1)
+
+    # The increasing branch is moved towards the decreasing one and vice versa
+    up_above = np.where(start, up_first > dw_first, up_last > dw_last)
+    sign     = np.where(up_above, 1.0, -1.0)
+
+    return sign * offset, sign * slope
+
+#==============================================================================================#
+# Inversion of axis or branches                                                                #
+#==============================================================================================#
+
+def invert(values):
+    '''
+    Invert the sign of a column.
+
+    Parameters
+    ----------
+    values : 1darray
+        data to invert
+
+    Returns
+    -------
+    1darray
+        inverted data
+    '''
+    return -np.asarray(values, dtype=float)
+
+#==============================================================================================#
+# Level of detail for the plots                                                                #
+#==============================================================================================#
+
+def decimate_indices(x, y, n_bins, x_range=None):
+    '''
+    Choose the points of a curve to draw, so that the plot looks the
+    same as with all the points but drawing costs O(n_bins).
+
+    The points inside the visible range are divided, in order, in n_bins
+    groups (about one per pixel of the axes) and of each group are kept:
+
+    - the first and the last point, so the line is continuous;
+    - the points with minimum and maximum x and y, so the envelope and
+      the saturation are exact;
+    - the two points of the steepest step, i.e. the switching field.
+
+    Moreover the points where x or y change sign are kept, so the
+    coercive points and the remanence are not moved by the decimation;
+    of each group only the first and the last crossing are kept, so
+    noisy data around zero do not keep almost all the points.
+
+    Parameters
+    ----------
+    x, y : 1darray
+        data of the curve
+    n_bins : int
+        number of groups, usually the width of the axes in pixels
+    x_range : tuple of float, optional
+        visible range of x; the points outside, except the first
+        neighbour on each side, are dropped. Default all the points.
+
+    Returns
+    -------
+    1darray
+        sorted indices of the points to draw
+    '''
+    x = np.asarray(x)
+    y = np.asarray(y)
+
+    if x_range is None:
+        idx = np.arange(len(x))
+    else:
+        lo, hi = min(x_range), max(x_range)
+        inside = (x >= lo) & (x <= hi)
+        near   = inside.copy()
+        near[1:]  |= inside[:-1]
+        near[:-1] |= inside[1:]
+        idx = np.flatnonzero(near)
+
+    m = len(idx)
+    if m <= 4 * n_bins:
+        return idx
+
+    xv, yv = x[idx], y[idx]
+
+    # Groups of the same size, the last one is padded repeating the last point
+    size = -(-m // n_bins)
+    rows = -(-m // size)
+    base = np.arange(rows) * size
+
+    def groups(v):
+        return np.pad(v, (0, rows * size - m), mode="edge").reshape(rows, size)
+
+    keep = [base, base + size - 1]
+    for v in (xv, yv):
+        g = groups(v)
+        keep.append(base + g.argmin(axis=1))
+        keep.append(base + g.argmax(axis=1))
+
+    step = base + groups(np.abs(np.diff(yv, append=yv[-1]))).argmax(axis=1)
+    keep.extend([step, step + 1])
+
+    for v in (xv, yv):
+        s = np.signbit(v)
+        crossing = np.flatnonzero(s[1:] != s[:-1])
+        if len(crossing):
+            # First and last crossing of each group, the crossings are sorted
+            group    = crossing // size
+            first    = np.diff(group, prepend=-1) != 0
+            last     = np.diff(group, append=group[-1] + 1) != 0
+            crossing = crossing[first | last]
+        keep.extend([crossing, crossing + 1])
+
+    keep = np.unique(np.concatenate(keep))
+
+    return idx[keep[keep < m]]
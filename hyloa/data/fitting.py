@@ -0,0 +1,474 @@
+"""
+Code to build the functions used in the curve fitting.
+The function written by the user is checked, compiled only once and
+kept in a cache indexed by its text, so fitting the same model on
+many loops does not parse and compile it again each time.
+The expression can use only the variable x, the parameters, numpy
+as np, the functions of scipy.special and a few builtins; a parameter
+with the name of one of these functions hides it.
+There is also a library of the usual models of the loops, with
+analytic derivatives and estimate of the initial parameters.
+"""
+import ast
+import keyword
+import builtins
+import warnings
+import functools
+from dataclasses import dataclass
+
+import numpy as np
+import pandas as pd
+import scipy.special
+from scipy.optimize import curve_fit
+
+
+# Names available in the fit functions, built once
+FIT_NAMESPACE = {
+    name: getattr(scipy.special, name)
+    for name in dir(scipy.special) if not name.startswith("_")
+}
+FIT_NAMESPACE.update({
+    name: getattr(builtins, name)
+    for name in ("abs", "min", "max", "pow", "round", "sum", "float", "int")
+})
+FIT_NAMESPACE["np"] = np
+
+# Names that cannot be used for the parameters
+RESERVED_NAMES = ("x", "np")
+
+# Syntax allowed in the expressions
+ALLOWED_NODES = (
+    ast.Expression, ast.BinOp, ast.UnaryOp, ast.BoolOp, ast.Compare, ast.IfExp,
+    ast.Call, ast.keyword, ast.Name, ast.Load, ast.Attribute, ast.Constant,
+    ast.Tuple, ast.List, ast.operator, ast.unaryop, ast.boolop, ast.cmpop,
+)
+
+# Compiled models kept in the cache, see compile_model
+MODEL_CACHE_SIZE = 128
+
+# Columns identifying a row of the table of the fit results
+FIT_TABLE_KEY = ["file", "x", "y"]
+
+
+@dataclass
+class FitModel:
+    '''
+    Function to fit, compiled from an expression.
+
+    Attributes
+    ----------
+    expression : str
+        text of the function of x, or the name of a model of MODEL_LIBRARY
+    param_names : tuple of str
+        names of the parameters, in the order of func
+    func : callable
+        func(x, *params), the model
+    jac : callable or None
+        jac(x, *params), derivatives with respect to the parameters,
+        shape (len(x), len(params)), used by curve_fit
+    guess : callable or None
+        guess(x, y), initial values of the parameters estimated from the data
+    description : str
+        formula of the model, for the gui
+    '''
+    expression  : str
+    param_names : tuple
+    func        : callable
+    jac         : callable = None
+    guess       : callable = None
+    description : str = ""
+
+
+def validate_expression(expression, param_names):
+    '''
+    Check that an expression uses only the allowed syntax and names.
+
+    Parameters
+    ----------
+    expression : str
+        function of x written by the user
+    param_names : sequence of str
+        names of the parameters
+
+    Returns
+    -------
+    ast.Expression
+        parsed expression
+
+    Raises
+    ------
+    ValueError
+        if the expression is not valid
+    '''
+    for name in param_names:
+        if not name.isidentifier() or keyword.iskeyword(name) or name in RESERVED_NAMES:
+            raise ValueError(f"Nome di parametro non valido: '{name}'")
+    if len(set(param_names)) != len(param_names):
+        raise ValueError("I nomi dei parametri devono essere diversi tra loro.")
+
+    try:
+        tree = ast.parse(expression.strip(), mode="eval")
+    except SyntaxError as e:
+        raise ValueError(f"Errore di sintassi nella funzione: {e.msg}")
+
+    allowed_names = {"x", *param_names, *FIT_NAMESPACE}
+    for node in ast.walk(tree):
+        if not isinstance(node, ALLOWED_NODES):
+            raise ValueError(f"Costrutto non permesso nella funzione: {type(node).__name__}")
+        if isinstance(node, ast.Name) and node.id not in allowed_names:
+            raise ValueError(f"Nome sconosciuto nella funzione: '{node.id}'")
+        if isinstance(node, ast.Attribute) and node.attr.startswith("_"):
+            raise ValueError(f"Attributo non permesso nella funzione: '{node.attr}'")
+
+    return tree
+
+
+def get_model(expression, param_names):
+    '''
+    Return the compiled model of an expression, from the cache if
+    the same expression with the same parameters was already used.
+
+    Parameters
+    ----------
+    expression : str
+        function of x written by the user, or the name of a model of MODEL_LIBRARY
+    param_names : sequence of str
+        names of the parameters
+
+    Returns
+    -------
+    FitModel
+        compiled model; the models of the library have analytic derivatives,
+        the ones written by the user have no Jacobian and use the finite
+        differences of MINPACK
+    '''
+    key = (expression.strip(), tuple(param_names))
+
+    if key[0] in MODEL_LIBRARY:
+        model = MODEL_LIBRARY[key[0]]
+        if key[1] != model.param_names:
+            raise ValueError(f"I parametri del modello {key[0]} sono: {', '.join(model.param_names)}")
+        return model
+
+    return compile_model(*key)
+
+
+@functools.lru_cache(maxsize=MODEL_CACHE_SIZE)
+def compile_model(expression, param_names):
+    '''
+    Check and compile an expression written by the user. The last
+    MODEL_CACHE_SIZE models are kept, so fitting many loops with the
+    same function compiles it only once. The errors are not cached.
+
+    Parameters
+    ----------
+    expression : str
+        function of x, already stripped
+    param_names : tuple of str
+        names of the parameters
+
+    Returns
+    -------
+    FitModel
+        compiled model, without Jacobian
+    '''
+    tree = validate_expression(expression, param_names)
+
+    # Wrap the expression in a lambda of x and of the parameters
+    args = ast.arguments(
+        posonlyargs=[], args=[ast.arg(arg=name) for name in ("x", *param_names)],
+        kwonlyargs=[], kw_defaults=[], defaults=[]
+    )
+    lambda_tree = ast.Expression(body=ast.Lambda(args=args, body=tree.body))
+    ast.fix_missing_locations(lambda_tree)
+
+    code = compile(lambda_tree, "<funzione di fit>", "eval")
+    func = eval(code, {"__builtins__": {}, **FIT_NAMESPACE})
+
+    return FitModel(expression, param_names, func)
+
+
+def fit_model(model, x, y, p0, use_jac=True):
+    '''
+    Fit a model to the data.
+
+    Parameters
+    ----------
+    model : FitModel
+        model to fit
+    x, y : 1darray
+        data
+    p0 : sequence of float or None
+        initial values of the parameters, if None they are
+        estimated from the data (only for the models with guess)
+    use_jac : bool, optional
+        if True (default) and the model has one, use its Jacobian
+
+    Returns
+    -------
+    params : 1darray
+        best values of the parameters
+    pcov : 2darray
+        covariance matrix of the parameters
+    '''
+    if p0 is None:
+        if model.guess is None:
+            raise ValueError("Il modello non permette di stimare i parametri iniziali.")
+        p0 = model.guess(x, y)
+
+    if len(p0) != len(model.param_names):
+        raise ValueError("Il numero di parametri iniziali non corrisponde al numero di parametri.")
+
+    jac = model.jac if use_jac else None
+
+    return curve_fit(model.func, x, y, p0=p0, jac=jac)
+
+#==============================================================================================#
+# Library of models of the hysteresis loops                                                   #
+#==============================================================================================#
+
+def langevin(u):
+    '''
+    Langevin function L(u) = coth(u) - 1/u, with its series near zero.
+    '''
+    u     = np.asarray(u, dtype=float)
+    small = np.abs(u) < 1e-2
+    us    = np.where(small, 1.0, u)
+    return np.where(small, u/3 - u**3/45 + 2*u**5/945, 1/np.tanh(us) - 1/us)
+
+
+def langevin_prime(u):
+    '''
+    Derivative of the Langevin function L'(u) = 1/u^2 - 1/sinh(u)^2.
+    '''
+    u     = np.asarray(u, dtype=float)
+    small = np.abs(u) < 1e-2
+    us    = np.where(small, 1.0, u)
+    with np.errstate(over="ignore"):
+        return np.where(small, 1/3 - u**2/15 + 2*u**4/189, 1/us**2 - 1/np.sinh(us)**2)
+
+
+def brillouin(u, J):
+    '''
+    Brillouin function of angular momentum J, written with the
+    Langevin function to avoid the divergences of coth at zero:
+    B_J(u) = A L(A u) - C L(C u), with C = 1/(2J) and A = 1 + C.
+    '''
+    C = 1 / (2 * J)
+    A = 1 + C
+    return A * langevin(A * u) - C * langevin(C * u)
+
+
+def estimate_loop_shape(x, y):
+    '''
+    Estimate the shape of a branch of a loop from the data.
+
+    Parameters
+    ----------
+    x, y : 1darray
+        field and magnetization
+
+    Returns
+    -------
+    amplitude : float
+        half of the jump, negative if y decreases with x
+    center : float
+        field where the branch crosses its mean value (coercive field)
+    width : float
+        field interval of the switching
+    offset : float
+        mean value of the saturations
+    '''
+    order  = np.argsort(x)
+    xs, ys = np.asarray(x, dtype=float)[order], np.asarray(y, dtype=float)[order]
+
+    low, high = np.percentile(ys, [2, 98])
+    offset    = (low + high) / 2
+    n_edge    = max(len(ys) // 20, 1)
+    sign      = 1.0 if ys[-n_edge:].mean() >= ys[:n_edge].mean() else -1.0
+    amplitude = sign * max((high - low) / 2, np.finfo(float).tiny)
+
+    # Normalized branch, increasing in x
+    z = (ys - offset) / amplitude
+
+    def crossing(level):
+        above = np.flatnonzero(z >= level)
+        if len(above) == 0 or above[0] == 0:
+            return xs[np.argmin(np.abs(z - level))]
+        i = above[0]
+        return xs[i-1] + (level - z[i-1]) * (xs[i] - xs[i-1]) / (z[i] - z[i-1])
+
+    center = crossing(0.0)
+    width  = abs(crossing(np.tanh(1)) - crossing(-np.tanh(1))) / 2
+    if not width > 0:
+        width = (xs[-1] - xs[0]) / 10 or 1.0
+
+    return amplitude, center, width, offset
+
+
+def _tanh_model():
+    def func(x, Ms, Hc, w, c):
+        return Ms * np.tanh((x - Hc) / w) + c
+
+    def jac(x, Ms, Hc, w, c):
+        u  = (x - Hc) / w
+        t  = np.tanh(u)
+        dt = Ms * (1 - t**2) / w
+        return np.column_stack([t, -dt, -dt * u, np.ones_like(x)])
+
+    def guess(x, y):
+        return list(estimate_loop_shape(x, y))
+
+    return FitModel("tanh", ("Ms", "Hc", "w", "c"), func, jac, guess,
+                    "Ms*tanh((x - Hc)/w) + c")
+
+
+def _langevin_model():
+    def func(x, Ms, H0, a, c):
+        return Ms * langevin((x - H0) / a) + c
+
+    def jac(x, Ms, H0, a, c):
+        u  = (x - H0) / a
+        dL = Ms * langevin_prime(u) / a
+        return np.column_stack([langevin(u), -dL, -dL * u, np.ones_like(x)])
+
+    def guess(x, y):
+        # L has slope 1/3 in zero, tanh has slope 1
+        amplitude, center, width, offset = estimate_loop_shape(x, y)
+        return [amplitude, center, width / 3, offset]
+
+    return FitModel("Langevin", ("Ms", "H0", "a", "c"), func, jac, guess,
+                    "Ms*L((x - H0)/a) + c,  L(u) = coth(u) - 1/u")
+
+
+def _brillouin_model():
+    def func(x, Ms, H0, a, J, c):
+        return Ms * brillouin((x - H0) / a, J) + c
+
+    def jac(x, Ms, H0, a, J, c):
+        u  = (x - H0) / a
+        C  = 1 / (2 * J)
+        A  = 1 + C
+        dB_du = A**2 * langevin_prime(A * u) - C**2 * langevin_prime(C * u)
+        # A and C have the same derivative with respect to J, -1/(2J^2)
+        dB_dJ = -(langevin(A * u) + A * u * langevin_prime(A * u)
+                  - langevin(C * u) - C * u * langevin_prime(C * u)) / (2 * J**2)
+        return np.column_stack([
+            brillouin(u, J), -Ms * dB_du / a, -Ms * dB_du * u / a, Ms * dB_dJ, np.ones_like(x)
+        ])
+
+    def guess(x, y):
+        # For J = 1/2 the Brillouin function is tanh
+        amplitude, center, width, offset = estimate_loop_shape(x, y)
+        return [amplitude, center, width, 0.5, offset]
+
+    return FitModel("Brillouin", ("Ms", "H0", "a", "J", "c"), func, jac, guess,
+                    "Ms*B_J((x - H0)/a) + c")
+
+
+def _two_phase_model():
+    def func(x, M1, H1, w1, M2, H2, w2, c):
+        return M1 * np.tanh((x - H1) / w1) + M2 * np.tanh((x - H2) / w2) + c
+
+    def jac(x, M1, H1, w1, M2, H2, w2, c):
+        columns = []
+        for M, H, w in ((M1, H1, w1), (M2, H2, w2)):
+            u  = (x - H) / w
+            t  = np.tanh(u)
+            dt = M * (1 - t**2) / w
+            columns += [t, -dt, -dt * u]
+        return np.column_stack(columns + [np.ones_like(x)])
+
+    def guess(x, y):
+        # Two equal phases, one switching before and one after the coercive field
+        amplitude, center, width, offset = estimate_loop_shape(x, y)
+        return [amplitude / 2, center - width / 2, width / 2,
+                amplitude / 2, center + width / 2, width / 2, offset]
+
+    return FitModel("two-phase tanh", ("M1", "H1", "w1", "M2", "H2", "w2", "c"), func, jac, guess,
+                    "M1*tanh((x - H1)/w1) + M2*tanh((x - H2)/w2) + c")
+
+
+# Built-in models, {name : FitModel}; they can be used giving the name as expression
+MODEL_LIBRARY = {
+    model.expression: model
+    for model in (_tanh_model(), _langevin_model(), _brillouin_model(), _two_phase_model())
+}
+
+#==============================================================================================#
+# Fit of many loops and table of the results                                                   #
+#==============================================================================================#
+
+def fit_columns(expression, param_names, x, y, p0):
+    '''
+    Fit a model to a pair of columns and summarize the result.
+    It never raises, a failed fit is reported in the result, so it
+    can be used for many loops at once in a pool of worker processes:
+    only the text of the model is sent, and each worker compiles it once.
+
+    Parameters
+    ----------
+    expression : str
+        function of x
+    param_names : sequence of str
+        names of the parameters
+    x, y : 1darray
+        data in the range of the fit
+    p0 : sequence of float or None
+        initial values of the parameters, None to estimate them
+
+    Returns
+    -------
+    dict
+        model, number of points, success, message and, for each parameter
+        p, its value "p" and its error "error_p" (nan if the fit failed)
+    '''
+    row = {"model": expression, "n_points": len(x)}
+    row.update({name: np.nan for name in param_names})
+    row.update({f"error_{name}": np.nan for name in param_names})
+
+    try:
+        if len(x) == 0:
+            raise ValueError("Nessun dato nel range selezionato!")
+
+        with warnings.catch_warnings(record=True) as caught:
+            warnings.simplefilter("always")
+            params, pcov = fit_model(get_model(expression, param_names), x, y, p0)
+
+        for name, val, err in zip(param_names, params, np.sqrt(np.diag(pcov))):
+            row[name]            = float(val)
+            row[f"error_{name}"] = float(err)
+
+        row["success"] = True
+        row["message"] = "; ".join(str(w.message) for w in caught) or "ok"
+
+    except Exception as e:
+        row["success"] = False
+        row["message"] = str(e)
+
+    return row
+
+
+def update_fit_table(table, rows):
+    '''
+    Add the results of some fits to the table of the results.
+    A new fit of the same file and columns replaces the old row.
+
+    Parameters
+    ----------
+    table : pandas.DataFrame
+        current table, possibly empty
+    rows : list of dict
+        results, each with the keys of FIT_TABLE_KEY
+
+    Returns
+    -------
+    pandas.DataFrame
+        updated table
+    '''
+    new = pd.DataFrame(rows)
+    if table is None or table.empty:
+        return new
+
+    table = pd.concat([table, new], ignore_index=True)
+    return table.drop_duplicates(FIT_TABLE_KEY, keep="last").reset_index(drop=True)
@@ -0,0 +1,282 @@
+"""
+Code for the undo and redo of the operations on the data.
+
+An operation never modifies the data of a column: hyloa.data.processing.update_columns
+replaces the whole column with a new array (pandas copy-on-write), so the old
+array is still valid and it is enough to keep a reference to it, through a
+read-only view so that nothing can change it by mistake. Each change
+keeps only the columns it touched, before and after, with the attributes of
+the file (modified flag and provenance, see hyloa.data.provenance).
+The memory used by the history is limited: when it is exceeded the oldest
+changes are forgotten.
+Nothing here depends on Qt.
+"""
+import numpy as np
+from dataclasses import dataclass, field
+
+
+HISTORY_BUDGET = 512 * 1024**2      # Bytes of data kept by the history
+MAX_CHANGES    = 100                # Changes that can be undone
+
+
+def read_only(values):
+    ''' Read-only view of an array, the data are not copied
+    '''
+    view = values.view()
+    view.flags.writeable = False
+    return view
+
+
+def owner(values):
+    ''' The array that owns the memory of a view, kept alive by it
+    '''
+    while isinstance(values.base, np.ndarray):
+        values = values.base
+    return values
+
+
+def take_snapshot(df, columns, label=""):
+    '''
+    Read-only references to the current data of some columns of a
+    DataFrame, and a copy of its small attributes. No data is copied.
+
+    Parameters
+    ----------
+    df : pandas dataframe
+        dataframe about to change, or just changed
+    columns : iterable of str
+        columns of interest
+    label : str, optional
+        name of the operation
+
+    Returns
+    -------
+    dict
+        {"columns": {column : array or None if missing}, "attrs": {...}, "label": label}
+    '''
+    return {
+        "columns" : {col: read_only(df[col].to_numpy()) if col in df.columns else None for col in columns},
+        "attrs"   : {
+            "modified"   : df.attrs.get("modified", False),
+            "provenance" : list(df.attrs.get("provenance", [])),
+        },
+        "label"   : label,
+    }
+
+
+def restore_snapshot(df, snapshot):
+    '''
+    Put back in a DataFrame the columns and attributes of a snapshot.
+
+    Parameters
+    ----------
+    df : pandas dataframe
+        dataframe to restore
+    snapshot : dict
+        as returned by take_snapshot
+
+    Returns
+    -------
+    list of str
+        restored columns
+    '''
+    for col, values in snapshot["columns"].items():
+        if values is None:
+            if col in df.columns:
+                del df[col]
+        else:
+            df[col] = values
+    df.attrs["modified"]   = snapshot["attrs"]["modified"]
+    df.attrs["provenance"] = list(snapshot["attrs"]["provenance"])
+    return list(snapshot["columns"])
+
+
+def snapshot_size(snapshot):
+    '''
+    Bytes kept alive by the columns of a snapshot. A column that is a view
+    keeps all the memory of its owner (e.g. a block of many columns of
+    pandas), which is counted once.
+    '''
+    owners = {id(o): o for o in (owner(v) for v in snapshot["columns"].values() if v is not None)}
+    return sum(o.nbytes for o in owners.values())
+
+
+@dataclass
+class Change:
+    '''
+    A change that can be undone, possibly of many files.
+
+    Attributes
+    ----------
+    label : str
+        name of the operation
+    items : list of tuple
+        (dataframe, snapshot before, snapshot after) for each modified file
+    '''
+    label : str
+    items : list = field(default_factory=list)
+
+    def size(self, undone=False):
+        '''
+        Bytes kept alive only by the history: the old data, or
+        the new data if the change has been undone.
+        '''
+        return sum(snapshot_size(after if undone else before) for _, before, after in self.items)
+
+
+class History:
+    '''
+    Stacks of the changes that can be undone and redone.
+
+    Parameters
+    ----------
+    budget : int, optional
+        maximum bytes of data kept, default HISTORY_BUDGET; the most
+        recent change is always kept, even if it is larger
+    max_changes : int, optional
+        maximum number of changes that can be undone, default MAX_CHANGES
+    '''
+
+    def __init__(self, budget=HISTORY_BUDGET, max_changes=MAX_CHANGES):
+        self.budget      = budget
+        self.max_changes = max_changes
+        self.undo_stack  = []
+        self.redo_stack  = []
+
+    def push(self, df, before, after, merge=False):
+        '''
+        Record a change of a file. The redo stack is emptied.
+
+        Parameters
+        ----------
+        df : pandas dataframe
+            modified dataframe
+        before, after : dict
+            snapshots of the touched columns, see take_snapshot
+        merge : bool, optional
+            if True the change is added to the last one, so they are
+            undone together (e.g. the same operation on many files)
+        '''
+        self.redo_stack.clear()
+
+        if merge and self.undo_stack:
+            change = self.undo_stack[-1]
+            if before["label"] and before["label"] not in change.label.split(", "):
+                change.label = f"{change.label}, {before['label']}" if change.label else before["label"]
+        else:
+            change = Change(before["label"])
+            self.undo_stack.append(change)
+
+        change.items.append((df, before, after))
+        self.evict()
+
+    def size(self):
+        ''' Bytes kept by the history
+        '''
+        return (sum(c.size() for c in self.undo_stack)
+                + sum(c.size(undone=True) for c in self.redo_stack))
+
+    def evict(self):
+        '''
+        Forget the oldest changes until the history fits in the budget.
+
+        Returns
+        -------
+        int
+            number of changes forgotten
+        '''
+        removed = 0
+        while len(self.undo_stack) > self.max_changes:
+            self.undo_stack.pop(0)
+            removed += 1
+
+        # The redo stack is dropped before the undo one, and the last change is kept
+        size = self.size()
+        while size > self.budget and self.redo_stack:
+            size -= self.redo_stack.pop(0).size(undone=True)
+            removed += 1
+        while size > self.budget and len(self.undo_stack) > 1:
+            size -= self.undo_stack.pop(0).size()
+            removed += 1
+
+        return removed
+
+    def can_undo(self):
+        return bool(self.undo_stack)
+
+    def can_redo(self):
+        return bool(self.redo_stack)
+
+    def undo(self):
+        '''
+        Restore the data before the last change.
+
+        Returns
+        -------
+        Change or None
+            the undone change, None if there is nothing to undo
+        '''
+        if not self.undo_stack:
+            return None
+        change = self.undo_stack.pop()
+        for df, before, _ in reversed(change.items):
+            restore_snapshot(df, before)
+        self.redo_stack.append(change)
+        return change
+
+    def redo(self):
+        '''
+        Apply again the last undone change.
+
+        Returns
+        -------
+        Change or None
+            the redone change, None if there is nothing to redo
+        '''
+        if not self.redo_stack:
+            return None
+        change = self.redo_stack.pop()
+        for df, _, after in change.items:
+            restore_snapshot(df, after)
+        self.undo_stack.append(change)
+        return change
+
+    def forget(self, dataframes):
+        '''
+        Drop the changes of files that are no longer in the session
+        (closed, reloaded or replaced by a new session).
+
+        Parameters
+        ----------
+        dataframes : list of pandas dataframe
+            files of the session
+        '''
+        alive = {id(df) for df in dataframes}
+        for stack in (self.undo_stack, self.redo_stack):
+            stack[:] = [c for c in stack if all(id(df) in alive for df, _, _ in c.items)]
+
+    def detach(self, predicate):
+        '''
+        Replace with a copy in memory the arrays kept by the history
+        that satisfy a condition, e.g. the columns mapped from a
+        session archive that is going to be overwritten.
+
+        Parameters
+        ----------
+        predicate : callable
+            called with each array, True if it must be copied
+        '''
+        for stack in (self.undo_stack, self.redo_stack):
+            for change in stack:
+                for _, before, after in change.items:
+                    for snapshot in (before, after):
+                        columns = snapshot["columns"]
+                        for col, values in columns.items():
+                            if values is not None and predicate(values):
+                                columns[col] = read_only(np.array(values))
+
+    def clear(self):
+        ''' Forget everything
+        '''
+        self.undo_stack.clear()
+        self.redo_stack.clear()
@@ -7,12 +7,69 @@ import pandas as pd
 
 from PyQt5.QtWidgets import (
     QFileDialog, QMessageBox, QWidget, QHBoxLayout, QLabel,
-    QPushButton, QCheckBox, QLineEdit, QScrollArea, QTableWidget,
-    QTableWidgetItem, QDialog, QVBoxLayout, QComboBox
+    QPushButton, QCheckBox, QLineEdit, QScrollArea, QTableView,
+    QDialog, QVBoxLayout, QComboBox
+)
+from PyQt5.QtCore import Qt, QAbstractTableModel, QModelIndex
+
+from hyloa.utils.workers import PoolRunner
+from hyloa.data.provenance import set_source_columns
+from hyloa.data.labview import (
+    read_labview_file, write_labview_file, DEFAULT_FMT
 )
-from PyQt5.QtCore import Qt
 
 
+#==============================================================================================#
+# Preview of the data                                                                          #
+#==============================================================================================#
+
+class ArrayTableModel(QAbstractTableModel):
+    '''
+    Read-only table model over a 2d array, used for the preview of the files.
+    The view asks only for the visible cells, so nothing is created for the
+    others, and the rows are exposed in pages of `page_size` rows while
+    scrolling, so opening the preview takes the same time whatever the size.
+    '''
+
+    def __init__(self, data, columns, page_size=1000, parent=None):
+        super().__init__(parent)
+        self._data      = data       # 2darray with shape (n_points, n_columns)
+        self._columns   = columns    # Names of the columns
+        self._page_size = page_size  # Number of rows added at each fetch
+        self._loaded    = min(page_size, data.shape[0])
+
+    def rowCount(self, parent=QModelIndex()):
+        return 0 if parent.isValid() else self._loaded
+
+    def columnCount(self, parent=QModelIndex()):
+        return 0 if parent.isValid() else self._data.shape[1]
+
+    def data(self, index, role=Qt.DisplayRole):
+        if role == Qt.DisplayRole and index.isValid():
+            return str(self._data[index.row(), index.column()])
+        return None
+
+    def headerData(self, section, orientation, role=Qt.DisplayRole):
+        if role != Qt.DisplayRole:
+            return None
+        if orientation == Qt.Horizontal:
+            return self._columns[section]
+        return str(section + 1)
+
+    def flags(self, index):
+        return Qt.ItemIsEnabled | Qt.ItemIsSelectable
+
+    def canFetchMore(self, parent=QModelIndex()):
+        return not parent.isValid() and self._loaded < self._data.shape[0]
+
+    def fetchMore(self, parent=QModelIndex()):
+        n = min(self._page_size, self._data.shape[0] - self._loaded)
+        if n <= 0:
+            return
+        self.beginInsertRows(QModelIndex(), self._loaded, self._loaded + n - 1)
+        self._loaded += n
+        self.endInsertRows()
+
 #==============================================================================================#
 # File upload functions                                                                        #
 #==============================================================================================#
@@ -55,6 +112,20 @@ def load_files(app_instance):
     if not file_paths:
         return
 
+    if len(file_paths) > 1:
+        reply = QMessageBox.question(
+            None,
+            "Importazione multipla",
+            f"Sono stati selezionati {len(file_paths)} file.\n"
+            "Vuoi usare la stessa selezione di colonne per tutti i file?\n"
+            "(Le colonne si scelgono sul primo file; per gli altri i nomi personalizzati "
+            "vengono usati come suffisso del nome del file)",
+            QMessageBox.Yes | QMessageBox.No
+        )
+        if reply == QMessageBox.Yes:
+            load_files_bulk(app_instance, file_paths)
+            return
+
     for file_path in file_paths:
 
         filename = os.path.basename(file_path)
@@ -77,28 +148,173 @@ def load_files(app_instance):
             index_to_replace = None  # new file
 
         try:
-            with open(file_path, "r", encoding='utf-8') as f:
-                header = f.readline().strip().split("\t")
+            header, data = read_labview_file(file_path)
 
             app_instance.logger.info(f"Apertura file {file_path}")
-            show_column_selection(app_instance, file_path, header, index_to_replace)
+            show_column_selection(app_instance, file_path, header, data, index_to_replace)
 
         except Exception as e:
             QMessageBox.critical(None, "Errore", f"Errore durante il caricamento del file: {file_path}\n{e}")
 
 #==============================================================================================#
 
-def show_column_selection(app_instance, file_path, header, index_to_replace=None):
+def add_dataframe(app_instance, file_path, header, df_data, index_to_replace=None):
     '''
-    Dialog window to select columns to load.
+    Add a loaded file to the session, or overwrite an existing one.
 
     Parameters
     ----------
     app_instance : instance of MainApp
+    file_path : string
+        path of the loaded file
+    header : LabviewHeader
+        header of the file
+    df_data : pandas dataframe
+        loaded columns
+    index_to_replace : int or None, optional
+        position of the file to overwrite, None to add a new file
+    '''
+    df_data.attrs["filename"] = os.path.basename(file_path)
+
+    if index_to_replace is not None:
+        app_instance.dataframes[index_to_replace]   = df_data
+        app_instance.header_lines[index_to_replace] = header
+        app_instance.logger.info(f"File '{file_path}' sovrascritto in posizione {index_to_replace}")
+    else:
+        app_instance.dataframes.append(df_data)
+        app_instance.header_lines.append(header)
+        app_instance.logger.info(f"File '{file_path}' aggiunto")
+
+
+def read_selected_columns(file_path, indices):
+    '''
+    Read a file and keep only some columns, used by the workers of the bulk import.
+
+    Parameters
+    ----------
     file_path : string
         path of the file to read
-    header : list of str
+    indices : list of int
+        positions of the columns to keep
+
+    Returns
+    -------
+    header : LabviewHeader
         header of the file
+    data : 2darray
+        float64 data of the selected columns only
+    '''
+    header, data = read_labview_file(file_path)
+    return header, np.ascontiguousarray(data[:, indices])
+
+
+def load_files_bulk(app_instance, file_paths):
+    '''
+    Load many files with the same column selection.
+    The columns are chosen on the first file, then all the others are
+    parsed in a pool of worker processes and added to the session,
+    in order, as soon as they are ready, without blocking the gui.
+
+    Parameters
+    ----------
+    app_instance : instance of MainApp
+    file_paths : list of str
+        paths of the files to load
+    '''
+    existing_names = [df.attrs.get("filename", "") for df in app_instance.dataframes]
+    already_loaded = [p for p in file_paths if os.path.basename(p) in existing_names]
+
+    if already_loaded:
+        reply = QMessageBox.question(
+            None,
+            "File già caricati",
+            f"{len(already_loaded)} file sono già stati caricati.\nVuoi sovrascriverli?",
+            QMessageBox.Yes | QMessageBox.No
+        )
+        if reply == QMessageBox.No:
+            file_paths = [p for p in file_paths if p not in already_loaded]
+            if not file_paths:
+                return
+
+    def index_to_replace(file_path):
+        filename = os.path.basename(file_path)
+        names    = [df.attrs.get("filename", "") for df in app_instance.dataframes]
+        return names.index(filename) if filename in names else None
+
+    first_path, other_paths = file_paths[0], file_paths[1:]
+
+    try:
+        header, data = read_labview_file(first_path)
+    except Exception as e:
+        QMessageBox.critical(None, "Errore", f"Errore durante il caricamento del file: {first_path}\n{e}")
+        return
+
+    app_instance.logger.info(f"Importazione multipla di {len(file_paths)} file, modello: {first_path}")
+
+    def on_template(indices, custom):
+        # Same selection for all the other files
+        template = [header.columns[i] for i in indices]
+        errors   = []
+
+        def on_result(i, result, error):
+            file_path = other_paths[i]
+            stem      = os.path.splitext(os.path.basename(file_path))[0]
+
+            if error is None and [result[0].columns[j] for j in indices] != template:
+                error = ValueError("le colonne non corrispondono a quelle del primo file")
+            if error is not None:
+                errors.append(f"{file_path}: {error}")
+                app_instance.logger.error(f"Errore durante il caricamento del file {file_path}: {error}")
+                return
+
+            file_header, columns = result
+            column_names = [f"{stem}_{name or col}" for name, col in zip(custom, template)]
+            df_data = pd.DataFrame(dict(zip(column_names, columns.T)))
+            set_source_columns(df_data, template)
+
+            app_instance.logger.info(f"Dal file: {file_path}, caricate le colonne: {template}")
+            add_dataframe(app_instance, file_path, file_header, df_data, index_to_replace(file_path))
+
+        def on_finished():
+            app_instance.refresh_shell_variables()
+            runner.deleteLater()
+            if errors:
+                QMessageBox.warning(None, "Importazione multipla",
+                                    "Alcuni file non sono stati caricati:\n" + "\n".join(errors))
+
+        if not other_paths:
+            return
+
+        runner = PoolRunner(
+            read_selected_columns, [(path, indices) for path in other_paths],
+            on_result, on_finished, label=f"Caricamento di {len(other_paths)} file...",
+            parent=app_instance
+        )
+
+    show_column_selection(app_instance, first_path, header, data,
+                          index_to_replace(first_path), on_loaded=on_template)
+
+#==============================================================================================#
+
+def show_column_selection(app_instance, file_path, header, data, index_to_replace=None, on_loaded=None):
+    '''
+    Dialog window to select columns to load.
+
+    Parameters
+    ----------
+    app_instance : instance of MainApp
+    file_path : string
+        path of the file to read
+    header : LabviewHeader
+        header of the file, from read_labview_file
+    data : 2darray
+        data of the file, from read_labview_file
+    index_to_replace : int or None, optional
+        position of the file to overwrite, None to add a new file
+    on_loaded : callable, optional
+        called as on_loaded(indices, custom_names) after the file is loaded,
+        with the positions of the chosen columns and their custom names
+        (empty string if not given); used by the bulk import
     '''
     # Create a dialog window
     dialog = QWidget()
@@ -117,18 +333,9 @@ def show_column_selection(app_instance, file_path, header, index_to_replace=None
     selected_columns = {}
     custom_names     = {}
 
-    # Preview Data Table
-    all_df = pd.read_csv(file_path, sep="\t").drop([0, 1, 2])
-    table = QTableWidget()
-    table.setRowCount(len(all_df))
-    table.setColumnCount(len(all_df.columns))
-    table.setHorizontalHeaderLabels(list(all_df.columns))
-
-    for i in range(len(all_df)):
-        for j, col in enumerate(all_df.columns):
-            item = QTableWidgetItem(str(all_df.iloc[i, j]))
-            item.setFlags(item.flags() ^ Qt.ItemIsEditable)
-            table.setItem(i, j, item)
+    # Preview Data Table, the cells are created only when visible
+    table = QTableView()
+    table.setModel(ArrayTableModel(data, header.columns, parent=table))
 
     table.setFixedHeight(250)
     main_layout.addWidget(table)
@@ -139,7 +346,7 @@ def show_column_selection(app_instance, file_path, header, index_to_replace=None
     scroll_content = QWidget()
     scroll_layout = QVBoxLayout(scroll_content)
 
-    for i, col_name in enumerate(header):
+    for i, col_name in enumerate(header.columns):
         box = QHBoxLayout()
         checkbox = QCheckBox(col_name)
         checkbox.setChecked(True)
@@ -157,35 +364,27 @@ def show_column_selection(app_instance, file_path, header, index_to_replace=None
     # Confirm button
     def submit_selection():
         try:
-            columns_to_load = [header[i] for i in range(len(header)) if selected_columns[i].isChecked()]
+            names = header.columns
+            indices = [i for i in range(len(names)) if selected_columns[i].isChecked()]
+            columns_to_load = [names[i] for i in indices]
             column_names = [
-                custom_names[i].text() or f"{os.path.splitext(os.path.basename(file_path))[0]}_{header[i]}"
-                for i in range(len(header)) if selected_columns[i].isChecked()
+                custom_names[i].text() or f"{os.path.splitext(os.path.basename(file_path))[0]}_{names[i]}"
+                for i in indices
             ]
 
-            df_header = pd.read_csv(file_path, sep="\t", nrows=3)
-            app_instance.header_lines.append(df_header)
-
-            df_data = pd.read_csv(file_path, sep="\t", usecols=columns_to_load)
-            df_data.columns = column_names
-            df_data = df_data.drop([0, 1, 2])
+            # The file has already been read, just take the selected columns
+            df_data = pd.DataFrame({name: data[:, i] for name, i in zip(column_names, indices)})
+            set_source_columns(df_data, columns_to_load)
 
             app_instance.logger.info(f"Dal file: {file_path}, caricate le colonne: {columns_to_load}")
-
-            df_data.attrs["filename"] = os.path.basename(file_path)
-
-            if index_to_replace is not None:
-                app_instance.dataframes[index_to_replace]   = df_data
-                app_instance.header_lines[index_to_replace] = df_header
-                app_instance.logger.info(f"File '{file_path}' sovrascritto in posizione {index_to_replace}")
-            else:
-                app_instance.dataframes.append(df_data)
-                app_instance.header_lines.append(df_header)
-                app_instance.logger.info(f"File '{file_path}' aggiunto")
+            add_dataframe(app_instance, file_path, header, df_data, index_to_replace)
 
             QMessageBox.information(dialog, "Successo", f"Dati caricati da {file_path}!")
             app_instance.refresh_shell_variables()
             dialog.close()
+
+            if on_loaded is not None:
+                on_loaded(indices, [custom_names[i].text() for i in indices])
         except Exception as e:
             QMessageBox.critical(dialog, "Errore", f"Errore durante il caricamento:\n{e}")
 
@@ -199,37 +398,6 @@ def show_column_selection(app_instance, file_path, header, index_to_replace=None
 # Functions to save modified data                                                              #
 #==============================================================================================#
 
-def save_header(app_instance, df, file_path):
-    '''
-    Save the header in the final text file,
-    to provide compatibility in case you want to
-    reopen it for further analysis.
-
-    Parameters
-    ----------
-    app_instance : MainApp object
-        instance of MainApp from main_window.py
-    df : pandas dataframe
-        dataframe containing only the header of the data file
-    file_path : string
-        path of the file to save
-    '''
-    try:
-        with open(file_path, "w", encoding='utf-8') as f:
-            # Write the names of the columns
-            f.write("\t".join(df.columns) + "\n")
-            
-            # Writes every row of the DataFrame, ignoring NaNs
-            for _, row in df.iterrows():
-                line = "\t".join(row.astype(str).fillna("").replace("nan", "").values)
-                f.write(line.strip() + "\n")
-        app_instance.logger.info(f"File salvato correttamente in: {file_path}")
-
-    except Exception as e:
-        app_instance.logger.info(f"Errore durante il salvataggio: {e}")
-
-#==============================================================================================#
-
 def save_modified_data(app_instance, parent_widget):
     ''' 
     Allows you to choose the file and data to save, with the related headers.
@@ -272,20 +440,34 @@ def save_modified_data(app_instance, parent_widget):
 
     layout.addWidget(combo)
 
+    layout.addWidget(QLabel("Formato dei numeri (es. %.6E, %.4f):"))
+    fmt_edit = QLineEdit(DEFAULT_FMT)
+    layout.addWidget(fmt_edit)
+
     save_button = QPushButton("Salva")
     layout.addWidget(save_button)
 
+    n_modified = sum(bool(df.attrs.get("modified")) for df in dataframes)
+    save_all_button = QPushButton(f"Salva tutti i file modificati ({n_modified})")
+    save_all_button.setEnabled(n_modified > 0)
+    layout.addWidget(save_all_button)
+
     def on_save_clicked():
         df_idx = combo.currentIndex()
-        save_to_file(df_idx, app_instance, parent_widget)
+        save_to_file(df_idx, app_instance, parent_widget, fmt=fmt_edit.text() or DEFAULT_FMT)
+        dialog.accept()
+
+    def on_save_all_clicked():
+        save_all_modified(app_instance, parent_widget, fmt=fmt_edit.text() or DEFAULT_FMT)
         dialog.accept()
 
     save_button.clicked.connect(on_save_clicked)
+    save_all_button.clicked.connect(on_save_all_clicked)
 
     dialog.exec_()
 
 
-def save_to_file(df_idx, app_instance, parent_widget=None):
+def save_to_file(df_idx, app_instance, parent_widget=None, fmt=DEFAULT_FMT):
     '''
     Save the selected data to a new text file.
     If fewer columns than the 8 available are loaded,
@@ -297,8 +479,10 @@ def save_to_file(df_idx, app_instance, parent_widget=None):
         index of the selected dataframe
     app_instance : MainApp object
         instance of MainApp from main_window.py
-    save_window : Toplevel object
-        window to close after saving the data
+    parent_widget : QWidget or None
+        parent widget for the dialogs
+    fmt : string, optional
+        printf-style format of each number
     '''  
 
     dataframes   = app_instance.dataframes
@@ -323,30 +507,55 @@ def save_to_file(df_idx, app_instance, parent_widget=None):
             QMessageBox.warning(parent_widget, "Annullato", "Operazione annullata.")
             return
 
-        save_header(app_instance, header, file_path)
-        # Save the data in the new file in text format
-        with open(file_path, "a", encoding='utf-8') as f:
+        write_labview_file(file_path, header, df.to_numpy(dtype=float), fmt)
+        df.attrs["modified"] = False
+        app_instance.logger.info(f"File salvato correttamente in: {file_path}")
+
+        QMessageBox.information(parent_widget, "Successo", f"Dati salvati con successo in:\n{file_path}")
+
+    except Exception as e:
+        QMessageBox.critical(parent_widget, "Errore", f"Errore durante il salvataggio:\n{e}")
 
-            data = np.array(df)
-            rows, cols = data.shape
 
-            # Create a zero matrix with 8 columns
-            expanded_data = np.zeros((rows, 8))
+def save_all_modified(app_instance, parent_widget=None, fmt=DEFAULT_FMT):
+    '''
+    Save all the modified files in a chosen directory.
+    Each file is saved with the name of the original file plus "_mod".
 
-            if cols == 4:
-                # Intersperses each original column with a column of zeros
-                expanded_data[:, ::2] = data
-            elif cols == 6:
-                # Inserts a column of zeros as the fourth and final column
-                expanded_data[:, :3]  = data[:, :3]
-                expanded_data[:, 4:7] = data[:, 3:]
-            elif cols == 8:
-                # All data
-                expanded_data = data
+    Parameters
+    ----------
+    app_instance : MainApp object
+        instance of MainApp from main_window.py
+    parent_widget : QWidget or None
+        parent widget for the dialogs
+    fmt : string, optional
+        printf-style format of each number
+    '''
+    directory = QFileDialog.getExistingDirectory(parent_widget, "Cartella dove salvare i file")
 
-            np.savetxt(f, expanded_data, delimiter="\t", fmt="%s")
+    if not directory:
+        QMessageBox.warning(parent_widget, "Annullato", "Operazione annullata.")
+        return
 
-        QMessageBox.information(parent_widget, "Successo", f"Dati salvati con successo in:\n{file_path}")
+    saved, errors = [], []
+    for df, header in zip(app_instance.dataframes, app_instance.header_lines):
+        if not df.attrs.get("modified"):
+            continue
 
-    except Exception as e:
-        QMessageBox.critical(parent_widget, "Errore", f"Errore durante il salvataggio:\n{e}")
\ No newline at end of file
+        stem, ext = os.path.splitext(df.attrs.get("filename", f"file_{len(saved) + 1}.txt"))
+        file_path = os.path.join(directory, f"{stem}_mod{ext or '.txt'}")
+        try:
+            write_labview_file(file_path, header, df.to_numpy(dtype=float), fmt)
+            df.attrs["modified"] = False
+            saved.append(file_path)
+            app_instance.logger.info(f"File salvato correttamente in: {file_path}")
+        except Exception as e:
+            errors.append(f"{file_path}: {e}")
+            app_instance.logger.error(f"Errore durante il salvataggio di {file_path}: {e}")
+
+    if errors:
+        QMessageBox.critical(parent_widget, "Errore",
+                             "Errore durante il salvataggio di:\n" + "\n".join(errors))
+    else:
+        QMessageBox.information(parent_widget, "Successo",
+                                f"Salvati {len(saved)} file in:\n{directory}")
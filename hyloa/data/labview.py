@@ -0,0 +1,236 @@
+"""
+Reader and writer of the LabVIEW data files.
+Nothing here depends on Qt, so the files can be read and written
+also by the headless batch processing (see hyloa/batch.py).
+"""
+import re
+import numpy as np
+import pandas as pd
+from dataclasses import dataclass, field
+
+
+#==============================================================================================#
+# Parser of the LabVIEW files                                                                  #
+#==============================================================================================#
+
+# Number of metadata lines between the names of the columns and the data
+N_METADATA_LINES = 3
+
+# A metadata entry is a name followed by a value, e.g. "MaxV 30.00" or "Sen1(mV) 5.0E-1",
+# the value can also be glued to the name, e.g. "Rot Ell Izero Parameters3.478239E-3"
+_NUMBER   = r"[-+]?(?:\d+\.?\d*|\.\d+)(?:[eE][-+]?\d+)?"
+_ENTRY_RE = re.compile(rf"^(?P<key>.*?)\s*(?P<value>{_NUMBER})$")
+
+
+@dataclass
+class LabviewHeader:
+    '''
+    Header of a LabVIEW data file.
+
+    Attributes
+    ----------
+    columns : list of str
+        names of the columns, first line of the file
+    lines : list of str
+        metadata lines, kept verbatim to write them back when saving
+    fields : dict
+        typed metadata, e.g. {"MaxV": 30.0, "Steps": 180, "Polarization": "s"};
+        values without a name are appended to the previous entry,
+        which becomes a list (e.g. "Rot Ell Izero Parameters")
+    '''
+    columns : list
+    lines   : list = field(default_factory=list)
+    fields  : dict = field(default_factory=dict)
+
+
+def _parse_value(text):
+    '''
+    Convert a metadata value into int or float if possible.
+    '''
+    try:
+        return int(text)
+    except ValueError:
+        pass
+    try:
+        return float(text)
+    except ValueError:
+        return text
+
+
+def parse_metadata(lines):
+    '''
+    Split the metadata lines of a LabVIEW file into typed fields.
+
+    Parameters
+    ----------
+    lines : list of str
+        metadata lines of the file
+
+    Returns
+    -------
+    fields : dict
+        {name : value} for each entry of the metadata
+    '''
+    fields   = {}
+    last_key = None
+
+    for line in lines:
+        for token in line.strip().split("\t"):
+            token = token.strip()
+            if not token:
+                continue
+
+            match = _ENTRY_RE.match(token)
+            if match:
+                key, value = match.group("key"), _parse_value(match.group("value"))
+            elif " " in token:
+                key, value = token.rsplit(" ", 1)
+            else:
+                key, value = token, ""
+
+            if not key and last_key is not None:
+                # Value without a name: continuation of the previous entry
+                previous = fields[last_key]
+                fields[last_key] = (previous if isinstance(previous, list) else [previous]) + [value]
+                continue
+
+            fields[key] = value
+            last_key    = key
+
+    return fields
+
+
+def read_labview_file(file_path):
+    '''
+    Read a LabVIEW data file (see load_files for the structure) with a single pass.
+    The header and the metadata are read line by line, then the numeric body
+    is parsed directly into a float64 array by the C parser of pandas.
+
+    Parameters
+    ----------
+    file_path : string
+        path of the file to read
+
+    Returns
+    -------
+    header : LabviewHeader
+        names of the columns and metadata of the file
+    data : 2darray
+        float64 data with shape (n_points, n_columns)
+    '''
+    with open(file_path, "r", encoding="utf-8") as f:
+        columns = f.readline().strip().split("\t")
+        lines   = [f.readline().rstrip("\r\n") for _ in range(N_METADATA_LINES)]
+
+        try:
+            data = pd.read_csv(
+                f, sep="\t", header=None, usecols=range(len(columns)),
+                dtype=np.float64, skip_blank_lines=True
+            ).to_numpy()
+        except pd.errors.EmptyDataError:
+            data = np.empty((0, len(columns)))
+
+    header = LabviewHeader(columns, lines, parse_metadata(lines))
+
+    return header, data
+
+
+def header_from_frame(df_header):
+    '''
+    Build a LabviewHeader from the DataFrame used by the old
+    versions to store the header (e.g. in saved sessions).
+
+    Parameters
+    ----------
+    df_header : pandas dataframe
+        dataframe with the names of the columns and the metadata lines
+
+    Returns
+    -------
+    LabviewHeader
+    '''
+    lines = [
+        "\t".join(str(v) for v in row if not pd.isna(v))
+        for row in df_header.itertuples(index=False)
+    ]
+    return LabviewHeader([str(c) for c in df_header.columns], lines, parse_metadata(lines))
+
+
+#==============================================================================================#
+# Writer of the LabVIEW files                                                                  #
+#==============================================================================================#
+
+# Default numeric format of the saved files, same notation of the LabVIEW files
+DEFAULT_FMT = "%.6E"
+
+
+def expand_columns(data):
+    '''
+    Bring the data to the 8 columns layout of the LabVIEW files.
+    If fewer columns than the 8 available are loaded,
+    columns of zeros are added to maintain compatibility.
+
+    Parameters
+    ----------
+    data : 2darray
+        data with 4, 6 or 8 columns
+
+    Returns
+    -------
+    2darray
+        data with 8 columns
+    '''
+    rows, cols = data.shape
+
+    if cols == 8:
+        # All data
+        return data
+
+    # Create a zero matrix with 8 columns
+    expanded_data = np.zeros((rows, 8))
+
+    if cols == 4:
+        # Intersperses each original column with a column of zeros
+        expanded_data[:, ::2] = data
+    elif cols == 6:
+        # Inserts a column of zeros as the fourth and final column
+        expanded_data[:, :3]  = data[:, :3]
+        expanded_data[:, 4:7] = data[:, 3:]
+    else:
+        raise ValueError(f"Impossibile salvare {cols} colonne, servono 4, 6 o 8 colonne.")
+
+    return expanded_data
+
+
+def write_labview_file(file_path, header, data, fmt=DEFAULT_FMT, chunk_size=10000):
+    '''
+    Write header and data with the structure of the LabVIEW files,
+    so that the file can be reopened for further analysis.
+    The rows are formatted in blocks with a single string operation,
+    instead of one call for each row.
+
+    Parameters
+    ----------
+    file_path : string
+        path of the file to save
+    header : LabviewHeader
+        header of the data file
+    data : 2darray
+        data with 4, 6 or 8 columns, see expand_columns
+    fmt : string, optional
+        printf-style format of each number, default "%.6E"
+    chunk_size : int, optional
+        number of rows formatted at once
+    '''
+    data = expand_columns(np.asarray(data, dtype=float))
+    row  = "\t".join([fmt] * data.shape[1]) + "\n"
+
+    with open(file_path, "w", encoding='utf-8') as f:
+        # Write the names of the columns and the metadata
+        f.write("\t".join(header.columns) + "\n")
+        for line in header.lines:
+            f.write(line.strip() + "\n")
+
+        for start in range(0, data.shape[0], chunk_size):
+            block = data[start:start + chunk_size]
+            f.write((row * block.shape[0]) % tuple(block.ravel()))
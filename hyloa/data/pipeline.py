@@ -0,0 +1,326 @@
+"""
+Code to describe a chain of operations on the loops (normalization,
+closure, inversions, fits) as a pipeline of stages with their parameters,
+that can be written in JSON or YAML and applied to any file.
+
+The stages are not applied one after the other to the whole columns.
+Each operation changes a column only by a scale, an offset and a linear
+ramp whose coefficients depend on a few points at the ends of the
+branches, so the pipeline only keeps, for each column, the coefficients
+of the transformation accumulated so far. The data are read once and
+written once at the end (or before a fit, that needs all the points).
+Nothing here depends on Qt.
+
+Example of a pipeline in YAML:
+
+::
+
+    stages:
+      - op: close
+        columns: [UpRot, DwRot]
+      - op: norm
+        columns: [UpRot, DwRot]
+        window: 5
+      - op: invert
+        columns: [FieldUp, FieldDw]
+"""
+import os
+import json
+import logging
+import numpy as np
+from dataclasses import dataclass, field
+
+from hyloa.data.core import normalization_parameters, closure_parameters
+from hyloa.data.fitting import fit_columns
+from hyloa.data.provenance import STEPS_VERSION
+
+
+# Operations that can be applied; "code" (columns written by the shell) is only recorded
+OPERATIONS = ("norm", "close", "invert", "fit")
+
+logger = logging.getLogger(__name__)
+
+
+@dataclass
+class Stage:
+    '''
+    One operation of a pipeline.
+
+    Attributes
+    ----------
+    op : str
+        name of the operation, see OPERATIONS
+    columns : list of str
+        columns used, in pairs (increasing, decreasing branch)
+        for norm and close, x and y for fit
+    params : dict
+        other parameters: window for norm; expression, param_names,
+        p0 and x_range for fit
+    '''
+    op      : str
+    columns : list
+    params  : dict = field(default_factory=dict)
+
+    @classmethod
+    def from_step(cls, step):
+        ''' Stage from a dictionary {"op", "columns", **params}
+        '''
+        step = dict(step)
+        return cls(step.pop("op"), list(step.pop("columns", [])), step)
+
+    def to_step(self):
+        ''' Dictionary {"op", "columns", **params}, can be written in JSON
+        '''
+        return {"op": self.op, "columns": list(self.columns), **self.params}
+
+    def validate(self):
+        ''' Raise ValueError if the stage cannot be applied
+        '''
+        if self.op == "code":
+            return
+        if self.op not in OPERATIONS:
+            raise ValueError(f"Operazione sconosciuta: {self.op}")
+        if self.op in ("norm", "close") and (not self.columns or len(self.columns) % 2):
+            raise ValueError(f"{self.op}: le colonne vanno date a coppie (ramo up, ramo down).")
+        if self.op == "norm" and int(self.params.get("window", 5)) < 1:
+            raise ValueError("La finestra per la media deve contenere almeno un punto.")
+        if self.op == "fit":
+            if len(self.columns) != 2:
+                raise ValueError("fit: servono le colonne x e y.")
+            missing = [k for k in ("expression", "param_names", "x_range") if k not in self.params]
+            if missing:
+                raise ValueError(f"fit: mancano i parametri {missing}.")
+
+
+class Pipeline:
+    '''
+    Ordered list of stages applied to the columns of a file.
+
+    Parameters
+    ----------
+    stages : list of Stage or dict
+        stages of the pipeline, dictionaries as {"op", "columns", **params}
+    '''
+
+    def __init__(self, stages=()):
+        self.stages = [s if isinstance(s, Stage) else Stage.from_step(s) for s in stages]
+        for stage in self.stages:
+            stage.validate()
+
+    def __len__(self):
+        return len(self.stages)
+
+    #==================== Construction and storage ====================#
+
+    @classmethod
+    def from_steps(cls, steps):
+        ''' Pipeline from a list of steps, see hyloa.data.provenance
+        '''
+        return cls(steps)
+
+    @classmethod
+    def from_names(cls, names, columns, window=5):
+        '''
+        Pipeline applying some operations to the same pairs of columns.
+
+        Parameters
+        ----------
+        names : list of str
+            operations in order, "norm", "close" or "invert"
+        columns : list of str
+            columns, in pairs (increasing, decreasing branch)
+        window : int, optional
+            number of points used for the averages of the normalization
+
+        Returns
+        -------
+        Pipeline
+        '''
+        return cls([
+            Stage(name, list(columns), {"window": window} if name == "norm" else {})
+            for name in names
+        ])
+
+    @classmethod
+    def load(cls, file_path):
+        '''
+        Read a pipeline from a JSON or YAML file (.yaml, .yml; needs PyYAML).
+        The file contains the list of stages, or a dictionary with the list
+        under "stages" or "steps" (as written by hyloa.data.provenance.save_steps).
+
+        Parameters
+        ----------
+        file_path : str
+            path of the file
+
+        Returns
+        -------
+        Pipeline
+        '''
+        with open(file_path, "r", encoding="utf-8") as f:
+            if os.path.splitext(file_path)[1].lower() in (".yaml", ".yml"):
+                try:
+                    import yaml
+                except ImportError:
+                    raise ImportError("Per leggere pipeline in YAML serve il pacchetto PyYAML.")
+                content = yaml.safe_load(f)
+            else:
+                content = json.load(f)
+
+        if isinstance(content, dict):
+            if content.get("version", 0) > STEPS_VERSION:
+                raise ValueError("Il file delle operazioni è stato scritto da una versione più recente di hyloa.")
+            content = content.get("stages", content.get("steps"))
+        if not isinstance(content, list):
+            raise ValueError("Il file non contiene una lista di operazioni.")
+
+        return cls(content)
+
+    def to_steps(self):
+        ''' The stages as a list of dictionaries, see Stage.to_step
+        '''
+        return [stage.to_step() for stage in self.stages]
+
+    def save(self, file_path):
+        '''
+        Write the pipeline in a JSON file, or YAML if the extension is .yaml or .yml.
+
+        Parameters
+        ----------
+        file_path : str
+            path of the file
+        '''
+        content = {"stages": self.to_steps()}
+        with open(file_path, "w", encoding="utf-8") as f:
+            if os.path.splitext(file_path)[1].lower() in (".yaml", ".yml"):
+                import yaml
+                yaml.safe_dump(content, f, sort_keys=False)
+            else:
+                json.dump(content, f, indent=1)
+
+    def columns_used(self):
+        ''' Names of all the columns read by the pipeline, in order of appearance
+        '''
+        return list(dict.fromkeys(c for s in self.stages if s.op != "code" for c in s.columns))
+
+    def modified_columns(self):
+        ''' Names of the columns changed by the pipeline
+        '''
+        return list(dict.fromkeys(
+            c for s in self.stages if s.op in ("norm", "close", "invert") for c in s.columns
+        ))
+
+    #==================== Execution ====================#
+
+    def run(self, columns):
+        '''
+        Apply the pipeline to the columns of a file.
+
+        Parameters
+        ----------
+        columns : dict
+            {column name : 1darray}, all the arrays with the same length;
+            the entries of the modified columns are replaced with the
+            new data, the given arrays are never modified
+
+        Returns
+        -------
+        list of dict
+            one row for each fit, as returned by hyloa.data.fitting.fit_columns
+            with the names of the x and y columns
+        '''
+        names   = self.columns_used()
+        missing = [c for c in names if c not in columns]
+        if missing:
+            raise KeyError(f"Colonne non trovate: {missing}")
+        if not names:
+            return []
+
+        row  = {name: k for k, name in enumerate(names)}
+        work = np.array([columns[c] for c in names], dtype=float)     # The only copy of the data
+        n    = work.shape[1]
+
+        # Value of point i of row r: scale[r] * work[r, i] + offset[r] + slope[r] * i
+        scale  = np.ones(len(names))
+        offset = np.zeros(len(names))
+        slope  = np.zeros(len(names))
+
+        def values(rows, idx):
+            ''' Current values of some points of some rows
+            '''
+            idx = np.asarray(idx)
+            return (scale[rows, None] * work[np.ix_(rows, idx)]
+                    + offset[rows, None] + slope[rows, None] * idx)
+
+        def materialize(rows):
+            ''' Apply the accumulated transformation to the data of some rows
+            '''
+            i = np.arange(n)
+            for r in rows:
+                if scale[r] == 1.0 and offset[r] == 0.0 and slope[r] == 0.0:
+                    continue
+                work[r] *= scale[r]
+                work[r] += offset[r]
+                if slope[r] != 0.0:
+                    work[r] += slope[r] * i
+                scale[r], offset[r], slope[r] = 1.0, 0.0, 0.0
+
+        fit_rows = []
+        for stage in self.stages:
+            if stage.op == "code":
+                logger.warning(f"Colonne {stage.columns} modificate dalla shell: "
+                               "passo non riproducibile, ignorato.")
+                continue
+
+            rows = np.array([row[c] for c in stage.columns], dtype=int)
+
+            if stage.op == "invert":
+                scale[rows]  *= -1
+                offset[rows] *= -1
+                slope[rows]  *= -1
+
+            elif stage.op == "norm":
+                window = int(stage.params.get("window", 5))
+                if n < window:
+                    raise ValueError(f"Ogni ramo deve avere almeno {window} punti.")
+                up, dw = rows[::2], rows[1::2]
+                heads  = np.stack([values(up, np.arange(window)),
+                                   values(dw, np.arange(window))], axis=1)
+                tails  = np.stack([values(up, np.arange(n - window, n)),
+                                   values(dw, np.arange(n - window, n))], axis=1)
+                shift, amplitude = normalization_parameters(heads, tails)
+
+                for branch in (up, dw):
+                    scale[branch]  = scale[branch] / amplitude
+                    offset[branch] = (offset[branch] - shift) / amplitude
+                    slope[branch]  = slope[branch] / amplitude
+
+            elif stage.op == "close":
+                if n < 2:
+                    continue
+                up, dw = rows[::2], rows[1::2]
+                ends_up, ends_dw = values(up, [0, n - 1]), values(dw, [0, n - 1])
+                c0, c1 = closure_parameters(ends_up[:, 0], ends_up[:, 1],
+                                            ends_dw[:, 0], ends_dw[:, 1], n)
+                offset[up] -= c0
+                slope[up]  -= c1
+                offset[dw] += c0
+                slope[dw]  += c1
+
+            elif stage.op == "fit":
+                materialize(rows)
+                x_data, y_data = work[rows[0]], work[rows[1]]
+                x_start, x_end = stage.params["x_range"]
+                mask = (x_data >= x_start) & (x_data <= x_end)
+
+                fit_row = fit_columns(stage.params["expression"], stage.params["param_names"],
+                                      x_data[mask], y_data[mask], stage.params.get("p0"))
+                fit_row.update({"x": stage.columns[0], "y": stage.columns[1]})
+                fit_rows.append(fit_row)
+
+        modified = [row[c] for c in self.modified_columns()]
+        materialize(modified)
+        for r in modified:
+            columns[names[r]] = work[r]
+
+        return fit_rows
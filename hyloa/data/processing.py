@@ -1,12 +1,61 @@
 """
 Code that contains some standard operations to do on the data.
+The numerical part of each operation lives in hyloa.data.core,
+here there are only the Qt dialogs that call it.
 """
-import numpy as np
 from PyQt5.QtWidgets import (
     QDialog, QVBoxLayout, QLabel, QComboBox, QCheckBox, QPushButton,
-    QMessageBox, QScrollArea, QWidget, QFormLayout
+    QMessageBox, QScrollArea, QWidget, QFormLayout, QSpinBox, QFileDialog
 )
 
+from hyloa.data.core import normalize_dataframes, close_loop, invert
+from hyloa.data.provenance import record_step, source_name
+from hyloa.data.history import take_snapshot
+from hyloa.data.pipeline import Pipeline
+from hyloa.data.fitting import update_fit_table
+
+
+def update_columns(df, new_columns, app_instance=None, step=None, steps=None):
+    '''
+    Write the new values of some columns in a DataFrame and mark it
+    as modified, so that it can be saved with the other modified files.
+    The application is notified of the change (see MainApp.columns_changed),
+    e.g. to record it in the autosave and to update the shell variables.
+
+    Parameters
+    ----------
+    df : pandas dataframe
+        dataframe to update
+    new_columns : dict
+        {column name : new values}
+    app_instance : MainApp, optional
+        application owning the dataframe
+    step : dict, optional
+        operation that produced the values, as {"op": name, **parameters};
+        it is recorded in the provenance of the dataframe, with the
+        written columns (see hyloa.data.provenance.record_step)
+    steps : list of dict, optional
+        steps already in the form of the provenance (e.g. a whole pipeline)
+        added to the provenance of the dataframe
+    '''
+    label = step["op"] if step is not None else "pipeline" if steps else "modifica"
+
+    # The old arrays are replaced, not modified: keeping them is enough to undo
+    before = take_snapshot(df, new_columns, label)
+
+    for col, new_values in new_columns.items():
+        df[col] = new_values
+    df.attrs["modified"] = True
+
+    if step is not None:
+        record_step(df, columns=list(new_columns), **step)
+    if steps:
+        df.attrs.setdefault("provenance", []).extend(steps)
+
+    notify = getattr(app_instance, "columns_changed", None)
+    if notify is not None:
+        notify(df, list(new_columns), before)
+
 
 #==============================================================================================#
 # Function to normalize curves in the interval [-1, 1]                                         #
@@ -82,6 +131,15 @@ def norm_dialog(plot_instance, app_instance):
     file_combo.currentIndexChanged.connect(update_column_list)
     update_column_list()
 
+    options_layout = QFormLayout()
+    window_spin = QSpinBox()
+    window_spin.setRange(1, 1000)
+    window_spin.setValue(5)
+    options_layout.addRow("Punti per la media agli estremi:", window_spin)
+    all_files_check = QCheckBox("Applica a tutti i file con lo stesso numero di colonne")
+    options_layout.addRow(all_files_check)
+    layout.addLayout(options_layout)
+
     def on_apply():
         selected_file_idx = file_combo.currentIndex()
         selected_cols = [col for col, cb in column_checks.items() if cb.isChecked()]
@@ -89,7 +147,8 @@ def norm_dialog(plot_instance, app_instance):
             QMessageBox.critical(dialog, "Errore", "Seleziona un numero pari di colonne.")
             return
         dialog.accept()
-        apply_norm(plot_instance, app_instance, selected_file_idx, selected_cols)
+        apply_norm(plot_instance, app_instance, selected_file_idx, selected_cols,
+                   window=window_spin.value(), all_files=all_files_check.isChecked())
 
     apply_button = QPushButton("Applica")
     apply_button.clicked.connect(on_apply)
@@ -97,24 +156,36 @@ def norm_dialog(plot_instance, app_instance):
 
     dialog.exec_()
 
-def apply_norm(plot_instance, app_instance, file_index, selected_cols):
+def apply_norm(plot_instance, app_instance, file_index, selected_cols, window=5, all_files=False):
     '''
     Cycle normalization function.
     For each cycle the procedure implemented is the following:
 
-    1) Compute the initial and final average values of the first and last 5 points of each branch.
+    1) Compute the initial and final average values of the first and last points of each branch.
     2) Reconcile the average values to correct any inconsistencies in direction.
        If both branches grow or decrease in a coherent way, the averages of the same
        branch are averaged. Otherwise, the "cross-branch" average is averaged.
     3) Compute the shift and the amplitude of the cycle.
     4) Normalize the branches so that the cycle is centered and with unit amplitude.
 
+    All the selected loops (of one or all the files) are normalized
+    together, see hyloa.data.core.normalize_dataframes.
+
     Parameters
     ----------
     plot_instance : instance of the plot class
         Instance of the plot class
     app_instance : MainApp
         Main application instance containing the session data.
+    file_index : int
+        Index of the selected DataFrame.
+    selected_cols : list of str
+        Columns to normalize, in pairs.
+    window : int, optional
+        Number of points at the ends of each branch used for the averages, default 5.
+    all_files : bool, optional
+        If True the columns in the same positions are normalized in every
+        file with the same number of columns of the selected one.
     '''
 
     parent_widget  = app_instance
@@ -122,46 +193,39 @@ def apply_norm(plot_instance, app_instance, file_index, selected_cols):
     logger         = app_instance.logger
 
     try:
-        df = app_instance.dataframes[file_index]
-   
-        N_Y = []
-        for y1, y2 in zip(selected_cols[::2], selected_cols[1::2]):
-            ell_up = df[y1].astype(float).values
-            ell_dw = df[y2].astype(float).values
-
-            # Compute averages at start/end
-            aveup1 = np.mean(ell_up[:5])
-            aveup2 = np.mean(ell_up[-5:])
-            avedw1 = np.mean(ell_dw[:5])
-            avedw2 = np.mean(ell_dw[-5:])
-
-            # Branch direction correction
-            if ((aveup1 > aveup2 and avedw1 > avedw2) or (aveup1 < aveup2 and avedw1 < avedw2)):
-                aveup1 = (aveup1 + avedw1) * 0.5
-                avedw1 = (aveup2 + avedw2) * 0.5
-            else:
-                aveup1 = (aveup1 + avedw2) * 0.5
-                avedw1 = (aveup2 + avedw1) * 0.5
+        df = dataframes[file_index]
+
+        # Positions of the selected columns, to find the same loops in the other files
+        positions = [list(df.columns).index(col) for col in selected_cols]
 
-            v_shift = (aveup1 + avedw1) * 0.5
-            v_amplitude = abs(aveup1 - avedw1) * 0.5
+        if all_files:
+            indices = [i for i, d in enumerate(dataframes) if len(d.columns) == len(df.columns)]
+        else:
+            indices = [file_index]
 
-            # Normalize
-            ell_up_normalized = (ell_up - v_shift) / v_amplitude
-            ell_dw_normalized = (ell_dw - v_shift) / v_amplitude
+        pairs = []
+        for i in indices:
+            cols = [dataframes[i].columns[p] for p in positions]
+            pairs.append(list(zip(cols[::2], cols[1::2])))
 
-            N_Y.append((y1, ell_up_normalized))
-            N_Y.append((y2, ell_dw_normalized))
+        results = normalize_dataframes([dataframes[i] for i in indices], pairs, window)
 
-        for col, new_values in N_Y:
-            df[col] = new_values
-            logger.info(f"Normalizzazione applicata a {col}.")
+        for i, new_columns in zip(indices, results):
+            update_columns(dataframes[i], new_columns, app_instance,
+                           step={"op": "norm", "window": window})
+            for col in new_columns:
+                logger.info(f"Normalizzazione applicata a {col}.")
 
-        # Re-plot
-        plot_instance.plot()
+        # Re-plot; with all the files also the other plots may show modified data
+        plot_instance.request_plot()
+        if all_files:
+            for widget in app_instance.plot_widgets.values():
+                if widget.figure is not None:
+                    widget.request_plot()
 
+        files = ", ".join(f"{i + 1}" for i in indices)
         QMessageBox.information(plot_instance, "Successo",
-                                f"Normalizzazione applicata su File {file_index + 1}.")
+                                f"Normalizzazione applicata su File {files}.")
         
     except Exception as e:
         QMessageBox.critical(parent_widget, "Errore", f"Errore durante la normalizzazione:\n{e}")
@@ -298,44 +362,22 @@ def apply_loop_closure(plot_instance, app_instance, file_index, selected_cols):
             QMessageBox.warning(plot_instance, "Errore", "Devi selezionare la coppia di dati che crea il ciclo.")
             return
 
+        # All the selected loops are corrected together as a (n_loops, n_points) stack
+        cols_up = selected_cols[::2]
+        cols_dw = selected_cols[1::2]
+        ell_up, ell_dw = close_loop(df[cols_up].to_numpy().T, df[cols_dw].to_numpy().T)
+
         N_Y = []
-        for col1, col2 in zip(selected_cols[::2], selected_cols[1::2]):
-            ell_up = df[col1].astype(float).values
-            ell_dw = df[col2].astype(float).values
-
-            num = len(ell_up)
-            dy_start = abs(ell_up[0] - ell_dw[0])
-            dy_stop = abs(ell_up[-1] - ell_dw[-1])
-
-            if dy_start > dy_stop:
-                if ell_up[0] > ell_dw[0]:
-                    for i in range(num):
-                        ell_up[i] -= (0.5 * (num - 1 - i) * dy_start) / (num - 1)
-                        ell_dw[i] += (0.5 * (num - 1 - i) * dy_start) / (num - 1)
-                else:
-                    for i in range(num):
-                        ell_up[i] += (0.5 * (num - 1 - i) * dy_start) / (num - 1)
-                        ell_dw[i] -= (0.5 * (num - 1 - i) * dy_start) / (num - 1)
-
-            if dy_start < dy_stop:
-                if ell_up[-1] > ell_dw[-1]:
-                    for i in range(num - 1, -1, -1):
-                        ell_up[i] -= (0.5 * i * dy_stop) / (num - 1)
-                        ell_dw[i] += (0.5 * i * dy_stop) / (num - 1)
-                else:
-                    for i in range(num - 1, -1, -1):
-                        ell_up[i] += (0.5 * i * dy_stop) / (num - 1)
-                        ell_dw[i] -= (0.5 * i * dy_stop) / (num - 1)
-
-            N_Y.append((col1, ell_up))
-            N_Y.append((col2, ell_dw))
-
-        for col, new_values in N_Y:
-            df[col] = new_values
+        for col1, col2, up, dw in zip(cols_up, cols_dw, ell_up, ell_dw):
+            N_Y.append((col1, up))
+            N_Y.append((col2, dw))
+
+        update_columns(df, dict(N_Y), app_instance, step={"op": "close"})
+        for col, _ in N_Y:
             logger.info(f"Chiusura del ciclo applicata a {col}.")
 
         # Re-plot
-        plot_instance.plot()
+        plot_instance.request_plot()
 
         QMessageBox.information(plot_instance, "Successo",
                                 f"Correzione applicata su File {file_index + 1}.")
@@ -374,16 +416,18 @@ def apply_inversion(axis, file_index, selected_pairs, dataframes, logger, plot_i
             if axis in ("x", "both"):
                 x_col = x_combo.currentText()
                 if x_col in df.columns:
-                    df[x_col] = df[x_col].astype(float) * -1
+                    update_columns(df, {x_col: invert(df[x_col].to_numpy())}, plot_instance.app_instance,
+                                   step={"op": "invert"})
                     logger.info(f"Inversione asse x -> colonna {x_col}.")
 
             if axis in ("y", "both"):
                 y_col = y_combo.currentText()
                 if y_col in df.columns:
-                    df[y_col] = df[y_col].astype(float) * -1
+                    update_columns(df, {y_col: invert(df[y_col].to_numpy())}, plot_instance.app_instance,
+                                   step={"op": "invert"})
                     logger.info(f"Inversione asse y -> colonna {y_col}.")
 
-        plot_instance.plot()
+        plot_instance.request_plot()
 
         QMessageBox.information(plot_instance, "Successo",
                                 f"Inversione asse {axis.upper()} applicata su File {file_index + 1}!")
@@ -568,12 +612,119 @@ def apply_column_inversion(file_index, selected_columns, dataframes, logger, plo
 
         for col in selected:
             if col in df.columns:
-                df[col] = df[col].astype(float) * -1
+                update_columns(df, {col: invert(df[col].to_numpy())}, plot_instance.app_instance,
+                               step={"op": "invert"})
                 logger.info(f"Inversione colonna {col} nel file {file_index + 1}.")
 
-        plot_instance.plot()
+        plot_instance.request_plot()
         QMessageBox.information(plot_instance, "Successo",
                                 f"Inversione applicata su: {', '.join(selected)}")
     except Exception as e:
         QMessageBox.critical(plot_instance, "Errore", f"Errore durante l'inversione:\n{e}")
 
+#==============================================================================================#
+# Function to apply a whole pipeline of operations                                             #
+#==============================================================================================#
+
+def pipeline_dialog(app_instance):
+    '''
+    Choose a pipeline file (JSON or YAML, see hyloa.data.pipeline)
+    and apply it to all the loaded files.
+
+    Parameters
+    ----------
+    app_instance : MainApp
+        Main application instance with session state.
+    '''
+    if not app_instance.dataframes:
+        QMessageBox.warning(app_instance, "Errore", "Non ci sono dati caricati.")
+        return
+
+    path, _ = QFileDialog.getOpenFileName(
+        app_instance, "Seleziona la pipeline", "",
+        "Pipeline (*.json *.yaml *.yml);;Tutti i file (*)"
+    )
+    if not path:
+        return
+
+    try:
+        pipeline = Pipeline.load(path)
+    except Exception as e:
+        QMessageBox.critical(app_instance, "Errore", f"Errore durante la lettura della pipeline:\n{e}")
+        return
+
+    applied, errors = apply_pipeline(app_instance, pipeline)
+    app_instance.logger.info(f"Pipeline {path} applicata a {len(applied)} file.")
+
+    message = f"Pipeline applicata su {len(applied)} file."
+    if errors:
+        message += "\nNon applicata su:\n" + "\n".join(errors)
+    QMessageBox.information(app_instance, "Pipeline", message)
+
+def apply_pipeline(app_instance, pipeline, indices=None):
+    '''
+    Apply a pipeline to some loaded files. The columns of the pipeline
+    are the names in the original files, see hyloa.data.provenance.
+    Each file is written back once, at the end of the pipeline, and
+    the stages are added to its provenance.
+
+    Parameters
+    ----------
+    app_instance : MainApp
+        Main application instance containing the session data.
+    pipeline : Pipeline
+        operations to apply
+    indices : list of int, optional
+        files to process, default all
+
+    Returns
+    -------
+    applied : list of int
+        files processed
+    errors : list of str
+        description of the files that could not be processed
+    '''
+    dataframes = app_instance.dataframes
+    logger     = app_instance.logger
+    indices    = range(len(dataframes)) if indices is None else indices
+
+    applied, errors, fit_rows = [], [], []
+    for i in indices:
+        df = dataframes[i]
+        try:
+            # Name in the file -> name in the dataframe
+            names   = {source_name(df, str(c)): c for c in df.columns}
+            missing = [c for c in pipeline.columns_used() if c not in names]
+            if missing:
+                raise KeyError(f"colonne mancanti {missing}")
+
+            columns = {c: df[names[c]].to_numpy() for c in pipeline.columns_used()}
+            rows    = pipeline.run(columns)
+
+            modified = pipeline.modified_columns()
+            if modified:
+                update_columns(df, {names[c]: columns[c] for c in modified}, app_instance,
+                               steps=pipeline.to_steps())
+            else:
+                df.attrs.setdefault("provenance", []).extend(pipeline.to_steps())
+
+            for row in rows:
+                row.update({"file": i + 1, "filename": df.attrs.get("filename", ""),
+                            "x": names[row["x"]], "y": names[row["y"]]})
+            fit_rows.extend(rows)
+            applied.append(i)
+            logger.info(f"Pipeline di {len(pipeline)} operazioni applicata al file {i + 1}.")
+
+        except Exception as e:
+            errors.append(f"File {i + 1}: {e}")
+            logger.error(f"Errore durante l'applicazione della pipeline al file {i + 1}: {e}")
+
+    if fit_rows:
+        app_instance.fit_table = update_fit_table(app_instance.fit_table, fit_rows)
+
+    for widget in app_instance.plot_widgets.values():
+        if widget.figure is not None:
+            widget.request_plot()
+    app_instance.refresh_shell_variables()
+
+    return applied, errors
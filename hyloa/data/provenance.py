@@ -0,0 +1,88 @@
+"""
+Code to record the operations applied to each file, with their
+parameters, so that the same chain can be applied again to other files.
+
+The steps of a file are kept in df.attrs["provenance"] as a list of
+dictionaries that can be written in JSON. The columns are referred to
+by their names in the original file, kept in df.attrs["source_columns"]
+when the file is loaded, so the steps do not depend on the names given
+in the gui and can be replayed on the raw data of any file with the same
+layout: a file written by save_steps is read and applied with
+hyloa.data.pipeline.Pipeline.load, e.g. by the batch processing
+(see hyloa.batch). Nothing here depends on Qt.
+"""
+import json
+
+
+STEPS_VERSION = 1
+
+
+def set_source_columns(df, source_names):
+    '''
+    Remember the names that the columns of a new DataFrame have in the
+    file they were read from, and start an empty list of steps.
+
+    Parameters
+    ----------
+    df : pandas dataframe
+        dataframe just loaded
+    source_names : list of str
+        names in the file, in the same order of df.columns
+    '''
+    df.attrs["source_columns"] = dict(zip((str(c) for c in df.columns), source_names))
+    df.attrs["provenance"]     = []
+
+
+def source_name(df, column):
+    ''' Name of a column in the original file, the column itself if unknown
+    '''
+    return df.attrs.get("source_columns", {}).get(column, column)
+
+
+def record_step(df, op, columns, **params):
+    '''
+    Add a step to the provenance of a DataFrame.
+
+    Parameters
+    ----------
+    df : pandas dataframe
+        dataframe the operation was applied to
+    op : str
+        name of the operation, see hyloa.data.pipeline.OPERATIONS
+    columns : list of str
+        columns used by the operation, names in the dataframe;
+        for norm and close in pairs (increasing, decreasing branch),
+        for fit x and y
+    **params
+        parameters of the operation, must be JSON serializable
+
+    Returns
+    -------
+    dict
+        the recorded step
+    '''
+    step = {"op": op, "columns": [source_name(df, c) for c in columns], **params}
+    df.attrs.setdefault("provenance", []).append(step)
+    return step
+
+
+def get_steps(df):
+    ''' Copy of the steps recorded for a DataFrame
+    '''
+    return [dict(step) for step in df.attrs.get("provenance", [])]
+
+
+def save_steps(file_path, steps):
+    '''
+    Write a list of steps in a JSON file, that can be read
+    with hyloa.data.pipeline.Pipeline.load.
+
+    Parameters
+    ----------
+    file_path : str
+        path of the file
+    steps : list of dict
+        steps, see record_step
+    '''
+    with open(file_path, "w", encoding="utf-8") as f:
+        json.dump({"version": STEPS_VERSION, "steps": steps}, f, indent=1)
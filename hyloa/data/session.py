@@ -1,19 +1,373 @@
 """
-Code to save a session (i.e. alla dta loaded all plot crated and so on) in .pkl files
+Code to save a session (i.e. all data loaded, all plots created and so on).
+The session is saved in a columnar archive: a zip file with a JSON manifest
+(files, headers, plots, customizations, fit results) and one .npy array for
+each column of each file, optionally compressed. Loading it never unpickles
+anything; the old .pkl sessions can still be opened.
+The columns of uncompressed archives are memory-mapped, so only the data
+actually used (e.g. the plotted columns) is read from disk. The whole
+archive is mapped once, read-only, and every column is an array on that
+single map, so a session keeps only one file descriptor open.
 """
+import os
+import gc
+import json
+import struct
 import pickle
 import logging
+import weakref
+import zipfile
+import numpy as np
+import pandas as pd
+from mmap import mmap as memory_map, ACCESS_READ
 
 from PyQt5.QtWidgets import (
     QMdiSubWindow, QMessageBox, QFileDialog
 )
 
+from hyloa.data.labview import LabviewHeader, header_from_frame, parse_metadata
+from hyloa.data.provenance import set_source_columns, source_name
 from hyloa.utils.logging_setup import setup_logging
 from hyloa.gui.plot_window import PlotControlWidget
 
+
+SESSION_EXT     = ".hyl"   # Extension of the session archives
+SESSION_VERSION = 1        # Version of the layout of the archive
+
+# Maps of the archives read by read_session_archive, {absolute path : WeakSet of mmap}
+_maps = {}
+
+SESSION_FILTER            = f"Sessione hyloa (*{SESSION_EXT})"
+SESSION_FILTER_COMPRESSED = f"Sessione hyloa compressa (*{SESSION_EXT})"
+LEGACY_FILTER             = "Sessione pickle (*.pkl)"
+
+#==============================================================================================#
+# Columnar archive                                                                             #
+#==============================================================================================#
+
+def _json_default(obj):
+    '''
+    Convert the numpy objects that json cannot serialize.
+    '''
+    if isinstance(obj, np.generic):
+        return obj.item()
+    if isinstance(obj, np.ndarray):
+        return obj.tolist()
+    raise TypeError(f"Oggetto di tipo {type(obj).__name__} non serializzabile")
+
+
+def _column_name(file_idx, col_idx):
+    ''' Name of the member of the archive containing a column
+    '''
+    return f"data/{file_idx}/{col_idx}.npy"
+
+
+def _map_member(f, buffer, zf, name):
+    '''
+    Array of a .npy member stored without compression in a zip archive,
+    built on the map of the whole archive without reading the data.
+
+    Parameters
+    ----------
+    f : file
+        the archive, open in binary mode, used to read the headers
+    buffer : mmap.mmap
+        read-only map of the whole archive
+    zf : zipfile.ZipFile
+        the open archive
+    name : str
+        name of the member
+
+    Returns
+    -------
+    ndarray or None
+        read-only array on the map, None if the member cannot be mapped
+    '''
+    info = zf.getinfo(name)
+    if info.compress_type != zipfile.ZIP_STORED:
+        return None
+
+    # Local file header: fixed 30 bytes, then name and extra field
+    f.seek(info.header_offset + 26)
+    name_len, extra_len = struct.unpack("<HH", f.read(4))
+    f.seek(info.header_offset + 30 + name_len + extra_len)
+
+    version = np.lib.format.read_magic(f)
+    if version == (1, 0):
+        shape, fortran_order, dtype = np.lib.format.read_array_header_1_0(f)
+    else:
+        shape, fortran_order, dtype = np.lib.format.read_array_header_2_0(f)
+    offset = f.tell()
+
+    if dtype.hasobject or int(np.prod(shape)) == 0:
+        return None
+
+    return np.ndarray(shape=shape, dtype=dtype, buffer=buffer, offset=offset,
+                      order="F" if fortran_order else "C")
+
+
+def is_mapped(array, file_path):
+    '''
+    True if an array is (a view of) a column mapped from an archive.
+
+    Parameters
+    ----------
+    array : ndarray
+        array to check
+    file_path : str
+        path of the archive
+    '''
+    maps = _maps.get(os.path.abspath(file_path))
+    if not maps or not isinstance(array, np.ndarray):
+        return False
+    while isinstance(array, np.ndarray):
+        array = array.base
+    return isinstance(array, memory_map) and array in maps
+
+
+def materialize(df, file_path=None):
+    '''
+    Read in memory the columns of a DataFrame memory-mapped from a session.
+
+    Parameters
+    ----------
+    df : pandas dataframe
+        dataframe loaded by read_session_archive
+    file_path : str, optional
+        only the columns mapped from this archive, default all
+
+    Returns
+    -------
+    list of str
+        columns read in memory
+    '''
+    path    = file_path or df.attrs.get("mapped_from")
+    columns = [col for col in df.columns if path and is_mapped(df[col].to_numpy(), path)]
+    for col in columns:
+        df[col] = np.array(df[col].to_numpy())
+    df.attrs.pop("mapped_from", None)
+    return columns
+
+
+def write_session_archive(file_path, session_data, compress=False):
+    '''
+    Write the session in a columnar archive.
+
+    Parameters
+    ----------
+    file_path : str
+        path of the archive
+    session_data : dict
+        dictionary with the same keys of the session, "dataframes" and
+        "header_lines" are stored as arrays, everything else must be JSON
+        serializable and goes in the manifest
+    compress : bool, optional
+        if True the members of the archive are compressed
+    '''
+    dataframes   = session_data.get("dataframes", [])
+    header_lines = session_data.get("header_lines", [])
+
+    manifest = {key: value for key, value in session_data.items()
+                if key not in ("dataframes", "header_lines")}
+    manifest["version"] = SESSION_VERSION
+    manifest["files"]   = [
+        {
+            "filename"   : df.attrs.get("filename", ""),
+            "modified"   : bool(df.attrs.get("modified", False)),
+            "columns"    : [str(c) for c in df.columns],
+            "source"     : [source_name(df, str(c)) for c in df.columns],
+            "provenance" : df.attrs.get("provenance", []),
+            "length"     : len(df),
+            "header"     : {"columns": header.columns, "lines": header.lines},
+        }
+        for df, header in zip(dataframes, header_lines)
+    ]
+
+    compression = zipfile.ZIP_DEFLATED if compress else zipfile.ZIP_STORED
+
+    # Write on a temporary file, so that a failure does not destroy the previous session
+    tmp_path = file_path + ".tmp"
+    with zipfile.ZipFile(tmp_path, "w", compression=compression, allowZip64=True) as zf:
+        zf.writestr("manifest.json", json.dumps(manifest, default=_json_default, indent=1))
+
+        for i, df in enumerate(dataframes):
+            for j, col in enumerate(df.columns):
+                with zf.open(_column_name(i, j), "w", force_zip64=True) as f:
+                    np.lib.format.write_array(f, np.ascontiguousarray(df[col].to_numpy(dtype=float)),
+                                              allow_pickle=False)
+
+    try:
+        os.replace(tmp_path, file_path)
+    except PermissionError:
+        # On Windows a file cannot be replaced while it is mapped, see release_archive
+        gc.collect()
+        try:
+            os.replace(tmp_path, file_path)
+        except PermissionError:
+            os.remove(tmp_path)
+            raise PermissionError(f"Il file {file_path} è ancora in uso dalla sessione aperta, "
+                                  "salvare la sessione in un altro file.")
+
+
+def read_session_archive(file_path, mmap=True):
+    '''
+    Read a session written by write_session_archive.
+
+    Parameters
+    ----------
+    file_path : str
+        path of the archive
+    mmap : bool, optional
+        if True (default) the columns of uncompressed archives are memory-mapped:
+        nothing is read until a column is used, e.g. by a plot or by the shell.
+        The columns are read-only arrays on a single map of the archive.
+        Compressed archives are always read in memory.
+
+    Returns
+    -------
+    session_data : dict
+        dictionary with the same keys used by save_current_session
+    '''
+    with open(file_path, "rb") as f, zipfile.ZipFile(f, "r") as zf:
+        manifest = json.loads(zf.read("manifest.json"))
+
+        # One map for all the columns; it keeps its own descriptor, so the file can be closed
+        buffer = None
+        if mmap and any(i.compress_type == zipfile.ZIP_STORED for i in zf.infolist()):
+            buffer = memory_map(f.fileno(), 0, access=ACCESS_READ)
+            _maps.setdefault(os.path.abspath(file_path), weakref.WeakSet()).add(buffer)
+
+        if manifest.get("version", 0) > SESSION_VERSION:
+            raise ValueError("La sessione è stata salvata con una versione più recente di hyloa.")
+
+        dataframes, header_lines = [], []
+        for i, info in enumerate(manifest.pop("files")):
+            columns = {}
+            for j, col in enumerate(info["columns"]):
+                name   = _column_name(i, j)
+                values = _map_member(f, buffer, zf, name) if buffer is not None else None
+                if values is None:
+                    with zf.open(name) as member:
+                        values = np.lib.format.read_array(member, allow_pickle=False)
+                columns[col] = values
+
+            # copy=False keeps one block for each column, so the maps are not copied
+            df = pd.DataFrame(columns, copy=False)
+            df.attrs["filename"] = info["filename"]
+            df.attrs["modified"] = info["modified"]
+            set_source_columns(df, info.get("source", info["columns"]))
+            df.attrs["provenance"] = info.get("provenance", [])
+            if buffer is not None:
+                df.attrs["mapped_from"] = os.path.abspath(file_path)
+            dataframes.append(df)
+
+            # The typed metadata are not stored, they are parsed again from the lines
+            header = info["header"]
+            header_lines.append(
+                LabviewHeader(header["columns"], header["lines"], parse_metadata(header["lines"]))
+            )
+
+    manifest.pop("version", None)
+    manifest["dataframes"]   = dataframes
+    manifest["header_lines"] = header_lines
+
+    return manifest
+
+#==============================================================================================#
+# Save and load from the gui                                                                   #
+#==============================================================================================#
+
+def collect_plot_state(app_instance):
+    '''
+    State of the plot panels of the session, in a JSON friendly form.
+
+    Parameters
+    ----------
+    app_instance : MainApp
+        Main application instance containing the session data.
+
+    Returns
+    -------
+    dict
+        {plot index : {"selected_pairs": [...], "plot_customizations": {...}}}
+    '''
+    return {
+        idx: {
+            "selected_pairs": [
+                (
+                    f_combo.currentText(),
+                    x_combo.currentText(),
+                    y_combo.currentText()
+                )
+                for f_combo, x_combo, y_combo in widget.selected_pairs
+            ],
+            "plot_customizations": widget.plot_customizations.copy()
+        }
+        for idx, widget in app_instance.plot_widgets.items()
+    }
+
+
+def collect_session_data(app_instance):
+    '''
+    Build the dictionary with everything needed to restore the session.
+
+    Parameters
+    ----------
+    app_instance : MainApp
+        Main application instance containing the session data.
+
+    Returns
+    -------
+    dict
+        session data, see write_session_archive
+    '''
+    return {
+        "dataframes": app_instance.dataframes,
+        "header_lines": app_instance.header_lines,
+        "logger_path": app_instance.logger_path,
+        "fit_results": app_instance.fit_results,
+        "fit_table": app_instance.fit_table.to_dict("records"),
+        "number_plots": app_instance.number_plots,
+        "plot_widgets": collect_plot_state(app_instance),
+    }
+
+
+def release_archive(app_instance, file_path):
+    '''
+    Drop all the references of the application to the columns mapped
+    from an archive, so that the archive can be overwritten: on Windows
+    a mapped file cannot be replaced. The columns of the dataframes and
+    of the undo history are read in memory, the shell and the plots are
+    bound to the new arrays.
+
+    Parameters
+    ----------
+    app_instance : MainApp
+        Main application instance containing the session data.
+    file_path : str
+        path of the archive
+    '''
+    if not _maps.get(os.path.abspath(file_path)):
+        return
+
+    for df in app_instance.dataframes:
+        materialize(df, file_path)
+
+    history = getattr(app_instance, "history", None)
+    if history is not None:
+        history.detach(lambda array: is_mapped(array, file_path))
+
+    app_instance.refresh_shell_variables()
+    for widget in app_instance.plot_widgets.values():
+        if widget.figure is not None:
+            widget.plot()
+            for line in widget.lines:
+                line.recache(always=True)
+
+
 def save_current_session(app_instance, parent_widget=None):
     '''
-    Save the current session to a .pkl file.
+    Save the current session to a columnar archive.
 
     Parameters
     ----------
@@ -26,44 +380,25 @@ def save_current_session(app_instance, parent_widget=None):
         QMessageBox.critical(parent_widget, "Errore", "Impossibile iniziare l'analisi senza avviare il log.")
         return
 
-    file_path, _ = QFileDialog.getSaveFileName(
+    file_path, selected_filter = QFileDialog.getSaveFileName(
         parent_widget,
         "Salva sessione",
         "",
-        "Pickle Files (*.pkl)"
+        f"{SESSION_FILTER};;{SESSION_FILTER_COMPRESSED}"
     )
 
     if not file_path:
         QMessageBox.warning(parent_widget, "Attenzione", "Nessun file selezionato per il salvataggio.")
         return
 
-    try:
-        # Build the dictionary for saving data 
-        session_data = {
-            "dataframes": app_instance.dataframes,
-            "header_lines": app_instance.header_lines,
-            "logger_path": app_instance.logger_path,
-            "fit_results": app_instance.fit_results,
-            "number_plots": app_instance.number_plots,
-
-            "plot_widgets": {
-                idx: {
-                    "selected_pairs": [
-                        (
-                            f_combo.currentText(),
-                            x_combo.currentText(),
-                            y_combo.currentText()
-                        )
-                        for f_combo, x_combo, y_combo in widget.selected_pairs
-                    ],
-                    "plot_customizations": widget.plot_customizations.copy()
-                }
-                for idx, widget in app_instance.plot_widgets.items()
-            }
-        }
+    if not file_path.endswith(SESSION_EXT):
+        file_path += SESSION_EXT
 
-        with open(file_path, "wb") as f:
-            pickle.dump(session_data, f)
+    try:
+        release_archive(app_instance, file_path)
+        write_session_archive(file_path, collect_session_data(app_instance),
+                              compress=selected_filter == SESSION_FILTER_COMPRESSED)
+        app_instance.logger.info(f"Sessione salvata nel file {file_path}")
 
         QMessageBox.information(parent_widget, "Sessione Salvata",
                                 f"Sessione salvata nel file:\n{file_path}")
@@ -71,9 +406,82 @@ def save_current_session(app_instance, parent_widget=None):
         QMessageBox.critical(parent_widget, "Errore", f"Errore durante il salvataggio:\n{e}")
 
 
+def restore_session(app_instance, session_data):
+    '''
+    Restore in the application a session read from file or recovered
+    from the autosave: data, logger, shell and log panels and plots.
+
+    Parameters
+    ----------
+    app_instance : MainApp
+        Main application instance to load the session into.
+    session_data : dict
+        session data, see collect_session_data
+    '''
+    # Reload attributes of main app instance
+    app_instance.dataframes     = session_data.get("dataframes", [])
+    app_instance.header_lines   = session_data.get("header_lines", [])
+    app_instance.logger_path    = session_data.get("logger_path", None)
+    app_instance.fit_results    = session_data.get("fit_results", {})
+    app_instance.fit_table      = pd.DataFrame(session_data.get("fit_table", []))
+    app_instance.number_plots   = session_data.get("number_plots", 0)
+
+    # Sessions saved by older versions store the data as strings
+    # and the headers as DataFrames, convert them to the current layout
+    app_instance.dataframes = [
+        df if all(dt == np.float64 for dt in df.dtypes) else df.astype(np.float64)
+        for df in app_instance.dataframes
+    ]
+    app_instance.header_lines = [
+        header_from_frame(h) if isinstance(h, pd.DataFrame) else h
+        for h in app_instance.header_lines
+    ]
+
+    # Recreate the logger
+    app_instance.log_handler = setup_logging(app_instance.logger_path)
+    app_instance.logger = logging.getLogger(__name__)
+    app_instance.logger.info("Logger ripristinato da file di sessione.")
+
+    if app_instance.shell_sub is None:
+        app_instance.open_default_panels()
+
+    # Recreate all plot's control panels
+    plot_widgets_data = session_data.get("plot_widgets", {})
+    for idx_str, plot_info in plot_widgets_data.items():
+        idx = int(idx_str)
+        widget = PlotControlWidget(app_instance, idx)
+
+        for i in reversed(range(widget.pair_layout.count())):
+            widget.pair_layout.itemAt(i).widget().setParent(None)
+        widget.selected_pairs.clear()
+
+        app_instance.plot_widgets[idx] = widget
+
+        # Retrieve selected pairs ...
+        for file_str, x_str, y_str in plot_info.get("selected_pairs", []):
+            widget.add_pair(file_text=file_str, x_col=x_str, y_col=y_str)
+
+        # ... and customization (JSON turns the keys into strings)
+        widget.plot_customizations = {
+            int(k): v for k, v in plot_info.get("plot_customizations", {}).items()
+        }
+
+        # Create sub window for panel
+        sub = QMdiSubWindow()
+        sub.setWidget(widget)
+        sub.setWindowTitle(f"Controllo grafico {idx}")
+        sub.resize(600, 300)
+        app_instance.mdi_area.addSubWindow(sub)
+        sub.show()
+
+        # Schedule the plot, all the plots are drawn once the session is restored
+        widget.request_plot()
+
+
 def load_previous_session(app_instance, parent_widget=None):
     '''
-    Load a previously saved session from a .pkl file.
+    Load a previously saved session, from a columnar archive
+    or from a .pkl file saved by the older versions.
 
     Parameters
     ----------
@@ -81,71 +489,42 @@ def load_previous_session(app_instance, parent_widget=None):
         Main application instance to load the session into.
     parent_widget : QWidget or None
         Optional parent for the dialog windows.
+
+    Returns
+    -------
+    str or None
+        path of the columnar archive loaded, None if nothing was
+        loaded or if the session was an old .pkl file
     '''
     options = QFileDialog.Options()
     file_path, _ = QFileDialog.getOpenFileName(
         parent_widget,
         "Carica sessione",
         "",
-        "Pickle Files (*.pkl)",
+        f"{SESSION_FILTER};;{LEGACY_FILTER}",
         options=options
     )
 
     if not file_path:
         QMessageBox.warning(parent_widget, "Errore", "Nessun file selezionato per il caricamento della sessione.")
-        return
+        return None
 
     try:
-        with open(file_path, "rb") as f:
-            session_data = pickle.load(f)
-
-        # Reload attributes of main app instance
-        app_instance.dataframes     = session_data.get("dataframes", [])
-        app_instance.header_lines   = session_data.get("header_lines", [])
-        app_instance.logger_path    = session_data.get("logger_path", None)
-        app_instance.fit_results    = session_data.get("fit_results", {})
-        app_instance.number_plots   = session_data.get("number_plots", 0)
-
-        # Recreate the logger
-        setup_logging(app_instance.logger_path)
-        app_instance.logger = logging.getLogger(__name__)
-        app_instance.logger.info("Logger ripristinato da file di sessione.")
+        if file_path.endswith(".pkl"):
+            # Old sessions, only open files you trust
+            with open(file_path, "rb") as f:
+                session_data = pickle.load(f)
+        else:
+            session_data = read_session_archive(file_path)
 
-        app_instance.open_default_panels()
-
-        # Recreate all plot's control panels
-        plot_widgets_data = session_data.get("plot_widgets", {})
-        for idx_str, plot_info in plot_widgets_data.items():
-            idx = int(idx_str)
-            widget = PlotControlWidget(app_instance, idx)
-            
-            for i in reversed(range(widget.pair_layout.count())):
-                widget.pair_layout.itemAt(i).widget().setParent(None)
-            widget.selected_pairs.clear()
-
-            app_instance.plot_widgets[idx] = widget
-
-            # Retrieve selected pairs ...
-            for file_str, x_str, y_str in plot_info.get("selected_pairs", []):
-                widget.add_pair(file_text=file_str, x_col=x_str, y_col=y_str)
-
-            # ... and customization
-            widget.plot_customizations = plot_info.get("plot_customizations", {})
-
-            # Create sub window for panel
-            sub = QMdiSubWindow()
-            sub.setWidget(widget)
-            sub.setWindowTitle(f"Controllo grafico {idx}")
-            sub.resize(600, 300)
-            app_instance.mdi_area.addSubWindow(sub)
-            sub.show()
-
-            # Force the plot
-            widget.plot()
+        restore_session(app_instance, session_data)
 
         QMessageBox.information(parent_widget, "Sessione Caricata",
                                 f"Sessione caricata dal file:\n{file_path}")
 
+        return None if file_path.endswith(".pkl") else file_path
+
     except Exception as e:
         QMessageBox.critical(parent_widget, "Errore",
-                             f"Errore durante il caricamento della sessione:\n{e}")
\ No newline at end of file
+                             f"Errore durante il caricamento della sessione:\n{e}")
+        return None
@@ -0,0 +1,143 @@
+"""
+Code for the window that computes the figures of merit of the loops
+(coercive field, remanence, saturation, area, ...), see hyloa.data.analysis
+"""
+from PyQt5.QtWidgets import (
+    QWidget, QVBoxLayout, QHBoxLayout, QLabel, QPushButton, QComboBox,
+    QCheckBox, QScrollArea, QMessageBox, QMdiSubWindow
+)
+
+from hyloa.data.analysis import analyze_dataframes
+from hyloa.gui.plot_window import show_table
+
+
+# Labels of the four columns of a loop
+LOOP_COLUMNS = ["H up", "M up", "H down", "M down"]
+
+
+def default_loop_columns(columns):
+    '''
+    Columns proposed for a loop: for the LabVIEW files field and
+    rotation of the two branches, otherwise the first four columns.
+    '''
+    if len(columns) >= 6:
+        return [columns[0], columns[1], columns[4], columns[5]]
+    return (columns * 4)[:4]
+
+
+def open_analysis_window(app_instance):
+    '''
+    Open the window to choose the loops and compute their figures of merit.
+    The results are shown in a table, saved in app_instance.loop_table
+    and available in the shell as loop_table.
+
+    Parameters
+    ----------
+    app_instance : MainApp
+        Main application instance containing the session data.
+    '''
+    dataframes = app_instance.dataframes
+    logger     = app_instance.logger
+
+    if app_instance.logger is None:
+        QMessageBox.critical(app_instance, "Errore", "Impossibile iniziare l'analisi senza avviare il log")
+        return
+
+    if not dataframes:
+        QMessageBox.critical(app_instance, "Errore", "Nessun file caricato")
+        return
+
+    window = QWidget()
+    layout = QVBoxLayout(window)
+    layout.addWidget(QLabel("Seleziona i cicli (campo e magnetizzazione dei due rami):"))
+
+    # Scroll area with one row for each loop
+    scroll_area = QScrollArea()
+    scroll_area.setWidgetResizable(True)
+    container   = QWidget()
+    rows_layout = QVBoxLayout(container)
+    scroll_area.setWidget(container)
+    layout.addWidget(scroll_area)
+
+    loop_rows = []   # (file combo, [four column combos])
+
+    def add_loop():
+        row = QHBoxLayout()
+
+        file_combo = QComboBox()
+        file_combo.addItems([f"File {i + 1}" for i in range(len(dataframes))])
+        row.addWidget(QLabel("File:"))
+        row.addWidget(file_combo)
+
+        combos = []
+        for label in LOOP_COLUMNS:
+            combo = QComboBox()
+            row.addWidget(QLabel(f"{label}:"))
+            row.addWidget(combo)
+            combos.append(combo)
+
+        def update_columns():
+            cols = list(dataframes[file_combo.currentIndex()].columns)
+            for combo, default in zip(combos, default_loop_columns(cols)):
+                combo.clear()
+                combo.addItems(cols)
+                combo.setCurrentText(default)
+
+        file_combo.currentIndexChanged.connect(update_columns)
+        update_columns()
+
+        row_widget = QWidget()
+        row_widget.setLayout(row)
+        rows_layout.addWidget(row_widget)
+        loop_rows.append((file_combo, combos))
+
+    add_button = QPushButton("Aggiungi ciclo")
+    add_button.clicked.connect(add_loop)
+    layout.addWidget(add_button)
+
+    all_files_check = QCheckBox("Applica a tutti i file con lo stesso numero di colonne")
+    layout.addWidget(all_files_check)
+
+    def compute():
+        try:
+            loops = []
+            for file_combo, combos in loop_rows:
+                idx       = file_combo.currentIndex()
+                columns   = list(dataframes[idx].columns)
+                positions = [columns.index(combo.currentText()) for combo in combos]
+
+                if all_files_check.isChecked():
+                    indices = [i for i, df in enumerate(dataframes) if len(df.columns) == len(columns)]
+                else:
+                    indices = [idx]
+
+                for i in indices:
+                    loops.append((i, tuple(dataframes[i].columns[p] for p in positions)))
+
+            table = analyze_dataframes(dataframes, loops)
+            app_instance.loop_table = table
+
+            logger.info(f"Parametri calcolati per {len(table)} cicli.")
+            for _, r in table.iterrows():
+                logger.info(f"File {r['file']} ({r['M_up']}, {r['M_dw']}): Hc = {r['Hc']:.4g}, "
+                            f"H_eb = {r['H_eb']:.4g}, Mr = {r['Mr']:.4g}, Ms = {r['Ms']:.4g}, "
+                            f"area = {r['area']:.4g}, squareness = {r['squareness']:.4g}")
+
+            app_instance.refresh_shell_variables()
+            show_table(app_instance, table, "Risultati dei cicli", "Nessun ciclo selezionato.")
+
+        except Exception as e:
+            QMessageBox.critical(window, "Errore", f"Errore durante il calcolo dei parametri:\n{e}")
+
+    compute_button = QPushButton("Calcola")
+    compute_button.clicked.connect(compute)
+    layout.addWidget(compute_button)
+
+    add_loop()
+
+    sub = QMdiSubWindow()
+    sub.setWidget(window)
+    sub.setWindowTitle("Parametri dei cicli")
+    sub.resize(800, 300)
+    app_instance.mdi_area.addSubWindow(sub)
+    sub.show()
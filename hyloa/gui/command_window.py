@@ -3,11 +3,9 @@ Code to manage the window where you can
 run code to make changes to the data
 """
 
-import io
-import sys
 import numpy as np
 from PyQt5.QtWidgets import (
-    QWidget, QVBoxLayout, QLabel, QTextEdit
+    QWidget, QVBoxLayout, QHBoxLayout, QLabel, QTextEdit, QPushButton, QSpinBox
 )
 from PyQt5.QtCore import Qt
 
@@ -15,6 +13,10 @@ from scipy.special import *
 from scipy.optimize import *
 import matplotlib.pyplot as plt
 
+from hyloa.data.history import read_only
+from hyloa.data.processing import update_columns
+from hyloa.utils.workers import CodeRunner, ExecutionCancelled, GuiInvoker, GuiProxy
+
 class ShellEditor(QTextEdit):
     ''' Class for wrinting in the shell
     '''
@@ -72,8 +74,6 @@ class CommandWindow(QWidget):
     def __init__(self, app_instance):
         super().__init__()
         self.app_instance = app_instance
-        self.dataframes = app_instance.dataframes
-        self.fit_results = app_instance.fit_results
         self.logger = app_instance.logger
 
         self.setWindowTitle("Shell Interattiva Python")
@@ -84,36 +84,134 @@ class CommandWindow(QWidget):
         self.shell_text = ShellEditor(self)
         layout.addWidget(self.shell_text)
 
-        self.local_vars = self._initialize_local_vars()
+        # The code runs in a worker thread, it can be stopped with the button or Ctrl+C
+        controls = QHBoxLayout()
+        self.stop_button = QPushButton("Interrompi", self)
+        self.stop_button.setEnabled(False)
+        self.stop_button.clicked.connect(self.cancel_execution)
+        controls.addWidget(self.stop_button)
+
+        controls.addStretch()
+        controls.addWidget(QLabel("Tempo massimo (s, 0 = nessuno):", self))
+        self.timeout_box = QSpinBox(self)
+        self.timeout_box.setRange(0, 24 * 3600)
+        controls.addWidget(self.timeout_box)
+        layout.addLayout(controls)
+
+        self.runner = None
+        self.pending = []       # Columns changed by the gui while the code runs, see update_columns
+        self.refresh_pending = False
+        self.local_vars = {}
+
+        # The code runs in a worker thread: the figures are made on the gui thread
+        self.global_vars = dict(globals())
+        self.global_vars["plt"] = GuiProxy(plt, GuiInvoker(self))
+        self.bound = {}     # {variable name : (dataframe, column, read-only view given to the shell)}
+        self.refresh_variables()
         self.command_history = []
         self.history_index = -1
 
         self.shell_text.installEventFilter(self)
         self.shell_text.moveCursor(self.shell_text.textCursor().End)
 
-    def _initialize_local_vars(self):
-        ''' Function to initialize the varibales konwn by the shell
+    def bind_column(self, df, column):
         '''
-        local_vars = {}
-
-        for idx, df in enumerate(self.dataframes):
-            for column in df.columns:
-                local_vars[column] = df[column].astype(float).values
-
-        local_vars.update(self.fit_results)
-        return local_vars
+        Give to the shell a column of a dataframe. The variable is a
+        read-only view of the data, so nothing is copied and the dataframe
+        is never modified behind the back of the application: an in-place
+        change raises an error, a new array assigned to the name is written
+        back in the dataframe after the command (see write_back).
+
+        Parameters
+        ----------
+        df : pandas dataframe
+            dataframe of the column
+        column : str
+            name of the column, also used as name of the variable
+        '''
+        array = read_only(df[column].to_numpy())
+        self.local_vars[column] = array
+        self.bound[column] = (df, column, array)
 
     def refresh_variables(self):
-        ''' Function to update the varibales konwn by the shell
         '''
-        self.local_vars.clear()
+        Update the variables known by the shell. Only the columns that
+        are new or whose data changed are bound again, the other variables,
+        including the ones defined by the user, are left as they are.
+        If many files have a column with the same name the last one wins.
+        While some code is running the update is done at its end.
+        '''
+        if self.runner is not None:
+            self.refresh_pending = True
+            return
 
-        for idx, df in enumerate(self.app_instance.dataframes):
+        current = {}
+        for df in self.app_instance.dataframes:
             for column in df.columns:
-                self.local_vars[column] = df[column].astype(float).values
+                current[column] = df
+
+        # Names whose dataframe, or column, is gone
+        for name in list(self.bound):
+            df, column, array = self.bound[name]
+            if current.get(name) is not df:
+                del self.bound[name]
+                if self.local_vars.get(name) is array:
+                    del self.local_vars[name]
+
+        for name, df in current.items():
+            entry = self.bound.get(name)
+            if (entry is None or self.local_vars.get(name) is not entry[2]
+                    or not np.may_share_memory(entry[2], df[name].to_numpy())):
+                self.bind_column(df, name)
 
         self.local_vars.update(self.app_instance.fit_results)
+        self.local_vars["fit_table"] = self.app_instance.fit_table
+        self.local_vars["loop_table"] = self.app_instance.loop_table
 
+    def update_columns(self, df, columns):
+        '''
+        Bind again some columns changed outside the shell,
+        called by MainApp.columns_changed.
+
+        Parameters
+        ----------
+        df : pandas dataframe
+            modified dataframe
+        columns : list of str
+            names of the modified columns
+        '''
+        if self.runner is not None:
+            # The worker is using the variables, they are bound again at its end
+            self.pending.append((df, list(columns)))
+            return
+
+        for column in columns:
+            entry = self.bound.get(column)
+            if entry is None or entry[0] is df:
+                self.bind_column(df, column)
+
+    def write_back(self):
+        '''
+        Write in the dataframes the columns that the user replaced with
+        a new array of the same length. Only the names bound to a new
+        object are looked at, so the cost does not depend on the size of
+        the session, and a column changed meanwhile by the gui is not
+        overwritten if the user did not touch it.
+        '''
+        for name, (df, column, array) in list(self.bound.items()):
+            value = self.local_vars.get(name)
+            if value is array:
+                continue
+            try:
+                new_values = np.array(value, dtype=float)
+            except (TypeError, ValueError):
+                continue
+            if new_values.shape != (len(df),):
+                continue
+            # Also rebinds the name to a copy of the new data, see update_columns
+            update_columns(df, {column: new_values}, self.app_instance, step={"op": "code"})
+            if self.bound[name][2] is array:
+                self.bind_column(df, column)
 
     def eventFilter(self, obj, event):
         ''' Handle switch for navigation in command's history or execute command
@@ -122,6 +220,15 @@ class CommandWindow(QWidget):
             if event.type() == event.KeyPress:
                 key = event.key()
 
+                if key == Qt.Key_C and event.modifiers() & Qt.ControlModifier \
+                        and self.runner is not None:
+                    self.cancel_execution()
+                    return True
+
+                if self.runner is not None and key in (Qt.Key_Return, Qt.Key_Up, Qt.Key_Down):
+                    # Wait the end of the running code
+                    return True
+
                 if key == Qt.Key_Return:
                     self.execute_command()
                     return True
@@ -153,28 +260,80 @@ class CommandWindow(QWidget):
         if self.logger:
             self.logger.info(f"Esecuzione del comando: {command}")
 
-        old_stdout, old_stderr = sys.stdout, sys.stderr
-        sys.stdout = output_capture = io.StringIO()
-        sys.stderr = output_capture
+        self.shell_text.moveCursor(self.shell_text.textCursor().End)
+        self.append_text("\n")
+        self.run_code(command)
 
-        try:
-            exec(command, globals(), self.local_vars)
-            output = output_capture.getvalue()
-        except Exception as e:
-            output = f"Errore: {str(e)}\n"
-        finally:
-            sys.stdout, sys.stderr = old_stdout, old_stderr
+    def run_code(self, code):
+        '''
+        Execute some code in a worker thread, with the variables of the shell.
+        The output is written in the shell while the code runs; at the end
+        the columns replaced by the code are written back in the dataframes
+        and a new prompt is shown.
+
+        Parameters
+        ----------
+        code : str
+            code to execute
+
+        Returns
+        -------
+        bool
+            False if other code is still running, so nothing was done
+        '''
+        if self.runner is not None:
+            return False
 
-        for idx, df in enumerate(self.dataframes):
-            for column in df.columns:
-                if column in self.local_vars:
-                    modified_array = self.local_vars[column]
-                    if not np.array_equal(df[column].values, modified_array):
-                        df[column] = modified_array
+        self.runner = CodeRunner(code, self.global_vars, self.local_vars,
+                                 self.append_text, self.execution_finished,
+                                 timeout=self.timeout_box.value() or None, parent=self)
+        self.stop_button.setEnabled(True)
+        return True
 
-        self.shell_text.append(output)
-        self.shell_text.append(">>> ")
-        self.shell_text.moveCursor(self.shell_text.textCursor().End)
+    def cancel_execution(self):
+        ''' Stop the running code
+        '''
+        if self.runner is not None:
+            self.append_text("Interruzione richiesta: il codice si ferma alla prossima istruzione "
+                             "Python, una chiamata a codice compilato (numpy, fit) va a termine.\n")
+            self.runner.cancel()
+
+    def execution_finished(self, error):
+        '''
+        Called by the runner at the end of the execution.
+
+        Parameters
+        ----------
+        error : BaseException or None
+            exception raised by the code, if any
+        '''
+        timed_out   = self.runner.timed_out
+        self.runner = None
+        self.stop_button.setEnabled(False)
+
+        if isinstance(error, ExecutionCancelled):
+            message = "Tempo massimo superato" if timed_out else "Esecuzione interrotta"
+            self.append_text(f"{message}\n")
+            if self.logger:
+                self.logger.warning(message)
+        elif error is not None:
+            self.append_text(f"Errore: {str(error)}\n")
+            if isinstance(error, ValueError) and "read-only" in str(error):
+                self.append_text("Le colonne non si modificano sul posto: assegnare un nuovo "
+                                 "array al nome, ad es. UpRot = -UpRot\n")
+
+        self.write_back()
+
+        # Changes made by the gui while the code was running
+        pending, self.pending = self.pending, []
+        for df, columns in pending:
+            self.update_columns(df, columns)
+        if self.refresh_pending:
+            self.refresh_pending = False
+            self.refresh_variables()
+
+        text = self.shell_text.toPlainText()
+        self.append_text(">>> " if not text or text.endswith("\n") else "\n>>> ")
 
     def navigate_history(self, direction):
         ''' Function for navigating in all command's history
@@ -1,24 +1,106 @@
 """
 Code for creation of the log panel in the main window
 """
+import os
+
 from PyQt5.QtCore import QTimer
 from PyQt5.QtGui import QTextCursor
 from PyQt5.QtWidgets import QPlainTextEdit
 
 
+MAX_LOG_LINES     = 5000            # Lines kept in the panel, the oldest are dropped
+MAX_INITIAL_BYTES = 512 * 1024      # At most this tail of an existing log is shown
+
+
 class LogWindow(QPlainTextEdit):
-    ''' Class to handle the log panel
+    '''
+    Class to handle the log panel.
+    The messages arrive with the signal of the log handler of the
+    application (see hyloa.utils.logging_setup), without any polling.
+    If there is no such handler, the log file is followed like
+    ``tail -f``: the position reached is remembered and each update reads
+    only the bytes appended since then, so the cost does not grow with
+    the length of the session.
     '''
     def __init__(self, app_instance):
         super().__init__()
         self.app_instance = app_instance
         self.setReadOnly(True)
         self.setStyleSheet("background-color: white; color: black; font-family: monospace;")
+        self.setMaximumBlockCount(MAX_LOG_LINES)
+
+        self.log_path = None      # File followed
+        self.offset   = None      # Byte offset of the first byte not read yet
+        self.partial  = b""       # Last line read, not yet terminated
+
         self.timer = QTimer(self)
         self.timer.timeout.connect(self.update_log)
-        self.timer.start(1000)    # Update each seconds
 
-        self.last_line_count = 0  # track last line shown
+        handler = getattr(app_instance, "log_handler", None)
+        if handler is not None:
+            for message in handler.connect(self.append_message):
+                self.appendPlainText(message)
+        else:
+            self.timer.start(1000)    # Update each seconds
+
+    def append_message(self, text):
+        '''
+        Show a new message, scrolling down if the panel was at the bottom.
+
+        Parameters
+        ----------
+        text : str
+            message to show
+        '''
+        scrollbar = self.verticalScrollBar()
+        at_bottom = scrollbar.value() == scrollbar.maximum()
+
+        self.appendPlainText(text)
+
+        if at_bottom:
+            self.moveCursor(QTextCursor.End)
+
+    def read_new_bytes(self):
+        '''
+        Read the bytes appended to the log file since the last call.
+
+        Returns
+        -------
+        bytes
+            new complete lines, empty if nothing changed
+        '''
+        path = self.app_instance.logger_path
+        size = os.path.getsize(path)
+
+        if path != self.log_path or self.offset is None:
+            # First read: start from the end of a long file
+            self.log_path = path
+            self.offset   = max(0, size - MAX_INITIAL_BYTES)
+            self.partial  = b""
+            skip_first    = self.offset > 0
+        elif size < self.offset:
+            # Truncated or replaced, start again
+            self.offset  = 0
+            self.partial = b""
+            skip_first   = False
+        elif size == self.offset:
+            return b""
+        else:
+            skip_first = False
+
+        with open(path, "rb") as f:
+            f.seek(self.offset)
+            data = f.read(size - self.offset)
+        self.offset += len(data)
+
+        data = self.partial + data
+        if skip_first:
+            # The first line was cut by the seek
+            data = data[data.find(b"\n") + 1:] if b"\n" in data else b""
+
+        end = data.rfind(b"\n") + 1
+        self.partial = data[end:]
+        return data[:end]
 
     def update_log(self):
         ''' Function that update the window
@@ -27,26 +109,12 @@ class LogWindow(QPlainTextEdit):
             return
 
         try:
-            with open(self.app_instance.logger_path, "r") as f:
-                lines = f.readlines()
-
-            if len(lines) == self.last_line_count:
+            data = self.read_new_bytes()
+            if not data:
                 return
 
-            # Show only new lines
-            new_lines = lines[self.last_line_count:]
-            self.last_line_count = len(lines)
-
-            cleaned = [line.split(" - ")[-1] for line in new_lines]
-
-            # Scroll on bottom
-            scrollbar = self.verticalScrollBar()
-            at_bottom = scrollbar.value() == scrollbar.maximum()
-
-            self.appendPlainText("".join(cleaned))
-
-            if at_bottom:
-                self.moveCursor(QTextCursor.End)
+            lines = data.decode("utf-8", errors="replace").splitlines()
+            self.append_message("\n".join(line.split(" - ")[-1] for line in lines))
 
         except Exception as e:
             self.appendPlainText(f"\n[Errore] {e}")
@@ -5,23 +5,33 @@ everything that is done otherwise it is not possible to start
 the analysis. From here the calls to the other functions branch out.
 """
 
+import pandas as pd
 import matplotlib.pyplot as plt
 from PyQt5.QtCore import Qt, QTimer
+from PyQt5.QtGui import QKeySequence
 from PyQt5.QtWidgets import (
     QApplication, QMainWindow, QMdiArea, QMdiSubWindow, QWidget, QVBoxLayout,
     QPushButton, QMessageBox, QTextEdit, QLabel, QDockWidget, QGroupBox, QHBoxLayout,
-    QDialog
+    QDialog, QInputDialog, QFileDialog, QShortcut
 )
 
 from hyloa.data.io import load_files
 from hyloa.gui.log_window import LogWindow
 from hyloa.data.io import save_modified_data
+from hyloa.data.processing import pipeline_dialog
 from hyloa.gui.script_window import ScriptEditor
 from hyloa.gui.command_window import CommandWindow
 from hyloa.gui.plot_window import PlotControlWidget
+from hyloa.gui.analysis_window import open_analysis_window
 from hyloa.utils.logging_setup import start_logging
 from hyloa.data.session import save_current_session
 from hyloa.data.session import load_previous_session
+from hyloa.data.session import restore_session
+from hyloa.data.provenance import get_steps, save_steps
+from hyloa.data.history import History, take_snapshot
+from hyloa.data.autosave import (
+    SessionJournal, AUTOSAVE_INTERVAL, autosave_base, has_autosave, recover
+)
 
 
 class MainApp(QMainWindow):
@@ -43,10 +53,30 @@ class MainApp(QMainWindow):
         self.header_lines         = []     # List to store the initial lines of files
         self.logger               = None   # Logger for the entire application
         self.logger_path          = None   # Path to the log file
+        self.log_handler          = None   # Handler sending the log to the panel
         self.fit_results          = {}     # Dictionary to save fitting results
+        self.fit_table            = pd.DataFrame()  # Results of the fits, one row for each file and pair
+        self.loop_table           = pd.DataFrame()  # Figures of merit of the loops (Hc, Mr, Ms, ...)
         self.number_plots         = 0      # Number of all created plots
         self.figures_map          = {}     # dict to store all figures
         self.plot_widgets         = {}     # {int: PlotControlWidget}
+        self.autosave             = None   # Journal of the session, see hyloa.data.autosave
+        self.history              = History()  # Changes that can be undone, see hyloa.data.history
+
+        # Periodic autosave, and a zero delay timer to flush after each operation:
+        # restarting it before it fires merges many changes in a single flush
+        self.autosave_timer = QTimer(self)
+        self.autosave_timer.timeout.connect(self.flush_autosave)
+        self.autosave_flush = QTimer(self)
+        self.autosave_flush.setSingleShot(True)
+        self.autosave_flush.setInterval(0)
+        self.autosave_flush.timeout.connect(self.flush_autosave)
+
+        # The changes recorded before this timer fires (e.g. the same operation
+        # applied to all the files) are undone together
+        self.history_group = QTimer(self)
+        self.history_group.setSingleShot(True)
+        self.history_group.setInterval(0)
 
         # Interface
         self.shell_sub = None
@@ -79,11 +109,26 @@ class MainApp(QMainWindow):
 
         layout.addWidget(self.make_group("Analisi", [
             ("Crea Grafico", self.plot),
+            ("Parametri Cicli", self.open_analysis),
             ("Salva Dati", self.save_data),
+            ("Esporta Operazioni", self.export_steps),
+            ("Applica Pipeline", self.apply_pipeline),
             ("Script", self.open_script_editor),
             ("Appunti", self.open_comment_window)
         ]))
 
+        self.undo_button = self.make_button("Annulla (Ctrl+Z)", self.undo)
+        self.redo_button = self.make_button("Ripeti (Ctrl+Shift+Z)", self.redo)
+        history_group    = QGroupBox("Modifiche")
+        history_layout   = QHBoxLayout(history_group)
+        history_layout.addWidget(self.undo_button)
+        history_layout.addWidget(self.redo_button)
+        layout.addWidget(history_group)
+        self.update_history_buttons()
+
+        QShortcut(QKeySequence.Undo, self, activated=self.undo)
+        QShortcut(QKeySequence("Ctrl+Shift+Z"), self, activated=self.redo)
+
         layout.addWidget(self.make_group("Sessione", [
             ("Salva Sessione", self.save_session),
             ("Carica Sessione", self.load_session)
@@ -115,6 +160,71 @@ class MainApp(QMainWindow):
         ''' Function that call the logging configuration
         '''
         start_logging(self, parent_widget=self)
+        if self.logger is not None and self.autosave is None:
+            self.start_autosave()
+
+    def start_autosave(self, ask_recover=True, seed=None):
+        '''
+        Start the journal of the session next to the log file.
+        If a journal left by a session that did not close correctly
+        is found, the user can choose to recover it.
+
+        Parameters
+        ----------
+        ask_recover : bool, optional
+            if False an old journal is overwritten without asking
+        seed : str, optional
+            session archive just loaded, used as snapshot without rewriting it
+        '''
+        if self.autosave is not None:
+            self.autosave.close()
+
+        base_path = autosave_base(self.logger_path)
+        recovered = False
+
+        if ask_recover and has_autosave(base_path):
+            reply = QMessageBox.question(
+                self, "Recupero sessione",
+                "È stato trovato un salvataggio automatico di una sessione non chiusa correttamente.\n"
+                "Vuoi recuperarlo?",
+                QMessageBox.Yes | QMessageBox.No
+            )
+            if reply == QMessageBox.Yes:
+                try:
+                    restore_session(self, recover(base_path))
+                    recovered = True
+                    self.history.clear()
+                    self.update_history_buttons()
+                    self.logger.info(f"Sessione recuperata dal salvataggio automatico {base_path}")
+                    self.refresh_shell_variables()
+                except Exception as e:
+                    QMessageBox.critical(self, "Errore", f"Errore durante il recupero della sessione:\n{e}")
+
+        try:
+            self.autosave = SessionJournal(base_path, on_change=self.autosave_flush.start)
+            self.autosave.start(self, seed=seed, resume=recovered)
+            self.autosave_timer.start(AUTOSAVE_INTERVAL)
+        except Exception as e:
+            self.autosave = None
+            self.logger.error(f"Impossibile avviare il salvataggio automatico: {e}")
+
+    def flush_autosave(self):
+        ''' Write the changes of the session in the journal
+        '''
+        if self.autosave is None:
+            return
+        try:
+            self.autosave.flush(self)
+        except Exception as e:
+            self.logger.error(f"Errore durante il salvataggio automatico: {e}")
+
+    def stop_autosave(self):
+        ''' Stop the autosave and delete its files, the session was closed normally
+        '''
+        self.autosave_timer.stop()
+        if self.autosave is not None:
+            self.autosave.close()
+            self.autosave = None
 
     def load_data(self):
         ''' call load file to load data
@@ -140,6 +250,45 @@ class MainApp(QMainWindow):
         '''
         save_modified_data(self, parent_widget=self) # Pass the class instance as an argument
     
+    def export_steps(self):
+        '''
+        Save in a JSON file the operations applied to a file,
+        to replay them on other files with hyloa-batch --replay.
+        '''
+        if not self.dataframes:
+            QMessageBox.warning(self, "Errore", "Non ci sono dati caricati.")
+            return
+
+        items = [
+            f"File {i + 1}: {df.attrs.get('filename', '')} ({len(df.attrs.get('provenance', []))} operazioni)"
+            for i, df in enumerate(self.dataframes)
+        ]
+        item, ok = QInputDialog.getItem(self, "Esporta Operazioni", "Seleziona il file:", items, 0, False)
+        if not ok:
+            return
+
+        steps = get_steps(self.dataframes[items.index(item)])
+        if not steps:
+            QMessageBox.warning(self, "Errore", "Nessuna operazione applicata al file selezionato.")
+            return
+
+        path, _ = QFileDialog.getSaveFileName(self, "Esporta Operazioni", "", "JSON (*.json)")
+        if not path:
+            return
+
+        try:
+            save_steps(path, steps)
+            if self.logger:
+                self.logger.info(f"Esportate {len(steps)} operazioni in {path}")
+            QMessageBox.information(self, "Successo", f"Operazioni salvate in {path}")
+        except Exception as e:
+            QMessageBox.critical(self, "Errore", f"Errore durante il salvataggio:\n{e}")
+
+    def apply_pipeline(self):
+        ''' Apply a pipeline of operations read from file to all the loaded files
+        '''
+        pipeline_dialog(self)
+
     def plot(self):
         ''' Function that create a instance for plot's control panel
         '''
@@ -228,6 +377,91 @@ class MainApp(QMainWindow):
             if isinstance(widget, CommandWindow):
                 widget.refresh_variables()
     
+    def columns_changed(self, df, columns, before=None):
+        '''
+        Called by hyloa.data.processing.update_columns each time some
+        columns of a dataframe are written: the change is recorded in the
+        autosave and in the history and the shell variables of those
+        columns are updated.
+
+        Parameters
+        ----------
+        df : pandas dataframe
+            modified dataframe
+        columns : list of str
+            names of the modified columns
+        before : dict, optional
+            snapshot of the columns before the change, see hyloa.data.history;
+            if None the change is not recorded in the history (e.g. undo)
+        '''
+        if self.autosave is not None:
+            self.autosave.mark(df, columns)
+
+        for sub in self.mdi_area.subWindowList():
+            widget = sub.widget()
+            if isinstance(widget, CommandWindow):
+                widget.update_columns(df, columns)
+
+        if before is not None:
+            self.history.push(df, before, take_snapshot(df, columns, before["label"]),
+                              merge=self.history_group.isActive())
+            self.history_group.start()
+            self.update_history_buttons()
+
+    def update_history_buttons(self):
+        ''' Enable the undo and redo buttons only if there is something to do
+        '''
+        self.undo_button.setEnabled(self.history.can_undo())
+        self.redo_button.setEnabled(self.history.can_redo())
+
+    def undo(self):
+        ''' Undo the last operation on the data
+        '''
+        self.apply_history(self.history.undo, "annullata")
+
+    def redo(self):
+        ''' Apply again the last undone operation
+        '''
+        self.apply_history(self.history.redo, "ripetuta")
+
+    def apply_history(self, action, verb):
+        '''
+        Undo or redo a change and update the rest of the application.
+
+        Parameters
+        ----------
+        action : callable
+            History.undo or History.redo
+        verb : str
+            word for the log
+        '''
+        # Changes of files that are no longer loaded cannot be restored
+        self.history.forget(self.dataframes)
+        self.history_group.stop()
+
+        change = action()
+        self.update_history_buttons()
+        if change is None:
+            return
+
+        for df, before, _ in change.items:
+            self.columns_changed(df, list(before["columns"]))
+
+        for widget in self.plot_widgets.values():
+            if widget.figure is not None:
+                widget.request_plot()
+        self.refresh_shell_variables()
+
+        if self.logger:
+            changed = {id(df) for df, _, _ in change.items}
+            files   = ", ".join(f"{i + 1}" for i, df in enumerate(self.dataframes) if id(df) in changed)
+            self.logger.info(f"Operazione {change.label} {verb} su File {files}.")
+
+    def open_analysis(self):
+        ''' Open the window to compute coercive field, remanence and so on
+        '''
+        open_analysis_window(self)
+
     def open_script_editor(self):
         editor = ScriptEditor(self)
         sub = QMdiSubWindow()
@@ -280,9 +514,15 @@ class MainApp(QMainWindow):
     def load_session(self):
         ''' Function that call load_previous_session
         '''
-        load_previous_session(self, parent_widget=self)
+        archive = load_previous_session(self, parent_widget=self)
+        self.history.forget(self.dataframes)
+        self.update_history_buttons()
         self.refresh_shell_variables()
 
+        # The journal restarts from the loaded session
+        if self.logger_path is not None:
+            self.start_autosave(ask_recover=False, seed=archive)
+
 
     def exit_app(self):
         ''' Function for exit button
@@ -291,8 +531,10 @@ class MainApp(QMainWindow):
                                      QMessageBox.Yes | QMessageBox.No | QMessageBox.Cancel)
         if reply == QMessageBox.Yes:
             self.save_session()
+            self.stop_autosave()
             QApplication.quit()
         elif reply == QMessageBox.No:
+            self.stop_autosave()
             QApplication.quit()
         # Otherwise (cancel) => do nothing
     
@@ -304,8 +546,10 @@ class MainApp(QMainWindow):
 
         if reply == QMessageBox.Yes:
             self.save_session()
+            self.stop_autosave()
             event.accept()
         elif reply == QMessageBox.No:
+            self.stop_autosave()
             event.accept()
         else:
             event.ignore()
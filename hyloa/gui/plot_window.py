@@ -2,30 +2,61 @@
 Code to manage the plot window
 """
 import numpy as np
-from scipy.special import *
 import matplotlib.pyplot as plt
-from scipy.optimize import curve_fit
 from matplotlib.figure import Figure
 from matplotlib import markers, lines as mlines, colors as mcolors
 from matplotlib.backends.backend_qt5agg import FigureCanvasQTAgg as FigureCanvas
 from matplotlib.backends.backend_qt5 import NavigationToolbar2QT as NavigationToolbar
 
-from PyQt5.QtCore import Qt
+from PyQt5.QtCore import Qt, QTimer
 from PyQt5.QtWidgets import (
     QWidget, QVBoxLayout, QHBoxLayout, QLabel, QPushButton,
     QScrollArea, QComboBox, QMessageBox, QDialog, QFormLayout,
-    QLineEdit, QMdiSubWindow, QTextEdit, QSizePolicy
+    QLineEdit, QMdiSubWindow, QTextEdit, QSizePolicy, QTableView, QFileDialog,
+    QCheckBox
 )
 
 from hyloa.data.processing import inv_single_branch_dialog
 from hyloa.data.processing import inv_x_dialog, inv_y_dialog
 from hyloa.data.processing import norm_dialog, close_loop_dialog
+from hyloa.data.core import decimate_indices
+from hyloa.data.io import ArrayTableModel
+from hyloa.utils.workers import PoolRunner
+from hyloa.data.fitting import get_model, fit_columns, update_fit_table, MODEL_LIBRARY
+from hyloa.data.provenance import record_step
 
 
 #==============================================================================================#
 # Main function for managing the plot window                                                   #
 #==============================================================================================#
 
+class OverlayFigure(Figure):
+    '''
+    Figure of a plot window. The overlays are animated artists, which
+    matplotlib skips in a normal draw (they are blitted on the screen,
+    see PlotControlWidget.add_overlay), so they are made normal while
+    the figure is saved, e.g. from the toolbar or the shell.
+    '''
+
+    def __init__(self, *args, **kwargs):
+        super().__init__(*args, **kwargs)
+        self.saving = False
+
+    def savefig(self, *args, **kwargs):
+        animated = [artist for artist in self.findobj() if artist.get_animated()]
+        for artist in animated:
+            artist.set_animated(False)
+        self.saving = True
+        try:
+            return super().savefig(*args, **kwargs)
+        finally:
+            self.saving = False
+            for artist in animated:
+                artist.set_animated(True)
+            # The background for the blitting is taken again from the screen
+            self.canvas.draw_idle()
+
+
 class PlotControlWidget(QWidget):
 
     def __init__(self, app_instance, number_plots):
@@ -40,6 +71,28 @@ class PlotControlWidget(QWidget):
         self.ax                   = None
         self.canvas               = None
         self.toolbar              = None
+        self.plot_sub             = None         # Sub-window of the figure
+        self.plot_pending         = False        # A replot has been requested but not done
+        # Artists reused between replots
+        self.artists              = {}           # {(file, x, y, n) : Line2D} of the plotted pairs
+        self.full_data            = {}           # {(file, x, y, n) : (x, y)} all the points of each line
+        self.lines                = []           # Lines of the pairs, in the order of selected_pairs
+        self.legend_key           = None         # Labels and styles of the current legend
+        self.overlays             = []           # Animated artists drawn with blitting (e.g. fits)
+        self.background           = None         # Figure without the overlays, for blitting
+
+        # The points drawn are recomputed after zoom, pan or resize,
+        # once all the events of the change have been processed
+        self.lod_timer = QTimer(self)
+        self.lod_timer.setSingleShot(True)
+        self.lod_timer.setInterval(0)
+        self.lod_timer.timeout.connect(self.update_lod)
+
+        # Replots requested by the operations on the data are merged in one draw
+        self.plot_timer = QTimer(self)
+        self.plot_timer.setSingleShot(True)
+        self.plot_timer.setInterval(0)
+        self.plot_timer.timeout.connect(self.flush_plot)
 
         self.init_ui()
 
@@ -140,8 +193,119 @@ class PlotControlWidget(QWidget):
     def plot(self):
         ''' Call function to plot data
         '''
+        self.plot_pending = False
         plot_data(self, self.app_instance)
 
+    def request_plot(self):
+        '''
+        Schedule a replot. All the requests made before control returns
+        to the event loop give a single draw, and a minimized figure is
+        drawn only when it is shown again.
+        '''
+        self.plot_pending = True
+        self.plot_timer.start()
+
+    def flush_plot(self):
+        ''' Do the requested replot, if the figure can be seen
+        '''
+        if not self.plot_pending:
+            return
+        if self.plot_sub is not None and (self.plot_sub.isMinimized() or self.plot_sub.isHidden()):
+            return
+        self.plot()
+
+    def on_plot_window_state(self, old_state, new_state):
+        ''' Do the replots skipped while the figure was minimized
+        '''
+        if self.plot_pending and not new_state & Qt.WindowMinimized:
+            self.plot_timer.start()
+
+    def lod_data(self, x, y, x_range=None):
+        '''
+        Points of a curve to draw at the current size of the axes,
+        see hyloa.data.core.decimate_indices.
+
+        Parameters
+        ----------
+        x, y : 1darray
+            all the points of the curve
+        x_range : tuple of float, optional
+            visible range of x, default all the curve
+
+        Returns
+        -------
+        x, y : 1darray
+            points to draw
+        '''
+        n_bins = max(int(self.ax.bbox.width), 1)
+        if len(x) <= 4 * n_bins:
+            return x, y
+
+        idx = decimate_indices(x, y, n_bins, x_range)
+        return x[idx], y[idx]
+
+    def update_lod(self):
+        ''' Decimate again the dense lines for the current view
+        '''
+        if self.ax is None:
+            return
+
+        x_range = self.ax.get_xlim()
+        n_bins  = max(int(self.ax.bbox.width), 1)
+        changed = False
+        for key, line in self.artists.items():
+            x, y = self.full_data[key]
+            if len(x) > 4 * n_bins or len(line.get_xdata()) != len(x):
+                line.set_data(*self.lod_data(x, y, x_range))
+                changed = True
+
+        if changed:
+            self.canvas.draw_idle()
+
+    def on_draw(self, event):
+        ''' After a full draw save the background and draw the overlays on it
+        '''
+        # Only the draws of the screen, not the ones of savefig (e.g. a pdf or svg canvas)
+        if event.canvas is not self.canvas or not self.canvas.supports_blit or self.figure.saving:
+            return
+        self.background = self.canvas.copy_from_bbox(self.figure.bbox)
+        # The canvas is about to be painted, no need to blit
+        for artist in self.overlays:
+            self.ax.draw_artist(artist)
+
+    def draw_overlays(self):
+        ''' Redraw only the overlays over the saved background
+        '''
+        if self.background is None:
+            return
+        self.canvas.restore_region(self.background)
+        for artist in self.overlays:
+            self.ax.draw_artist(artist)
+        self.canvas.blit(self.figure.bbox)
+
+    def add_overlay(self, artist):
+        '''
+        Show an artist over the plot without redrawing the whole figure.
+
+        Parameters
+        ----------
+        artist : matplotlib artist
+            artist already added to the axes
+        '''
+        artist.set_animated(True)
+        self.overlays.append(artist)
+        if self.background is None:
+            self.canvas.draw_idle()
+        else:
+            self.draw_overlays()
+
+    def clear_overlays(self):
+        ''' Remove all the overlays
+        '''
+        for artist in self.overlays:
+            artist.remove()
+        self.overlays = []
+
     def customize_plot_style(self):
         ''' Call function to customizzzation of plots
         '''
@@ -183,10 +347,58 @@ class PlotControlWidget(QWidget):
 # Function that creates the plot with the chosen data                                          #
 #==============================================================================================#
 
+def pair_style(i, n_pairs, plot_customizations):
+    '''
+    Style of the line of a pair: the two branches of each cycle
+    have the same style and only the first one is in the legend.
+
+    Parameters
+    ----------
+    i : int
+        index of the pair
+    n_pairs : int
+        number of plotted pairs
+    plot_customizations : dict
+        customizations of the plot, {cycle : style}
+
+    Returns
+    -------
+    dict
+        color, marker, linestyle and label of the line
+    '''
+    cycle = i // 2
+    first = i - i % 2         # First branch of the cycle
+
+    if not plot_customizations:
+        style = {
+            "color"     : tuple(plt.cm.jet(first / max(n_pairs - 1, 1))),
+            "marker"    : "o",
+            "linestyle" : "-",
+            "label"     : f"Ciclo {cycle + 1}",
+        }
+    else:
+        default_colors = plt.rcParams["axes.prop_cycle"].by_key()["color"]
+        customization  = plot_customizations.get(cycle, {})
+        style = {
+            "color"     : customization.get("color", default_colors[first % len(default_colors)]),
+            "marker"    : customization.get("marker", "None"),
+            "linestyle" : customization.get("linestyle", "-"),
+            "label"     : customization.get("label", f"Ciclo {cycle + 1}"),
+        }
+
+    if i % 2 == 1:
+        style["label"] = "_nolegend_"
+
+    return style
+
+
 def plot_data(plot_window_instance, app_instance):
     '''
     Create the plot with the selected pairs using matplotlib.
-   
+    The lines are created only the first time a pair is plotted,
+    afterwards their data and style are updated in place, so a replot
+    after an operation on the data does not rebuild the figure.
+
     Parameters
     ----------
     plot_window_instance : PlotControlWidget
@@ -201,10 +413,10 @@ def plot_data(plot_window_instance, app_instance):
     dataframes          = app_instance.dataframes
     plot_customizations = plot_window_instance.plot_customizations
     logger              = app_instance.logger
-    
+
     # Create a figure
     if plot_window_instance.figure is None:
-        fig = Figure(figsize=(10, 6))
+        fig = OverlayFigure(figsize=(10, 6))
         ax  = fig.add_subplot(111)
 
         # Save objects in the instance
@@ -216,6 +428,9 @@ def plot_data(plot_window_instance, app_instance):
         # Create canvas and show in sub-window
         canvas = FigureCanvas(fig)
         toolbar = NavigationToolbar(canvas, plot_window_instance)
+        canvas.mpl_connect("draw_event", plot_window_instance.on_draw)
+        canvas.mpl_connect("resize_event", lambda event: plot_window_instance.lod_timer.start())
+        ax.callbacks.connect("xlim_changed", lambda ax: plot_window_instance.lod_timer.start())
 
         # Create layout
         plot_area = QWidget()
@@ -236,7 +451,16 @@ def plot_data(plot_window_instance, app_instance):
         sub.resize(800, 600)
         app_instance.mdi_area.addSubWindow(sub)
         sub.show()
+        plot_window_instance.plot_sub = sub
+        sub.windowStateChanged.connect(plot_window_instance.on_plot_window_state)
 
+        # Fixed parts of the plot, created only once
+        ax.set_xlabel("H [Oe]", fontsize=15)
+        ax.set_ylabel(r"M/M$_{sat}$", fontsize=15)
+        # Add horizontal line at y=0
+        ax.axhline(y=0, color='gray', linestyle='--', linewidth=1)
+        # Add vertical line at x=0
+        ax.axvline(x=0, color='gray', linestyle='--', linewidth=1)
 
     else:
         # Retrieve existing objects
@@ -245,14 +469,12 @@ def plot_data(plot_window_instance, app_instance):
         canvas  = plot_window_instance.canvas
         toolbar = plot_window_instance.toolbar
 
-        # Clear for new plot
-        ax.clear()
+        # The overlays (e.g. fits) refer to the old data
+        plot_window_instance.clear_overlays()
 
     try:
 
-        X = []
-        Y = []
-
+        pairs = []
         for df_choice, x_var, y_var in selected_pairs:
             df_idx = int(df_choice.currentText().split(" ")[1]) - 1 
             x_col = x_var.currentText()
@@ -262,51 +484,58 @@ def plot_data(plot_window_instance, app_instance):
                 QMessageBox.critical(None, "Errore", "Devi selezionare tutte le coppie di colonne!")
                 return
 
-            X.append(dataframes[df_idx][x_col].astype(float).values)
-            Y.append(dataframes[df_idx][y_col].astype(float).values)
+            pairs.append((df_idx, x_col, y_col))
+
+        old_artists = plot_window_instance.artists
+        artists     = {}
+        full_data   = {}
+        lines       = []
+        occurrences = {}
+
+        for i, (df_idx, x_col, y_col) in enumerate(pairs):
+            x = dataframes[df_idx][x_col].to_numpy()
+            y = dataframes[df_idx][y_col].to_numpy()
             logger.info(f"Plot di: {x_col} vs {y_col}")
 
-        if not plot_customizations:
-            col = plt.cm.jet(np.linspace(0, 1, len(X)))
-            for i in range(0, len(X), 2):
-                ax.plot(X[i],   Y[i],   color=col[i], marker="o", label=f"Ciclo {i//2 + 1}")
-                ax.plot(X[i+1], Y[i+1], color=col[i], marker="o")
+            # The same pair can be plotted more than once
+            n   = occurrences[(df_idx, x_col, y_col)] = occurrences.get((df_idx, x_col, y_col), -1) + 1
+            key = (df_idx, x_col, y_col, n)
 
+            # Dense curves are decimated, all the points are kept for zoom and pan
+            x_draw, y_draw = plot_window_instance.lod_data(x, y)
 
-        else:
-            for i, (x, y) in enumerate(zip(X, Y)):
-                if i % 2 == 0:
-                    line1, = ax.plot(x, y, label=f"Ciclo {i // 2 + 1}")
-                else:
-                    line2, = ax.plot(x, y)
+            line = old_artists.pop(key, None)
+            if line is None:
+                line, = ax.plot(x_draw, y_draw)
+            else:
+                line.set_data(x_draw, y_draw)
 
-                try:
-                    customization = plot_customizations.get(i // 2, {})
+            line.set(**pair_style(i, len(pairs), plot_customizations))
+            artists[key]   = line
+            full_data[key] = (x, y)
+            lines.append(line)
 
-                    line1.set_color(customization.get("color", line1.get_color()))
-                    line1.set_marker(customization.get("marker", line1.get_marker()))
-                    line1.set_linestyle(customization.get("linestyle", line1.get_linestyle()))
-                    line1.set_label(customization.get("label", f"Ciclo {i // 2 + 1}"))
+        # Lines of pairs no longer selected
+        for line in old_artists.values():
+            line.remove()
 
-                    if i % 2 == 1:
-                        line2.set_color(customization.get("color", line1.get_color()))
-                        line2.set_marker(customization.get("marker", line1.get_marker()))
-                        line2.set_linestyle(customization.get("linestyle", line1.get_linestyle()))
-                        line2.set_label("_nolegend_")
+        plot_window_instance.artists   = artists
+        plot_window_instance.full_data = full_data
+        plot_window_instance.lines     = lines
 
-                except Exception as e:
-                    print(f"Errore applicando lo stile: {e}")
+        ax.relim()
+        ax.autoscale(True)
 
-        ax.set_xlabel("H [Oe]", fontsize=15)
-        ax.set_ylabel(r"M/M$_{sat}$", fontsize=15)
-        ax.legend()
-        
-        # Add horizontal line at y=0
-        ax.axhline(y=0, color='gray', linestyle='--', linewidth=1)
-        # Add vertical line at x=0
-        ax.axvline(x=0, color='gray', linestyle='--', linewidth=1)
-                        
-        canvas.draw()
+        # The legend is rebuilt only if labels or styles changed
+        legend_key = tuple(
+            (line.get_label(), str(line.get_color()), line.get_marker(), line.get_linestyle())
+            for line in lines
+        )
+        if legend_key != plot_window_instance.legend_key or ax.get_legend() is None:
+            ax.legend()
+            plot_window_instance.legend_key = legend_key
+
+        canvas.draw_idle()
 
     except Exception as e:
         QMessageBox.critical(None, "Errore", f"Errore durante la creazione del grafico: {e}")
@@ -337,20 +566,8 @@ def customize_plot_style(parent_widget, plot_customizations, number_plots, figur
 
     fig, ax = figures_map[number_plots]
 
-    lines = ax.lines
-
-    # Remove grid 
-    filtered_lines = []
-    for line in lines:
-        x_data, y_data = line.get_xdata(), line.get_ydata()
-       
-        if not (
-            (all(y == 0 for y in y_data) and len(set(x_data)) > 1) or  # axhline(0)
-            (all(x == 0 for x in x_data) and len(set(y_data)) > 1)     # axvline(0)
-        ):
-            filtered_lines.append(line)
-            
-    lines = filtered_lines
+    # Only the lines of the pairs, in order, without axis lines and fits
+    lines = parent_widget.lines
 
     if not lines:
         QMessageBox.critical(parent_widget, "Errore", "Nessuna linea presente nel grafico!")
@@ -437,6 +654,7 @@ def customize_plot_style(parent_widget, plot_customizations, number_plots, figur
             }
 
             ax.legend()
+            parent_widget.legend_key = None
             fig.canvas.draw_idle()
             dialog.accept()
 
@@ -484,7 +702,9 @@ def open_curve_fitting_window(app_instance, plot_widget):
             "in tal caso sarà quello a sinistra.\n\n"
             "ACHTUNG: la funzione va scritta in Python, quindi ad esempio |x| è abs(x), x^2 è x**2, e tutte "
             "le altre funzioni vanno scritte con np. davanti (i.e. np.cos(x), np.exp(x)), tranne per le funzioni speciali, "
-            "per le quali va usato il nome che usa la libreria scipy.special (i.e. scipy.special.erf diventa erf)"
+            "per le quali va usato il nome che usa la libreria scipy.special (i.e. scipy.special.erf diventa erf)\n\n"
+            "In alternativa si può scegliere un modello già pronto (tanh, Langevin, Brillouin, due fasi): "
+            "i parametri iniziali possono essere stimati automaticamente dai dati di ciascun file."
         )
 
         QMessageBox.information(window, "Guida al Fitting", help_text)
@@ -534,6 +754,11 @@ def open_curve_fitting_window(app_instance, plot_widget):
     x_end_edit = QLineEdit("1")
     param_layout.addWidget(x_end_edit)
 
+    param_layout.addWidget(QLabel("Modello:"))
+    model_combo = QComboBox()
+    model_combo.addItems(["Funzione personalizzata", *MODEL_LIBRARY])
+    param_layout.addWidget(model_combo)
+
     param_layout.addWidget(QLabel("Nomi parametri (es. a,b):"))
     param_names_edit = QLineEdit("a,b")
     param_layout.addWidget(param_names_edit)
@@ -546,6 +771,54 @@ def open_curve_fitting_window(app_instance, plot_widget):
     function_edit = QLineEdit("a*(x - b)")
     param_layout.addWidget(function_edit)
 
+    description_label = QLabel("")
+    param_layout.addWidget(description_label)
+
+    guess_check = QCheckBox("Stima automatica dei parametri iniziali")
+    guess_check.setEnabled(False)
+    param_layout.addWidget(guess_check)
+
+    def selected_data():
+        ''' Data of the selected columns in the range of the fit
+        '''
+        df     = dataframes[file_combo.currentIndex()]
+        x_data = df[x_combo.currentText()].to_numpy()
+        y_data = df[y_combo.currentText()].to_numpy()
+        mask   = (x_data >= float(x_start_edit.text())) & (x_data <= float(x_end_edit.text()))
+        return x_data[mask], y_data[mask]
+
+    def read_initial_params():
+        ''' Initial parameters written by the user, None if they are estimated
+        '''
+        if guess_check.isEnabled() and guess_check.isChecked():
+            return None
+        return [float(p.strip()) for p in initial_params_edit.text().split(",")]
+
+    def on_model_changed():
+        model = MODEL_LIBRARY.get(model_combo.currentText())
+        custom = model is None
+
+        function_edit.setReadOnly(not custom)
+        param_names_edit.setReadOnly(not custom)
+        guess_check.setEnabled(not custom)
+        guess_check.setChecked(not custom)
+
+        if custom:
+            description_label.setText("")
+            return
+
+        function_edit.setText(model.expression)
+        param_names_edit.setText(",".join(model.param_names))
+        description_label.setText(model.description)
+
+        # Show the estimate for the selected data, it can be edited
+        try:
+            initial_params_edit.setText(",".join(f"{p:.4g}" for p in model.guess(*selected_data())))
+        except Exception:
+            initial_params_edit.setText(",".join("1" for _ in model.param_names))
+
+    model_combo.currentIndexChanged.connect(on_model_changed)
+
     output_box = QTextEdit()
     output_box.setReadOnly(True)
     output_box.setSizePolicy(QSizePolicy.Expanding, QSizePolicy.Expanding)
@@ -559,8 +832,8 @@ def open_curve_fitting_window(app_instance, plot_widget):
             x_col   = x_combo.currentText()
             y_col   = y_combo.currentText()
 
-            x_data  = df[x_col].astype(float).values
-            y_data  = df[y_col].astype(float).values
+            x_data  = df[x_col].to_numpy()
+            y_data  = df[y_col].to_numpy()
 
             x_start = float(x_start_edit.text())
             x_end   = float(x_end_edit.text())
@@ -573,25 +846,38 @@ def open_curve_fitting_window(app_instance, plot_widget):
                 return
 
             param_names    = [p.strip() for p in param_names_edit.text().split(",")]
-            initial_params = [float(p.strip()) for p in initial_params_edit.text().split(",")]
+            initial_params = read_initial_params()
+
+            # Compiled only the first time, then taken from the cache
+            model = get_model(function_edit.text(), param_names)
 
-            func_code = f"lambda x, {', '.join(param_names)}: {function_edit.text()}"
-            fit_func  = eval(func_code)
+            row = fit_columns(model.expression, param_names, x_fit, y_fit, initial_params)
+            if not row["success"]:
+                raise RuntimeError(row["message"])
 
-            params, pcov = curve_fit(fit_func, x_fit, y_fit, p0=initial_params)
-            y_plot = fit_func(np.linspace(x_start, x_end, 500), *params)
+            params = [row[p] for p in param_names]
+            errors = [row[f"error_{p}"] for p in param_names]
+            y_plot = model.func(np.linspace(x_start, x_end, 500), *params)
 
-            fig = plot_widget.figure
-            ax  = plot_widget.ax
-            ax.plot(np.linspace(x_start, x_end, 500), y_plot, linestyle="--", color="green")
-            plot_widget.canvas.draw()
+            # The fit is drawn with blitting over the existing plot
+            if plot_widget.figure is not None:
+                fit_line, = plot_widget.ax.plot(np.linspace(x_start, x_end, 500), y_plot,
+                                                linestyle="--", color="green", scalex=False, scaley=False)
+                plot_widget.add_overlay(fit_line)
 
             result_lines = []
-            for p, val, err in zip(param_names, params, np.sqrt(np.diag(pcov))):
+            for p, val, err in zip(param_names, params, errors):
                 result_lines.append(f"{p} = {val:.3e} ± {err:.3e}")
                 fit_results[p] = val
                 fit_results[f"error_{p}"] = err
 
+            # The table keeps the results of each file and pair of columns
+            row.update({"file": df_idx + 1, "filename": df.attrs.get("filename", ""),
+                        "x": x_col, "y": y_col})
+            app_instance.fit_table = update_fit_table(app_instance.fit_table, [row])
+            record_step(df, "fit", [x_col, y_col], expression=model.expression,
+                        param_names=param_names, p0=initial_params, x_range=[x_start, x_end])
+
             result = "\n".join(result_lines)
             output_box.setPlainText(result)
             logger.info("Fit completato con successo.")
@@ -602,14 +888,146 @@ def open_curve_fitting_window(app_instance, plot_widget):
         except Exception as e:
             QMessageBox.critical(window, "Errore", f"Errore durante il fitting: {e}")
            
+    def perform_batch_fit():
+        '''
+        Fit the model to the same columns of all the files with the
+        same number of columns of the selected one, in parallel.
+        '''
+        try:
+            df_idx  = file_combo.currentIndex()
+            columns = list(dataframes[df_idx].columns)
+            i_x     = columns.index(x_combo.currentText())
+            i_y     = columns.index(y_combo.currentText())
+            x_start = float(x_start_edit.text())
+            x_end   = float(x_end_edit.text())
+
+            param_names    = [p.strip() for p in param_names_edit.text().split(",")]
+            initial_params = read_initial_params()
+
+            # Errors in the function are reported here, not once for each file
+            model = get_model(function_edit.text(), param_names)
+        except Exception as e:
+            QMessageBox.critical(window, "Errore", f"Errore durante il fitting: {e}")
+            return
+
+        keys, targets, args_list = [], [], []
+        for i, df in enumerate(dataframes):
+            if len(df.columns) != len(columns):
+                continue
+            x_col, y_col = df.columns[i_x], df.columns[i_y]
+            x_data, y_data = df[x_col].to_numpy(), df[y_col].to_numpy()
+            mask = (x_data >= x_start) & (x_data <= x_end)
+
+            keys.append({"file": i + 1, "filename": df.attrs.get("filename", ""), "x": x_col, "y": y_col})
+            targets.append(df)
+            args_list.append((model.expression, param_names, x_data[mask], y_data[mask], initial_params))
+
+        rows = []
+
+        def on_result(i, row, error):
+            if error is not None:
+                row = {"model": model.expression, "success": False, "message": str(error)}
+            rows.append({**keys[i], **row})
+
+            # Only the fits that worked become part of the history of the file
+            if row["success"]:
+                record_step(targets[i], "fit", [keys[i]["x"], keys[i]["y"]], expression=model.expression,
+                            param_names=param_names, p0=initial_params, x_range=[x_start, x_end])
+
+        def on_finished():
+            app_instance.fit_table = update_fit_table(app_instance.fit_table, rows)
+
+            n_ok = sum(row["success"] for row in rows)
+            output_box.setPlainText(f"Fit riusciti: {n_ok} su {len(keys)} file.\n"
+                                    "I risultati sono nella tabella 'fit_table'.")
+            logger.info(f"Fit di {model.expression} su {len(keys)} file: {n_ok} riusciti.")
+            for row in rows:
+                if not row["success"]:
+                    logger.warning(f"Fit del file {row['file']} ({row['y']}) fallito: {row['message']}")
+
+            app_instance.refresh_shell_variables()
+            show_fit_table(app_instance)
+
+        window.batch_runner = PoolRunner(
+            fit_columns, args_list, on_result, on_finished,
+            label=f"Fit di {len(args_list)} file in corso...", parent=window
+        )
+
     fit_button = QPushButton("Esegui Fit")
     fit_button.clicked.connect(perform_fit)
     param_layout.addWidget(fit_button)
 
+    batch_button = QPushButton("Fit su tutti i file con lo stesso numero di colonne")
+    batch_button.clicked.connect(perform_batch_fit)
+    param_layout.addWidget(batch_button)
+
+    table_button = QPushButton("Tabella risultati")
+    table_button.clicked.connect(lambda: show_fit_table(app_instance))
+    param_layout.addWidget(table_button)
+
     # Sub-window for fitting panel
     sub = QMdiSubWindow()
     sub.setWidget(window)
     sub.setWindowTitle("Curve Fitting")
     sub.resize(600, 300)
     app_instance.mdi_area.addSubWindow(sub)
-    sub.show()
\ No newline at end of file
+    sub.show()
+
+def show_fit_table(app_instance):
+    '''
+    Show the table of the fit results, one row for each file and pair of columns.
+
+    Parameters
+    ----------
+    app_instance : MainApp
+        Main application instance containing the fit results.
+    '''
+    show_table(app_instance, app_instance.fit_table, "Risultati dei fit", "Nessun fit eseguito.")
+
+
+def show_table(app_instance, table, title, empty_message):
+    '''
+    Show a table of results in a sub-window, with the possibility to export it.
+
+    Parameters
+    ----------
+    app_instance : MainApp
+        Main application instance.
+    table : pandas.DataFrame
+        table to show
+    title : str
+        title of the window
+    empty_message : str
+        message shown instead of the window if the table is empty
+    '''
+    if table.empty:
+        QMessageBox.information(app_instance, title, empty_message)
+        return
+
+    window = QWidget()
+    layout = QVBoxLayout(window)
+
+    view = QTableView()
+    view.setModel(ArrayTableModel(table.to_numpy(dtype=object), [str(c) for c in table.columns], parent=view))
+    layout.addWidget(view)
+
+    def export_csv():
+        file_path, _ = QFileDialog.getSaveFileName(window, "Esporta risultati", "", "CSV (*.csv)")
+        if not file_path:
+            return
+        try:
+            table.to_csv(file_path, index=False)
+            app_instance.logger.info(f"{title} esportati in {file_path}")
+        except Exception as e:
+            QMessageBox.critical(window, "Errore", f"Errore durante l'esportazione:\n{e}")
+
+    export_button = QPushButton("Esporta CSV")
+    export_button.clicked.connect(export_csv)
+    layout.addWidget(export_button)
+
+    sub = QMdiSubWindow()
+    sub.setWidget(window)
+    sub.setWindowTitle(title)
+    sub.resize(700, 300)
+    app_instance.mdi_area.addSubWindow(sub)
+    sub.show()
@@ -1,8 +1,6 @@
 """
 Code for manage script's window
 """
-import io
-import sys
 from PyQt5.QtWidgets import ( QWidget, QVBoxLayout, QPushButton,
                               QPlainTextEdit, QFileDialog, QMessageBox,
                               QHBoxLayout
@@ -50,38 +48,18 @@ class ScriptEditor(QWidget):
             QMessageBox.critical(self, "Errore", "Shell non trovata.")
             return
 
-        # Redirection of standard output and error
-        old_stdout, old_stderr = sys.stdout, sys.stderr
-        sys.stdout = output_capture = io.StringIO()
-        sys.stderr = output_capture
-
-        try:
-            exec(script_text, globals(), shell.local_vars)
-        except Exception as e:
-            output_capture.write(f"\nErrore: {str(e)}\n")
-        finally:
-            sys.stdout = old_stdout
-            sys.stderr = old_stderr
-
-        output = output_capture.getvalue()
-
-        if output.strip():
-            # Write over the prompt
-            text = shell.shell_text.toPlainText()
-            last_prompt_index = text.rfind(">>> ")
-
-            if last_prompt_index != -1:
-                # Take all except the prompt
-                before_prompt = text[:last_prompt_index]
-
-                # Build the final output
-                new_text = before_prompt + output + "\n>>> "
-
-                # Overwrite in the shell
-                shell.shell_text.setPlainText(new_text)
-                shell.shell_text.moveCursor(shell.shell_text.textCursor().End)
+        # Remove the empty prompt, the output of the script takes its place
+        text = shell.shell_text.toPlainText()
+        last_prompt_index = text.rfind(">>> ")
+        has_prompt = last_prompt_index != -1 and not text[last_prompt_index + 4:].strip()
 
+        if not shell.run_code(script_text):
+            QMessageBox.warning(self, "Attenzione", "La shell sta ancora eseguendo del codice.")
+            return
 
+        if has_prompt:
+            shell.shell_text.setPlainText(text[:last_prompt_index])
+            shell.shell_text.moveCursor(shell.shell_text.textCursor().End)
 
     def save_script(self):
         path, _ = QFileDialog.getSaveFileName(
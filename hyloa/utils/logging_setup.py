@@ -2,29 +2,107 @@
 Code for logger setup
 """
 import logging
+from collections import deque
+
+from PyQt5.QtCore import QObject, pyqtSignal
 from PyQt5.QtWidgets import QFileDialog, QMessageBox
 
+from hyloa.utils.queue_logging import setup_logging as queue_setup_logging
+
+
+MAX_BACKLOG = 5000      # Messages kept for the log panels opened later
+
+_qt_handler = None      # The only QtLogHandler, see get_qt_handler
+
+
+class LogEmitter(QObject):
+    ''' Object owning the signal of QtLogHandler
+    '''
+    message = pyqtSignal(str)
+
 
-def setup_logging(log_file):
+class QtLogHandler(logging.Handler):
     '''
-    Configures logging to the specified file.
+    Handler that sends the messages to the gui with a Qt signal.
+    It is called by the thread of the QueueListener, the signal is
+    queued and delivered on the gui thread. The last messages are kept,
+    so a panel opened later can show them.
 
     Parameters
     ----------
-    log_file : str
-        Path to the log file.
+    backlog : int, optional
+        number of messages kept, default MAX_BACKLOG
     '''
-    try:
-        logging.basicConfig(
-            filename=log_file,
-            level=logging.INFO,
-            format="%(asctime)s -  %(name)s - %(levelname)s - %(message)s",
-            datefmt="%Y-%m-%d %H:%M:%S"
-        )
-        logging.info("Inizio sessione di log.")
-        logging.info(f"Logging configurato: scrittura su {log_file}")
-    except Exception as e:
-        raise Exception(f"Errore durante la configurazione del logging: {e}")
+
+    def __init__(self, backlog=MAX_BACKLOG):
+        super().__init__()
+        self.emitter = LogEmitter()
+        self.backlog = deque(maxlen=backlog)
+        self.setFormatter(logging.Formatter("%(message)s"))
+
+    def emit(self, record):
+        try:
+            text = self.format(record)
+        except Exception:
+            self.handleError(record)
+            return
+        # handle() already holds the lock, so connect() cannot miss a message
+        self.backlog.append(text)
+        self.emitter.message.emit(text)
+
+    def connect(self, slot):
+        '''
+        Connect a slot to the messages.
+
+        Parameters
+        ----------
+        slot : callable
+            called with the text of each new message
+
+        Returns
+        -------
+        list of str
+            messages emitted before the connection
+        '''
+        self.acquire()
+        try:
+            self.emitter.message.connect(slot)
+            return list(self.backlog)
+        finally:
+            self.release()
+
+
+def get_qt_handler():
+    ''' The handler of the log panels, created the first time
+    '''
+    global _qt_handler
+    if _qt_handler is None:
+        _qt_handler = QtLogHandler()
+    return _qt_handler
+
+
+def setup_logging(log_file, json_file=None, gui=True):
+    '''
+    Configures logging to the specified file, see hyloa.utils.queue_logging.setup_logging.
+
+    Parameters
+    ----------
+    log_file : str or None
+        Path to the log file, None to write on the standard error.
+    json_file : str, optional
+        Path of a second file where the records are written as JSON lines.
+    gui : bool, optional
+        if True (default) the records are also sent to the log panels,
+        see get_qt_handler
+
+    Returns
+    -------
+    QtLogHandler or None
+        the handler of the log panels, None if gui is False
+    '''
+    handler = get_qt_handler() if gui else None
+    queue_setup_logging(log_file, json_file, [handler] if gui else [])
+    return handler
 
 
 def start_logging(app_instance, parent_widget=None):
@@ -62,7 +140,7 @@ def start_logging(app_instance, parent_widget=None):
 
     if log_file:
         try:
-            setup_logging(log_file)
+            app_instance.log_handler = setup_logging(log_file)
             app_instance.logger = logging.getLogger(__name__)
             app_instance.logger.info("Logging configurato con successo.")
             app_instance.logger_path = log_file
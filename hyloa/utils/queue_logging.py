@@ -0,0 +1,142 @@
+"""
+Logging through a queue: the loggers only put the records in a queue and
+a QueueListener writes them in its own thread, so logging never waits
+for the disk. The queue is shared with the worker processes, see
+pool_logging, so their records are written in the same files.
+Nothing here depends on Qt, so it is used also by the headless batch
+processing (see hyloa/batch.py); the log panels of the gui add their
+handler with hyloa.utils.logging_setup.
+"""
+import json
+import atexit
+import logging
+import multiprocessing
+from logging.handlers import QueueHandler, QueueListener
+
+
+LOG_FORMAT  = "%(asctime)s -  %(name)s - %(levelname)s - %(message)s"
+DATE_FORMAT = "%Y-%m-%d %H:%M:%S"
+
+_listener = None        # QueueListener writing the records, see setup_logging
+_queue    = None        # Queue of the records, also used by the worker processes
+_owned    = []          # Handlers opened by setup_logging, closed by stop_logging
+
+
+class JsonLinesFormatter(logging.Formatter):
+    '''
+    Formatter writing each record as a line of JSON, to be read by programs
+    '''
+
+    def format(self, record):
+        entry = {
+            "time"    : self.formatTime(record, DATE_FORMAT),
+            "created" : record.created,
+            "name"    : record.name,
+            "level"   : record.levelname,
+            "message" : record.getMessage(),
+        }
+        if record.exc_info:
+            entry["exception"] = self.formatException(record.exc_info)
+        return json.dumps(entry, ensure_ascii=False)
+
+
+def setup_logging(log_file, json_file=None, handlers=()):
+    '''
+    Configures logging to the specified file.
+    The loggers only put the records in a queue, a QueueListener writes
+    them on disk in its own thread, so logging never waits for the disk.
+    Calling it again replaces the previous configuration.
+
+    Parameters
+    ----------
+    log_file : str or None
+        Path to the log file, None to write on the standard error.
+    json_file : str, optional
+        Path of a second file where the records are written as JSON lines.
+    handlers : iterable of logging.Handler, optional
+        other handlers fed by the listener; they are not closed by stop_logging
+    '''
+    global _listener, _queue
+    try:
+        stop_logging()
+
+        handler = logging.FileHandler(log_file, encoding="utf-8") if log_file \
+                  else logging.StreamHandler()
+        handler.setFormatter(logging.Formatter(LOG_FORMAT, datefmt=DATE_FORMAT))
+        _owned.append(handler)
+
+        if json_file:
+            json_handler = logging.FileHandler(json_file, encoding="utf-8")
+            json_handler.setFormatter(JsonLinesFormatter())
+            _owned.append(json_handler)
+
+        _queue = multiprocessing.Queue()
+        root   = logging.getLogger()
+        root.addHandler(QueueHandler(_queue))
+        root.setLevel(logging.INFO)
+
+        _listener = QueueListener(_queue, *_owned, *handlers, respect_handler_level=True)
+        _listener.start()
+
+        logging.info("Inizio sessione di log.")
+        logging.info(f"Logging configurato: scrittura su {log_file or 'standard error'}")
+    except Exception as e:
+        raise Exception(f"Errore durante la configurazione del logging: {e}")
+
+
+def stop_logging():
+    '''
+    Write the records still in the queue and close the log files.
+    '''
+    global _listener, _queue
+    root = logging.getLogger()
+    for old in [h for h in root.handlers if isinstance(h, QueueHandler)]:
+        root.removeHandler(old)
+
+    if _listener is not None:
+        _listener.stop()
+        _listener = None
+    if _queue is not None:
+        _queue.close()
+        _queue.join_thread()
+        _queue = None
+    while _owned:
+        _owned.pop().close()
+
+
+def worker_logging(records, level=logging.INFO):
+    '''
+    Initializer of a worker process: its records are sent to the
+    queue of the main process, instead of being lost.
+
+    Parameters
+    ----------
+    records : multiprocessing.Queue or None
+        queue of the main process, None if logging is not configured
+    level : int, optional
+        minimum level of the records sent
+    '''
+    if records is None:
+        return
+    root = logging.getLogger()
+    # With fork the handlers of the main process are inherited
+    for old in list(root.handlers):
+        root.removeHandler(old)
+    root.addHandler(QueueHandler(records))
+    root.setLevel(level)
+
+
+def pool_logging():
+    '''
+    Arguments for a ProcessPoolExecutor whose workers log in the
+    files of the main process, e.g. ProcessPoolExecutor(**pool_logging()).
+
+    Returns
+    -------
+    dict
+        initializer and initargs of the pool
+    '''
+    return {"initializer": worker_logging, "initargs": (_queue,)}
+
+
+atexit.register(stop_logging)
@@ -0,0 +1,406 @@
+"""
+Code to run heavy jobs in a pool of worker processes, and the code
+written by the user in a worker thread, without blocking the Qt event loop.
+"""
+import os
+import sys
+import time
+import ctypes
+import threading
+import numpy as np
+from types import ModuleType
+from concurrent.futures import ProcessPoolExecutor, ThreadPoolExecutor
+
+from PyQt5.QtCore import Qt, QObject, QThread, QTimer, pyqtSignal
+from PyQt5.QtWidgets import QProgressDialog
+
+from hyloa.utils.queue_logging import pool_logging
+
+
+class PoolRunner(QObject):
+    '''
+    Submit the same function with many arguments to a pool of workers.
+    A QTimer polls the futures, so the results are delivered on the gui
+    thread, in the same order of the arguments, as soon as they are ready,
+    and a progress dialog allows to cancel the jobs not yet started.
+
+    Parameters
+    ----------
+    func : callable
+        function to run, must be defined at module level (it is pickled)
+    args_list : list of tuple
+        arguments of each call
+    on_result : callable
+        called as on_result(i, result, error) for each job, in order;
+        error is None on success, otherwise the raised exception
+    on_finished : callable, optional
+        called without arguments when all jobs are done or cancelled
+    label : str, optional
+        text of the progress dialog
+    parent : QWidget, optional
+        parent of the progress dialog
+    processes : bool, optional
+        use processes (default) or threads
+    max_workers : int, optional
+        number of workers, default the number of cores
+    '''
+
+    def __init__(self, func, args_list, on_result, on_finished=None, label="",
+                 parent=None, processes=True, max_workers=None):
+        super().__init__(parent)
+
+        self.on_result   = on_result
+        self.on_finished = on_finished
+        self.next_index  = 0      # First job whose result has not been delivered yet
+        self.cancelled   = False
+
+        if processes:
+            self.executor = ProcessPoolExecutor(max_workers=max_workers or os.cpu_count(), **pool_logging())
+        else:
+            self.executor = ThreadPoolExecutor(max_workers=max_workers or os.cpu_count())
+        self.futures  = [self.executor.submit(func, *args) for args in args_list]
+
+        self.progress = QProgressDialog(label, "Annulla", 0, len(self.futures), parent)
+        self.progress.setWindowTitle("Attendere")
+        self.progress.setMinimumDuration(0)
+        self.progress.canceled.connect(self.cancel)
+        self.progress.show()
+
+        self.timer = QTimer(self)
+        self.timer.timeout.connect(self.poll)
+        self.timer.start(50)
+
+    def poll(self):
+        ''' Deliver the results that are ready, in order
+        '''
+        while self.next_index < len(self.futures):
+            future = self.futures[self.next_index]
+            if not future.done():
+                break
+
+            if not future.cancelled():
+                error = future.exception()
+                self.on_result(self.next_index, None if error else future.result(), error)
+
+            self.next_index += 1
+            self.progress.setValue(self.next_index)
+
+        if self.next_index == len(self.futures):
+            self.finish()
+
+    def cancel(self):
+        ''' Cancel all the jobs not yet started
+        '''
+        self.cancelled = True
+        for future in self.futures:
+            future.cancel()
+
+    def finish(self):
+        ''' Stop polling and release the workers
+        '''
+        self.timer.stop()
+        self.executor.shutdown(wait=False)
+        self.progress.close()
+        if self.on_finished is not None:
+            self.on_finished()
+
+#==============================================================================================#
+# Execution of the code of the user                                                           #
+#==============================================================================================#
+
+class ExecutionCancelled(KeyboardInterrupt):
+    ''' Raised in the worker thread to stop the code of the user
+    '''
+
+
+class OutputRouter:
+    '''
+    File-like object installed once as sys.stdout and sys.stderr.
+    The writes of a thread with a registered buffer go to that buffer,
+    all the others go to the original stream, so the output of the code
+    running in a worker does not mix with the rest of the application.
+
+    Parameters
+    ----------
+    fallback : file-like or None
+        original stream
+    '''
+
+    def __init__(self, fallback):
+        self.fallback = fallback
+        self.targets  = {}      # {thread ident : callable receiving the text}
+
+    def write(self, text):
+        target = self.targets.get(threading.get_ident())
+        if target is not None:
+            target(text)
+        elif self.fallback is not None:
+            self.fallback.write(text)
+        return len(text)
+
+    def flush(self):
+        if threading.get_ident() not in self.targets and self.fallback is not None:
+            self.fallback.flush()
+
+    def __getattr__(self, name):
+        return getattr(self.fallback, name)
+
+
+def install_output_router():
+    '''
+    Replace sys.stdout and sys.stderr with an OutputRouter, only the first time.
+
+    Returns
+    -------
+    tuple of OutputRouter
+        routers of stdout and stderr
+    '''
+    if not isinstance(sys.stdout, OutputRouter):
+        sys.stdout = OutputRouter(sys.stdout)
+    if not isinstance(sys.stderr, OutputRouter):
+        sys.stderr = OutputRouter(sys.stderr)
+    return sys.stdout, sys.stderr
+
+
+class CodeRunner(QObject):
+    '''
+    Execute some code in a worker thread. As for PoolRunner a QTimer polls
+    the worker, so the output is delivered on the gui thread, a piece at
+    a time while the code runs, and so is the end of the execution.
+
+    The execution can be cancelled, or stopped after a timeout, by raising
+    ExecutionCancelled in the worker thread with PyThreadState_SetAsyncExc.
+    The exception is raised at the next Python instruction: a call to
+    compiled code (a huge numpy operation, a fit, time.sleep, a blocking
+    read) cannot be interrupted and ends before the code stops.
+
+    The worker must not touch the gui: the objects of the gui given to
+    the code (e.g. matplotlib.pyplot) have to be wrapped in a GuiProxy.
+
+    Parameters
+    ----------
+    code : str
+        code to execute
+    global_vars : dict
+        global namespace of the code
+    local_vars : dict
+        local namespace of the code, modified by the execution
+    on_output : callable
+        called as on_output(text) with the new output of the code
+    on_finished : callable
+        called as on_finished(error) at the end; error is None on success,
+        otherwise the raised exception (ExecutionCancelled if the code
+        was cancelled, see also timed_out)
+    timeout : float, optional
+        maximum time of execution in seconds, None (default) for no limit
+    parent : QObject, optional
+        parent of the runner
+    '''
+
+    def __init__(self, code, global_vars, local_vars, on_output, on_finished,
+                 timeout=None, parent=None):
+        super().__init__(parent)
+
+        self.on_output   = on_output
+        self.on_finished = on_finished
+        self.timeout     = timeout
+        self.timed_out   = False
+        self.error       = None
+        self.chunks      = []     # Output not yet delivered, appended by the worker
+        self.lock        = threading.Lock()
+
+        self.routers = install_output_router()
+        self.thread  = threading.Thread(target=self.run, daemon=True,
+                                        args=(code, global_vars, local_vars))
+        self.start_time = time.monotonic()
+        self.thread.start()
+
+        self.timer = QTimer(self)
+        self.timer.timeout.connect(self.poll)
+        self.timer.start(50)
+
+    def write(self, text):
+        ''' Collect the output of the worker, called on the worker thread
+        '''
+        with self.lock:
+            self.chunks.append(text)
+
+    def run(self, code, global_vars, local_vars):
+        ''' Body of the worker thread
+        '''
+        ident = threading.get_ident()
+        for router in self.routers:
+            router.targets[ident] = self.write
+        try:
+            exec(compile(code, "<shell>", "exec"), global_vars, local_vars)
+        except BaseException as e:
+            self.error = e
+        finally:
+            for router in self.routers:
+                router.targets.pop(ident, None)
+
+    def is_running(self):
+        ''' True until the results have been delivered
+        '''
+        return self.timer.isActive()
+
+    def deliver_output(self):
+        ''' Pass the collected output to on_output
+        '''
+        with self.lock:
+            text, self.chunks = "".join(self.chunks), []
+        if text:
+            self.on_output(text)
+
+    def poll(self):
+        ''' Deliver the output and check if the worker is done or too slow
+        '''
+        self.deliver_output()
+
+        if not self.thread.is_alive():
+            self.finish()
+        elif (self.timeout and not self.timed_out
+                and time.monotonic() - self.start_time > self.timeout):
+            self.timed_out = True
+            self.cancel()
+
+    def cancel(self):
+        '''
+        Ask the worker to stop, raising ExecutionCancelled in it.
+        The code stops only when it runs its next Python instruction,
+        see the notes of the class.
+        '''
+        if self.thread.is_alive():
+            ctypes.pythonapi.PyThreadState_SetAsyncExc(
+                ctypes.c_ulong(self.thread.ident), ctypes.py_object(ExecutionCancelled))
+
+    def finish(self):
+        ''' Stop polling and report the end of the execution
+        '''
+        self.timer.stop()
+        self.deliver_output()
+        self.on_finished(self.error)
+
+
+class GuiInvoker(QObject):
+    '''
+    Run functions on the gui thread on behalf of a worker thread.
+    The worker sends the call with a queued signal and waits for the result.
+
+    Parameters
+    ----------
+    parent : QObject, optional
+        parent of the invoker, must live in the gui thread
+    '''
+    request = pyqtSignal(object)
+
+    def __init__(self, parent=None):
+        super().__init__(parent)
+        self.request.connect(self.execute, Qt.QueuedConnection)
+
+    def execute(self, job):
+        ''' Run a job sent by invoke, on the gui thread
+        '''
+        func, args, kwargs, outcome, done = job
+        try:
+            outcome["result"] = func(*args, **kwargs)
+        except BaseException as e:
+            outcome["error"] = e
+        finally:
+            done.set()
+
+    def invoke(self, func, *args, **kwargs):
+        '''
+        Call func(*args, **kwargs) on the gui thread and return its result.
+        From the gui thread the function is simply called.
+        '''
+        if QThread.currentThread() is self.thread():
+            return func(*args, **kwargs)
+
+        outcome, done = {}, threading.Event()
+        self.request.emit((func, args, kwargs, outcome, done))
+
+        # Short waits, so that ExecutionCancelled can stop the worker meanwhile
+        while not done.wait(0.05):
+            pass
+
+        if "error" in outcome:
+            raise outcome["error"]
+        return outcome["result"]
+
+
+def _unwrap(value):
+    ''' The objects wrapped by the GuiProxy in some arguments
+    '''
+    if isinstance(value, GuiProxy):
+        return object.__getattribute__(value, "_target")
+    if isinstance(value, (list, tuple)):
+        return type(value)(_unwrap(v) for v in value)
+    return value
+
+
+class GuiProxy:
+    '''
+    Wrapper of an object of the gui (e.g. the module matplotlib.pyplot)
+    used by code running in a worker thread: every attribute access and
+    every call is executed on the gui thread by a GuiInvoker. The figures,
+    axes, artists and canvases returned are wrapped in turn.
+
+    Parameters
+    ----------
+    target : object
+        wrapped object
+    invoker : GuiInvoker
+        invoker living in the gui thread
+    '''
+
+    def __init__(self, target, invoker):
+        object.__setattr__(self, "_target", target)
+        object.__setattr__(self, "_invoker", invoker)
+
+    def _wrap(self, value):
+        ''' Wrap the results that belong to the gui
+        '''
+        from matplotlib.artist import Artist
+        from matplotlib.backend_bases import FigureCanvasBase
+
+        invoker = object.__getattribute__(self, "_invoker")
+        if isinstance(value, (ModuleType, Artist, FigureCanvasBase)):
+            return GuiProxy(value, invoker)
+        if isinstance(value, (list, tuple)):
+            return type(value)(self._wrap(v) for v in value)
+        if isinstance(value, np.ndarray) and value.dtype == object:
+            # e.g. the array of axes of plt.subplots
+            wrapped = value.copy()
+            for i, v in enumerate(value.flat):
+                wrapped.flat[i] = self._wrap(v)
+            return wrapped
+        return value
+
+    def __getattr__(self, name):
+        target  = object.__getattribute__(self, "_target")
+        invoker = object.__getattribute__(self, "_invoker")
+
+        value = invoker.invoke(getattr, target, name)
+        if not callable(value) or isinstance(value, type):
+            return self._wrap(value)
+
+        def call(*args, **kwargs):
+            return self._wrap(invoker.invoke(value, *_unwrap(args),
+                                             **{k: _unwrap(v) for k, v in kwargs.items()}))
+        return call
+
+    def __setattr__(self, name, value):
+        target  = object.__getattribute__(self, "_target")
+        invoker = object.__getattribute__(self, "_invoker")
+        invoker.invoke(setattr, target, name, _unwrap(value))
+
+    def __call__(self, *args, **kwargs):
+        target  = object.__getattribute__(self, "_target")
+        invoker = object.__getattribute__(self, "_invoker")
+        return self._wrap(invoker.invoke(target, *_unwrap(args),
+                                         **{k: _unwrap(v) for k, v in kwargs.items()}))
+
+    def __repr__(self):
+        return f"GuiProxy({object.__getattribute__(self, '_target')!r})"
+
@@ -9,7 +9,7 @@ setup(
     long_description=open("README.md", encoding="utf-8").read(),
     long_description_content_type="text/markdown",
     url="https://github.com/Francesco-Zeno-Costanzo/hyloa",
-    packages=find_packages(where="."),  # Search package in hyloa/
+    packages=find_packages(where=".", exclude=["tests", "tests.*"]),  # Search package in hyloa/
     package_dir={"": "."},  # Means that hyloa/ in the root
     include_package_data=True,
     install_requires=[
@@ -19,6 +19,9 @@ setup(
         "pandas",
         "matplotlib",
     ],
+    extras_require={
+        "yaml": ["PyYAML"],     # Pipelines written in YAML, see hyloa.data.pipeline
+    },
     classifiers=[
         "Programming Language :: Python :: 3",
         "License :: OSI Approved :: GNU General Public License v3 (GPLv3)",
@@ -28,6 +31,7 @@ setup(
     entry_points={
         "console_scripts": [
             "hyloa=hyloa.main:main",
+            "hyloa-batch=hyloa.batch:main",
         ],
     },
 )
@@ -0,0 +1,61 @@
+"""
+Tests of the figures of merit of the loops, hyloa.data.analysis.
+"""
+import numpy as np
+import pandas as pd
+
+from hyloa.data.analysis import loop_figures, analyze_dataframes
+
+
+def tanh_loop(ms=2.0, hc=30.0, width=10.0, shift=0.0, offset=0.0, n=2001):
+    ''' Loop with known coercivity, remanence and saturation
+    '''
+    h_up = np.linspace(-500, 500, n)
+    h_dw = h_up[::-1]
+    m_up = ms * np.tanh((h_up - shift - hc) / width) + offset
+    m_dw = ms * np.tanh((h_dw - shift + hc) / width) + offset
+    return h_up, m_up, h_dw, m_dw
+
+
+def test_figures_of_a_tanh_loop():
+    figures = loop_figures(*tanh_loop())
+
+    np.testing.assert_allclose(figures["Hc"], 30.0, rtol=1e-3)
+    np.testing.assert_allclose(figures["Hc_up"], 30.0, rtol=1e-3)
+    np.testing.assert_allclose(figures["Hc_dw"], -30.0, rtol=1e-3)
+    np.testing.assert_allclose(figures["Mr"], 2.0 * np.tanh(3.0), rtol=1e-3)
+    np.testing.assert_allclose(figures["Ms"], 2.0, rtol=1e-3)
+    np.testing.assert_allclose(figures["squareness"], np.tanh(3.0), rtol=1e-3)
+    # Two branches 2 * Ms apart over a field range of about 2 * Hc
+    np.testing.assert_allclose(figures["area"], 2 * 2.0 * 2 * 30.0, rtol=1e-2)
+
+
+def test_shift_and_offset_do_not_change_the_loop():
+    figures = loop_figures(*tanh_loop(shift=12.0, offset=0.7))
+
+    np.testing.assert_allclose(figures["Hc"], 30.0, rtol=1e-3)
+    np.testing.assert_allclose(figures["H_eb"], 12.0, rtol=1e-3)
+    np.testing.assert_allclose(figures["Ms"], 2.0, rtol=1e-3)
+    # The remanence is taken at H = 0, which is no longer the center of the loop
+    np.testing.assert_allclose(figures["Mr_up"], 2.0 * np.tanh((-12.0 - 30.0) / 10.0), rtol=1e-3)
+
+
+def test_a_stack_is_the_same_as_one_loop_at_a_time():
+    loops  = [tanh_loop(hc=hc, shift=s) for hc, s in ((30, 0), (50, 5), (10, -3))]
+    stack  = loop_figures(*(np.array(arrays) for arrays in zip(*loops)))
+
+    for k, loop in enumerate(loops):
+        for name, values in loop_figures(*loop).items():
+            np.testing.assert_allclose(stack[name][k], values[0])
+
+
+def test_analyze_dataframes_of_files_with_different_lengths():
+    dataframes = []
+    for n in (2001, 1001):
+        h_up, m_up, h_dw, m_dw = tanh_loop(n=n)
+        dataframes.append(pd.DataFrame({"Hu": h_up, "Mu": m_up, "Hd": h_dw, "Md": m_dw}))
+
+    table = analyze_dataframes(dataframes, [(i, ("Hu", "Mu", "Hd", "Md")) for i in (1, 0)])
+
+    assert list(table["file"]) == [2, 1]
+    np.testing.assert_allclose(table["Hc"], 30.0, rtol=1e-3)
@@ -0,0 +1,127 @@
+"""
+Tests of the autosave: the session is recovered from the snapshot and
+the journals, also when the last entry was cut by a crash.
+"""
+import os
+import threading
+from types import SimpleNamespace
+
+import numpy as np
+import pandas as pd
+import pytest
+
+from hyloa.data.labview import LabviewHeader
+from hyloa.data.provenance import set_source_columns
+from hyloa.data.autosave import SessionJournal, recover, journal_path, has_autosave
+
+
+def make_app(n_files=2, n_points=50):
+    ''' The parts of MainApp saved by the autosave
+    '''
+    dataframes, header_lines = [], []
+    for i in range(n_files):
+        df = pd.DataFrame({f"f{i}_H": np.linspace(-1, 1, n_points),
+                           f"f{i}_M": np.tanh(np.linspace(-3, 3, n_points))})
+        df.attrs["filename"] = f"loop{i}.txt"
+        set_source_columns(df, ["H", "M"])
+        dataframes.append(df)
+        header_lines.append(LabviewHeader(["H", "M"]))
+
+    return SimpleNamespace(dataframes=dataframes, header_lines=header_lines, logger_path=None,
+                           fit_results={}, fit_table=pd.DataFrame(), number_plots=0, plot_widgets={})
+
+
+def change(journal, df, column, values):
+    ''' Replace a column, as hyloa.data.processing.update_columns does
+    '''
+    df[column] = values
+    df.attrs["modified"] = True
+    journal.mark(df, [column])
+
+
+@pytest.fixture
+def journal(tmp_path):
+    journal = SessionJournal(str(tmp_path / "session.autosave"))
+    yield journal
+    journal.close()
+
+
+def test_recover_replays_the_journal(journal):
+    app = make_app()
+    journal.start(app)
+    journal.wait()
+
+    df = app.dataframes[1]
+    change(journal, df, "f1_M", -df["f1_M"].to_numpy())
+    journal.flush(app)
+
+    session = recover(journal.base_path)
+    assert len(session["dataframes"]) == 2
+    np.testing.assert_array_equal(session["dataframes"][1]["f1_M"], df["f1_M"])
+    assert session["dataframes"][1].attrs["modified"]
+
+
+def test_recover_ignores_a_truncated_entry(journal):
+    app = make_app()
+    journal.start(app)
+    journal.wait()
+
+    df = app.dataframes[0]
+    change(journal, df, "f0_M", df["f0_M"].to_numpy() + 1)
+    journal.flush(app)
+    expected = df["f0_M"].to_numpy().copy()
+
+    change(journal, df, "f0_M", df["f0_M"].to_numpy() * 10)
+    journal.flush(app)
+
+    # A crash in the middle of the last write
+    path = journal_path(journal.base_path, journal.generation)
+    with open(path, "r+b") as f:
+        f.truncate(os.path.getsize(path) - 7)
+
+    session = recover(journal.base_path)
+    np.testing.assert_array_equal(session["dataframes"][0]["f0_M"], expected)
+
+
+def test_recover_while_a_snapshot_is_written(journal):
+    app = make_app()
+    journal.start(app)
+    journal.wait()
+
+    # Compact and, before the new snapshot is in place, write to the next journal
+    df = app.dataframes[0]
+    change(journal, df, "f0_H", df["f0_H"].to_numpy() * 2)
+    journal.flush(app)
+    journal.compact(app)
+    change(journal, df, "f0_M", df["f0_M"].to_numpy() - 1)
+    journal.flush(app)
+
+    for _ in range(2):
+        session = recover(journal.base_path)
+        np.testing.assert_array_equal(session["dataframes"][0]["f0_H"], df["f0_H"])
+        np.testing.assert_array_equal(session["dataframes"][0]["f0_M"], df["f0_M"])
+        journal.wait()
+
+
+def test_snapshot_is_not_changed_by_later_fits(journal):
+    app = make_app()
+    app.fit_results = {"Hc": 30.0}
+    journal.start(app)
+    journal.wait()
+
+    # The snapshot is written only after the fit results have changed
+    gate = threading.Event()
+    journal.executor.submit(gate.wait)
+    journal.compact(app)
+    app.fit_results["Hc"] = 50.0
+    app.fit_results.update({f"p{k}": k for k in range(100)})
+    gate.set()
+    journal.wait()
+
+    assert recover(journal.base_path)["fit_results"] == {"Hc": 30.0}
+
+
+def test_close_removes_the_files(journal):
+    journal.start(make_app())
+    journal.close()
+    assert not has_autosave(journal.base_path)
@@ -0,0 +1,54 @@
+"""
+Tests of the headless batch processing, hyloa.batch.
+"""
+import json
+
+import numpy as np
+
+from hyloa.batch import run_pipeline
+from hyloa.data.core import close_loop
+from hyloa.data.labview import LabviewHeader, write_labview_file, read_labview_file
+from hyloa.data.pipeline import Pipeline
+from hyloa.utils.queue_logging import setup_logging, stop_logging
+
+
+COLUMNS = ["FieldUp", "UpRot", "UpEllipt", "IzeroUp", "FieldDw", "DwRot", "DwEllipt", "IzeroDw"]
+
+
+def write_loop(path, n=100):
+    ''' A LabVIEW file with an open loop
+    '''
+    h    = np.linspace(-1, 1, n)
+    ones = np.ones(n)
+    data = np.column_stack([h, np.tanh(h / 0.2) + 0.5, ones, ones,
+                            h[::-1], np.tanh(h[::-1] / 0.2), ones, ones])
+    write_labview_file(str(path), LabviewHeader(COLUMNS, ["", "", ""]), data)
+
+
+def test_records_of_the_workers_are_logged(tmp_path):
+    paths = [tmp_path / f"loop{i}.txt" for i in range(2)]
+    for path in paths:
+        write_loop(path)
+    json_log = tmp_path / "log.jsonl"
+
+    pipeline = Pipeline([{"op": "code", "columns": ["UpRot"]},
+                         {"op": "close", "columns": ["UpRot", "DwRot"]}])
+    setup_logging(str(tmp_path / "log.txt"), json_file=str(json_log))
+    try:
+        failed = run_pipeline([str(p) for p in paths], str(tmp_path / "out"), pipeline, jobs=2)
+    finally:
+        stop_logging()
+
+    assert failed == {}
+    records = [json.loads(line) for line in json_log.read_text(encoding="utf-8").splitlines()]
+    warnings = [r for r in records if r["name"] == "hyloa.data.pipeline" and r["level"] == "WARNING"]
+    assert len(warnings) == len(paths)
+
+    # The loop has been closed
+    _, raw       = read_labview_file(str(paths[0]))
+    header, data = read_labview_file(str(tmp_path / "out" / "loop0.txt"))
+    up, dw       = (COLUMNS.index(c) for c in ("UpRot", "DwRot"))
+    expected     = close_loop(raw[:, up], raw[:, dw])
+    assert header.columns == COLUMNS
+    np.testing.assert_allclose(data[:, up], expected[0], rtol=1e-6, atol=1e-6)
+    np.testing.assert_allclose(data[:, dw], expected[1], rtol=1e-6, atol=1e-6)
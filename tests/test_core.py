@@ -0,0 +1,73 @@
+"""
+Tests of the pure NumPy operations of hyloa.data.core.
+"""
+import numpy as np
+import pandas as pd
+
+from hyloa.data.core import close_loop, normalize_loop, normalize_dataframes
+
+
+def open_loop(n=200, drift=0.3):
+    ''' A tanh loop whose decreasing branch ends far from the increasing one
+    '''
+    h  = np.linspace(-1, 1, n)
+    up = np.tanh((h - 0.2) / 0.1)
+    dw = np.tanh((h + 0.2) / 0.1) + drift * np.linspace(0, 1, n)
+    return up, dw
+
+
+def test_close_loop_joins_the_dominant_end():
+    up, dw = open_loop()
+    new_up, new_dw = close_loop(up, dw)
+
+    # The misalignment was at the end of the branches, the start is untouched
+    assert np.isclose(new_up[-1], new_dw[-1])
+    assert np.isclose(new_up[0], up[0]) and np.isclose(new_dw[0], dw[0])
+
+
+def test_close_loop_of_a_stack_is_the_same_as_one_at_a_time():
+    loops = [open_loop(drift=d) for d in (0.3, -0.2, 0.0)]
+    up = np.array([u for u, _ in loops])
+    dw = np.array([d for _, d in loops])
+
+    stack_up, stack_dw = close_loop(up, dw)
+    for k, (u, d) in enumerate(loops):
+        one_up, one_dw = close_loop(u, d)
+        np.testing.assert_allclose(stack_up[k], one_up)
+        np.testing.assert_allclose(stack_dw[k], one_dw)
+
+
+def test_close_loop_does_not_modify_the_input():
+    up, dw = open_loop()
+    old_up, old_dw = up.copy(), dw.copy()
+    close_loop(up, dw)
+    np.testing.assert_array_equal(up, old_up)
+    np.testing.assert_array_equal(dw, old_dw)
+
+
+def test_normalized_loop_saturates_at_one():
+    up, dw = open_loop(drift=0.0)
+    up, dw = normalize_loop(3 * up + 5, 3 * dw + 5)
+
+    assert np.isclose(abs(up[:5].mean()), 1, atol=1e-3)
+    assert np.isclose(abs(up[-5:].mean()), 1, atol=1e-3)
+    assert np.isclose(up[-5:].mean() + up[:5].mean(), 0, atol=1e-3)
+
+
+def test_normalize_dataframes_matches_normalize_loop():
+    up, dw = open_loop(drift=0.0)
+    df = pd.DataFrame({"up": 2 * up - 1, "dw": 2 * dw - 1})
+
+    result, = normalize_dataframes([df], [("up", "dw")])
+    expected_up, expected_dw = normalize_loop(df["up"].to_numpy(), df["dw"].to_numpy())
+    np.testing.assert_allclose(result["up"], expected_up)
+    np.testing.assert_allclose(result["dw"], expected_dw)
+
+
+def test_normalize_dataframes_with_no_pairs_for_the_first_file():
+    up, dw = open_loop(drift=0.0)
+    dfs = [pd.DataFrame({"up": up, "dw": dw}) for _ in range(2)]
+
+    result = normalize_dataframes(dfs, [[], [("up", "dw")]])
+    assert result[0] == {}
+    assert set(result[1]) == {"up", "dw"}
@@ -0,0 +1,124 @@
+"""
+Tests of the fit functions, hyloa.data.fitting: checks of the expressions,
+cache of the compiled models and library of the models of the loops.
+"""
+import numpy as np
+import pytest
+
+from hyloa.data.fitting import (
+    validate_expression, get_model, compile_model, fit_columns,
+    MODEL_LIBRARY, MODEL_CACHE_SIZE
+)
+
+
+# Parameters of the library models used to generate the data
+TRUE_PARAMS = {
+    "tanh"           : [2.0, 30.0, 15.0, 0.3],
+    "Langevin"       : [2.0, 30.0, 8.0, 0.3],
+    "Brillouin"      : [2.0, 30.0, 12.0, 1.5, 0.3],
+    "two-phase tanh" : [1.2, -20.0, 10.0, 0.8, 60.0, 15.0, 0.3],
+}
+
+#==============================================================================================#
+# Expressions written by the user                                                              #
+#==============================================================================================#
+
+@pytest.mark.parametrize("names", [["x"], ["np"], ["lambda"], ["1a"], ["a", "a"]])
+def test_invalid_parameter_names(names):
+    with pytest.raises(ValueError):
+        validate_expression("x", names)
+
+
+@pytest.mark.parametrize("expression", [
+    "a*x +",                        # syntax
+    "lambda: a",                    # construct
+    "x[0]",                         # construct
+    "os.system('ls')",              # unknown name
+    "__import__('os')",             # unknown name
+    "np.__class__",                 # private attribute
+    "np.exp(x)._data",              # private attribute
+])
+def test_invalid_expressions(expression):
+    with pytest.raises(ValueError):
+        validate_expression(expression, ["a"])
+
+
+def test_parameters_can_shadow_library_names():
+    model = get_model("gamma * np.exp(-x / beta) + erf(x)", ["gamma", "beta"])
+    x = np.linspace(0, 1, 5)
+    np.testing.assert_allclose(model.func(x, 2.0, 3.0), 2.0 * np.exp(-x / 3.0) + model.func(x, 0.0, 3.0))
+
+
+def test_compiled_models_are_cached():
+    compile_model.cache_clear()
+    first  = get_model("a * x + b", ["a", "b"])
+    second = get_model("  a * x + b ", ("a", "b"))
+    other  = get_model("a * x + b", ["b", "a"])
+
+    assert first is second and other is not first
+    assert compile_model.cache_info().hits == 1
+    assert compile_model.cache_info().maxsize == MODEL_CACHE_SIZE
+
+
+def test_errors_are_not_cached():
+    compile_model.cache_clear()
+    for _ in range(2):
+        with pytest.raises(ValueError):
+            get_model("a * y", ["a"])
+    assert compile_model.cache_info().currsize == 0
+
+
+def test_library_models_check_their_parameters():
+    assert get_model("tanh", ["Ms", "Hc", "w", "c"]) is MODEL_LIBRARY["tanh"]
+    with pytest.raises(ValueError):
+        get_model("tanh", ["a", "b", "c", "d"])
+
+#==============================================================================================#
+# Library of models                                                                            #
+#==============================================================================================#
+
+@pytest.mark.parametrize("name", list(MODEL_LIBRARY))
+def test_jacobian_matches_central_differences(name):
+    model  = MODEL_LIBRARY[name]
+    params = np.array(TRUE_PARAMS[name])
+    # Points near the center too, where the Langevin function uses its series
+    x      = np.concatenate([np.linspace(-200, 200, 101), params[1] + np.array([-1e-3, 0.0, 1e-3])])
+
+    numeric = np.empty((len(x), len(params)))
+    for k in range(len(params)):
+        h = 1e-6 * max(abs(params[k]), 1.0)
+        up, dw = params.copy(), params.copy()
+        up[k] += h
+        dw[k] -= h
+        numeric[:, k] = (model.func(x, *up) - model.func(x, *dw)) / (2 * h)
+
+    np.testing.assert_allclose(model.jac(x, *params), numeric, atol=1e-6)
+
+
+@pytest.mark.parametrize("name", list(MODEL_LIBRARY))
+def test_fit_with_estimated_initial_parameters(name):
+    model = MODEL_LIBRARY[name]
+    rng   = np.random.default_rng(3)
+    x     = np.linspace(-200, 200, 400)
+    y     = model.func(x, *TRUE_PARAMS[name]) + 0.01 * rng.standard_normal(len(x))
+
+    row = fit_columns(name, model.param_names, x, y, None)
+
+    assert row["success"], row["message"]
+    fitted = model.func(x, *[row[p] for p in model.param_names])
+    assert np.sqrt(np.mean((fitted - y)**2)) < 0.02
+    assert np.isclose(row["c"], TRUE_PARAMS[name][-1], atol=0.05)
+
+
+def test_failed_fits_are_reported():
+    x = np.linspace(-1, 1, 50)
+
+    empty = fit_columns("tanh", ["Ms", "Hc", "w", "c"], x[:0], x[:0], None)
+    assert not empty["success"] and np.isnan(empty["Ms"])
+
+    # An expression of the user has no estimate of the initial parameters
+    no_guess = fit_columns("a * x", ["a"], x, 2 * x, None)
+    assert not no_guess["success"]
+
+    wrong_p0 = fit_columns("a * x + b", ["a", "b"], x, 2 * x, [1.0])
+    assert not wrong_p0["success"]
@@ -0,0 +1,102 @@
+"""
+Tests of the undo and redo of the operations, hyloa.data.history.
+"""
+import numpy as np
+import pandas as pd
+import pytest
+
+from hyloa.data.history import History, take_snapshot, snapshot_size
+
+
+def make_df(n=100):
+    df = pd.DataFrame({"H": np.linspace(-1, 1, n), "M": np.tanh(np.linspace(-3, 3, n))})
+    df.attrs["modified"]   = False
+    df.attrs["provenance"] = []
+    return df
+
+
+def apply(history, df, new_columns, label, merge=False):
+    ''' Change some columns recording the change, as hyloa.data.processing.update_columns
+    '''
+    before = take_snapshot(df, new_columns, label)
+    for col, values in new_columns.items():
+        df[col] = values
+    df.attrs["modified"] = True
+    df.attrs["provenance"].append({"op": label, "columns": list(new_columns)})
+    history.push(df, before, take_snapshot(df, new_columns, label), merge=merge)
+
+
+def test_undo_redo_round_trip():
+    history = History()
+    df      = make_df()
+    m0      = df["M"].to_numpy().copy()
+
+    apply(history, df, {"M": -df["M"].to_numpy()}, "invert")
+    apply(history, df, {"M": df["M"].to_numpy() * 2, "M2": df["M"].to_numpy() ** 2}, "scale")
+    m2, m2_sq = df["M"].to_numpy().copy(), df["M2"].to_numpy().copy()
+
+    assert history.undo().label == "scale"
+    assert "M2" not in df.columns
+    np.testing.assert_array_equal(df["M"], -m0)
+
+    assert history.undo().label == "invert"
+    np.testing.assert_array_equal(df["M"], m0)
+    assert not df.attrs["modified"] and df.attrs["provenance"] == []
+    assert history.undo() is None
+
+    history.redo()
+    history.redo()
+    np.testing.assert_array_equal(df["M"], m2)
+    np.testing.assert_array_equal(df["M2"], m2_sq)
+    assert [s["op"] for s in df.attrs["provenance"]] == ["invert", "scale"]
+    assert not history.can_redo()
+
+
+def test_merged_change_of_many_files_is_undone_together():
+    history = History()
+    dfs     = [make_df(), make_df(50)]
+    old     = [df["M"].to_numpy().copy() for df in dfs]
+
+    for k, df in enumerate(dfs):
+        apply(history, df, {"M": df["M"].to_numpy() + 1}, "norm", merge=k > 0)
+
+    assert len(history.undo_stack) == 1
+    history.undo()
+    for df, m in zip(dfs, old):
+        np.testing.assert_array_equal(df["M"], m)
+
+
+def test_a_new_change_empties_the_redo_stack():
+    history = History()
+    df      = make_df()
+    apply(history, df, {"M": df["M"].to_numpy() + 1}, "a")
+    history.undo()
+    apply(history, df, {"H": df["H"].to_numpy() * 2}, "b")
+
+    assert not history.can_redo()
+
+
+def test_snapshots_are_read_only():
+    df       = make_df()
+    snapshot = take_snapshot(df, ["M"])
+
+    with pytest.raises(ValueError):
+        snapshot["columns"]["M"][0] = 1.0
+
+
+def test_oldest_changes_are_forgotten_over_budget():
+    df      = make_df(1000)
+    history = History(budget=3 * 1000 * 8)
+    for k in range(10):
+        apply(history, df, {"M": df["M"].to_numpy() + k}, f"step {k}")
+
+    assert history.size() <= history.budget
+    assert len(history.undo_stack) == 3
+    assert history.undo_stack[-1].label == "step 9"
+
+
+def test_size_counts_the_owner_of_a_view():
+    block    = np.zeros((4, 1000))
+    snapshot = {"columns": {"a": block[0], "b": block[1], "c": None}}
+
+    assert snapshot_size(snapshot) == block.nbytes
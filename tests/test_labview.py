@@ -0,0 +1,62 @@
+"""
+Tests of the LabVIEW data files, hyloa.data.labview: what is written
+by write_labview_file is read back by read_labview_file.
+"""
+import numpy as np
+import pytest
+
+from hyloa.data.labview import LabviewHeader, read_labview_file, write_labview_file, parse_metadata
+
+
+COLUMNS = ["FieldUp", "UpRot", "UpEllipt", "IzeroUp", "FieldDw", "DwRot", "DwEllipt", "IzeroDw"]
+LINES   = [
+    "MaxV 30.00\tV_bias 0.00\tSteps 180\tLoops 10",
+    "Sen1(mV) 5.0E-1\tSen2(mV) 2.0E-2\tTC(ms) 10\tScaling 0.0E+0\tThetaPol 5.0\tPolarization s",
+    "Rot Ell Izero Parameters3.478239E-3\t-1.249859E-2\t3.036712E-1",
+]
+
+
+def make_header():
+    return LabviewHeader(list(COLUMNS), list(LINES), parse_metadata(LINES))
+
+
+@pytest.mark.parametrize("chunk_size", [7, 10000])
+def test_round_trip(tmp_path, chunk_size):
+    rng  = np.random.default_rng(0)
+    data = rng.standard_normal((103, 8)) * 10.0 ** rng.integers(-5, 5, (103, 8))
+    path = str(tmp_path / "loop.txt")
+
+    write_labview_file(path, make_header(), data, chunk_size=chunk_size)
+    header, read = read_labview_file(path)
+
+    assert header.columns == COLUMNS
+    assert header.lines == LINES
+    assert header.fields["MaxV"] == 30.0 and header.fields["Steps"] == 180
+    assert header.fields["Polarization"] == "s"
+    assert header.fields["Rot Ell Izero Parameters"] == [3.478239e-3, -1.249859e-2, 3.036712e-1]
+
+    assert read.shape == data.shape and read.dtype == np.float64
+    # "%.6E" keeps 7 significant digits
+    np.testing.assert_allclose(read, data, rtol=5e-7, atol=0)
+
+
+def test_four_columns_are_expanded(tmp_path):
+    data = np.arange(20, dtype=float).reshape(5, 4)
+    path = str(tmp_path / "loop.txt")
+
+    write_labview_file(path, make_header(), data)
+    _, read = read_labview_file(path)
+
+    np.testing.assert_array_equal(read[:, ::2], data)
+    np.testing.assert_array_equal(read[:, 1::2], 0)
+
+
+def test_custom_format_and_empty_file(tmp_path):
+    path = str(tmp_path / "loop.txt")
+
+    write_labview_file(path, make_header(), np.full((3, 8), 1 / 3), fmt="%.3f")
+    np.testing.assert_array_equal(read_labview_file(path)[1], 0.333)
+
+    write_labview_file(path, make_header(), np.empty((0, 8)))
+    header, read = read_labview_file(path)
+    assert header.lines == LINES and read.shape == (0, 8)
@@ -0,0 +1,76 @@
+"""
+Tests of the level of detail of the plots, hyloa.data.core.decimate_indices.
+"""
+import numpy as np
+
+from hyloa.data.core import decimate_indices
+
+
+def dense_loop(n=100_000, noise=0.01, seed=0):
+    ''' Increasing branch of a noisy loop, sampled much denser than the screen
+    '''
+    rng = np.random.default_rng(seed)
+    x   = np.linspace(-1000, 1000, n)
+    y   = np.tanh((x - 37) / 150) + noise * rng.standard_normal(n)
+    return x, y
+
+
+def test_few_points_are_all_kept():
+    x, y = dense_loop(n=300)
+    np.testing.assert_array_equal(decimate_indices(x, y, n_bins=100), np.arange(300))
+
+
+def test_decimation_bounds_the_points():
+    x, y = dense_loop()
+    idx  = decimate_indices(x, y, n_bins=200)
+
+    assert len(idx) < len(x) // 10
+    assert np.all(np.diff(idx) > 0)
+    assert idx[0] == 0 and idx[-1] == len(x) - 1
+
+
+def test_extrema_are_kept():
+    x, y = dense_loop()
+    idx  = decimate_indices(x, y, n_bins=200)
+
+    for k in (np.argmin(y), np.argmax(y), np.argmin(x), np.argmax(x)):
+        assert k in idx
+
+
+def crossings(v):
+    s = np.signbit(v)
+    return np.flatnonzero(s[1:] != s[:-1])
+
+
+def test_zero_crossings_are_kept():
+    x, y = dense_loop(noise=0.0)
+    idx  = decimate_indices(x, y, n_bins=200)
+
+    for v in (x, y):
+        crossing = crossings(v)
+        assert len(crossing) == 1
+        assert np.isin(crossing, idx).all() and np.isin(crossing + 1, idx).all()
+
+
+def test_noisy_crossings_are_limited():
+    # Around the coercive field the noise makes the sign change at almost every point
+    x, y   = dense_loop(noise=0.5)
+    n_bins = 200
+    idx    = decimate_indices(x, y, n_bins=n_bins)
+
+    assert len(crossings(y)) > len(x) // 20
+    # At most: 2 ends, 4 extrema, 2 points of the step, 4 points of the crossings of x and y
+    assert len(idx) <= 16 * n_bins
+    # The first and the last crossing are still there
+    crossing = crossings(y)
+    assert {crossing[0], crossing[0] + 1, crossing[-1], crossing[-1] + 1} <= set(idx)
+
+
+def test_visible_range_keeps_one_neighbour_outside():
+    x, y = dense_loop()
+    lo, hi = -100.0, 100.0
+    idx = decimate_indices(x, y, n_bins=50, x_range=(hi, lo))
+
+    inside = np.flatnonzero((x >= lo) & (x <= hi))
+    assert idx[0] == inside[0] - 1 and idx[-1] == inside[-1] + 1
+    assert np.all((x[idx[1:-1]] >= lo) & (x[idx[1:-1]] <= hi))
@@ -0,0 +1,82 @@
+"""
+Tests of the fused pipeline, hyloa.data.pipeline: the result must be the
+same as applying the operations of hyloa.data.core one after the other.
+"""
+import numpy as np
+import pytest
+
+from hyloa.data.core import close_loop, normalize_loop, invert
+from hyloa.data.fitting import fit_columns
+from hyloa.data.pipeline import Pipeline
+from hyloa.data.provenance import save_steps
+
+
+def raw_columns(n=400, seed=1):
+    ''' Columns of a file, with an open and shifted loop
+    '''
+    rng = np.random.default_rng(seed)
+    h   = np.linspace(-300, 300, n)
+    up  = 4 * np.tanh((h - 40) / 30) + 1.5 + 0.02 * rng.standard_normal(n)
+    dw  = 4 * np.tanh((h + 40) / 30) + 1.5 + np.linspace(0, 0.8, n)
+    return {"FieldUp": h, "FieldDw": h[::-1].copy(), "UpRot": up, "DwRot": dw}
+
+
+def test_fused_pipeline_matches_the_sequential_operations():
+    columns = raw_columns()
+    up, dw  = close_loop(columns["UpRot"], columns["DwRot"])
+    up, dw  = normalize_loop(up, dw, window=7)
+    up, dw  = invert(up), invert(dw)
+
+    pipeline = Pipeline([
+        {"op": "close",  "columns": ["UpRot", "DwRot"]},
+        {"op": "norm",   "columns": ["UpRot", "DwRot"], "window": 7},
+        {"op": "invert", "columns": ["UpRot", "DwRot"]},
+    ])
+    data = dict(columns)
+    assert pipeline.run(data) == []
+
+    np.testing.assert_allclose(data["UpRot"], up, rtol=1e-12, atol=1e-12)
+    np.testing.assert_allclose(data["DwRot"], dw, rtol=1e-12, atol=1e-12)
+    np.testing.assert_array_equal(data["FieldUp"], columns["FieldUp"])
+
+
+def test_run_does_not_modify_the_given_arrays():
+    columns = raw_columns()
+    old     = {name: values.copy() for name, values in columns.items()}
+
+    Pipeline.from_names(["close", "norm"], ["UpRot", "DwRot"]).run(dict(columns))
+    for name in columns:
+        np.testing.assert_array_equal(columns[name], old[name])
+
+
+def test_fit_sees_the_transformed_data():
+    columns  = raw_columns()
+    pipeline = Pipeline([
+        {"op": "norm", "columns": ["UpRot", "DwRot"]},
+        {"op": "fit",  "columns": ["FieldUp", "UpRot"], "expression": "a*np.tanh((x-b)/c)",
+         "param_names": ["a", "b", "c"], "p0": [1, 0, 10], "x_range": [-300, 300]},
+    ])
+    row, = pipeline.run(dict(columns))
+
+    up, _    = normalize_loop(columns["UpRot"], columns["DwRot"])
+    expected = fit_columns("a*np.tanh((x-b)/c)", ["a", "b", "c"], columns["FieldUp"], up, [1, 0, 10])
+
+    assert row["success"] and row["x"] == "FieldUp" and row["y"] == "UpRot"
+    for name in ("a", "b", "c"):
+        np.testing.assert_allclose(row[name], expected[name], rtol=1e-6)
+
+
+def test_steps_saved_by_provenance_are_loaded(tmp_path):
+    steps = [{"op": "close", "columns": ["UpRot", "DwRot"]},
+             {"op": "invert", "columns": ["FieldUp"]}]
+    path  = str(tmp_path / "steps.json")
+    save_steps(path, steps)
+
+    assert Pipeline.load(path).to_steps() == steps
+
+
+def test_invalid_stages_are_rejected():
+    with pytest.raises(ValueError):
+        Pipeline([{"op": "smooth", "columns": ["UpRot"]}])
+    with pytest.raises(ValueError):
+        Pipeline([{"op": "norm", "columns": ["UpRot"]}])
@@ -0,0 +1,70 @@
+"""
+Tests of the columnar session archives, hyloa.data.session.
+"""
+import numpy as np
+import pandas as pd
+import pytest
+
+from hyloa.data.labview import LabviewHeader
+from hyloa.data.provenance import set_source_columns
+from hyloa.data.session import write_session_archive, read_session_archive, is_mapped
+
+
+def make_session(lengths=(0, 200)):
+    ''' Session data with one file for each length, an empty file has empty columns
+    '''
+    dataframes, header_lines = [], []
+    for i, n in enumerate(lengths):
+        df = pd.DataFrame({f"f{i}_H": np.linspace(-1, 1, n), f"f{i}_M": np.sin(np.arange(n, dtype=float))})
+        df.attrs["filename"]   = f"loop{i}.txt"
+        df.attrs["modified"]   = bool(i % 2)
+        set_source_columns(df, ["H", "M"])
+        df.attrs["provenance"] = [{"op": "invert", "columns": ["M"]}] if i else []
+        dataframes.append(df)
+        header_lines.append(LabviewHeader(["H", "M"], ["MaxV 30.00\tSteps 180", "Polarization s"]))
+
+    return {"dataframes": dataframes, "header_lines": header_lines,
+            "fit_results": {"a": 1.5}, "number_plots": 2}
+
+
+@pytest.mark.parametrize("compress", [False, True])
+@pytest.mark.parametrize("mmap", [True, False])
+def test_round_trip(tmp_path, compress, mmap):
+    path    = str(tmp_path / "session.hyl")
+    session = make_session()
+    write_session_archive(path, session, compress=compress)
+    loaded  = read_session_archive(path, mmap=mmap)
+
+    assert loaded["fit_results"] == {"a": 1.5} and loaded["number_plots"] == 2
+    assert len(loaded["dataframes"]) == 2
+    for df, new in zip(session["dataframes"], loaded["dataframes"]):
+        assert list(new.columns) == list(df.columns)
+        for col in df.columns:
+            np.testing.assert_array_equal(new[col], df[col])
+        for key in ("filename", "modified", "provenance", "source_columns"):
+            assert new.attrs[key] == df.attrs[key]
+
+    for header in loaded["header_lines"]:
+        assert header.lines == ["MaxV 30.00\tSteps 180", "Polarization s"]
+        assert header.fields == {"MaxV": 30.0, "Steps": 180, "Polarization": "s"}
+
+
+def test_mapped_and_read_members_together(tmp_path):
+    # The empty columns cannot be mapped and are read, the others are mapped
+    path = str(tmp_path / "session.hyl")
+    write_session_archive(path, make_session((0, 200, 0, 50)))
+    loaded = read_session_archive(path)
+
+    for df in loaded["dataframes"]:
+        for col in df.columns:
+            values = df[col].to_numpy()
+            assert is_mapped(values, path) == (len(df) > 0)
+            assert not values.flags.writeable or len(df) == 0
+
+
+def test_compressed_archives_are_not_mapped(tmp_path):
+    path = str(tmp_path / "session.hyl")
+    write_session_archive(path, make_session(), compress=True)
+    df = read_session_archive(path)["dataframes"][1]
+
+    assert not is_mapped(df["f1_M"].to_numpy(), path)